@@ -17,9 +17,12 @@ from apps.shark_studio.web.utils.tmp_configs import (
 
 
 def imports():
-    import torch  # noqa: F401
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+
+    if not cmd_opts.defer_imports:
+        import torch  # noqa: F401
 
-    startup_timer.record("import torch")
+        startup_timer.record("import torch")
     warnings.filterwarnings(
         action="ignore", category=DeprecationWarning, module="torch"
     )
@@ -32,18 +35,32 @@ def imports():
 
     import apps.shark_studio.web.utils.globals as global_obj
 
-    global_obj._init()
-    startup_timer.record("initialize globals")
+    with startup_timer.subcategory("initialize globals"):
+        global_obj._init()
+
+    if not cmd_opts.defer_imports:
+        from apps.shark_studio.modules import (
+            img_processing,
+        )  # noqa: F401
 
-    from apps.shark_studio.modules import (
-        img_processing,
-    )  # noqa: F401
+        startup_timer.record("other imports")
+
+
+def preload(module_names):
+    """
+    With --defer_imports, starts importing the given model libraries in the
+    background once the server is up, so the first request finds them loaded.
+    """
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+    from apps.shark_studio.modules.lazy_modules import preload_modules
 
-    startup_timer.record("other imports")
+    if cmd_opts.defer_imports:
+        preload_modules(module_names)
 
 
 def initialize():
     configure_sigint_handler()
+    configure_tracing()
     # Setup to use shark_tmp for gradio's temporary image files and clear any
     # existing temporary images there if they exist. Then we can import gradio.
     # It has to be in this order or gradio ignores what we've set up.
@@ -113,6 +130,18 @@ def configure_cors_middleware(app):
     app.add_middleware(CORSMiddleware, **cors_options)
 
 
+def configure_tracing():
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+
+    if not cmd_opts.trace_file:
+        return
+    # shark.iree_utils.trace reads the environment when it is first imported
+    # and again at exit, when the trace is written.
+    os.environ["SHARK_TRACE_FILE"] = os.path.abspath(cmd_opts.trace_file)
+    if "shark.iree_utils.trace" in sys.modules:
+        sys.modules["shark.iree_utils.trace"].tracer.enable()
+
+
 def configure_sigint_handler():
     # make the program just exit at ctrl+c without waiting for anything
     def sigint_handler(sig, frame):
@@ -1,14 +1,19 @@
 from turbine_models.custom_models import stateless_llama
-from turbine_models.model_runner import vmfbRunner
 from turbine_models.gen_external_params.gen_external_params import gen_external_params
 import time
-from shark.iree_utils.compile_utils import compile_module_to_flatbuffer
+from shark.iree_utils.compile_utils import (
+    compile_module_to_flatbuffer,
+    load_vmfb_using_mmap,
+)
 from apps.shark_studio.web.utils.file_utils import (
     get_resource_path,
     get_checkpoints_path,
 )
+from apps.shark_studio.web.utils.residency import make_key, get_artifact_bytes
 from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+from apps.shark_studio.modules.llm_metrics import LLMRequestMetrics, llm_metrics
 from apps.shark_studio.api.utils import parse_device
+from apps.shark_studio.api.llm_models import llm_model_map
 from urllib.request import urlopen
 import iree.runtime as ireert
 from itertools import chain
@@ -17,33 +22,6 @@ import os
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 
-llm_model_map = {
-    "meta-llama/Llama-2-7b-chat-hf": {
-        "initializer": stateless_llama.export_transformer_model,
-        "hf_model_name": "meta-llama/Llama-2-7b-chat-hf",
-        "compile_flags": ["--iree-opt-const-expr-hoisting=False"],
-        "stop_token": 2,
-        "max_tokens": 4096,
-        "system_prompt": """<s>[INST] <<SYS>>Be concise. You are a helpful, respectful and honest assistant. If a question does not make any sense, or is not factually coherent, explain why instead of answering something not correct. If you don't know the answer to a question, please don't share false information. <</SYS>>""",
-    },
-    "Trelis/Llama-2-7b-chat-hf-function-calling-v2": {
-        "initializer": stateless_llama.export_transformer_model,
-        "hf_model_name": "Trelis/Llama-2-7b-chat-hf-function-calling-v2",
-        "compile_flags": ["--iree-opt-const-expr-hoisting=False"],
-        "stop_token": 2,
-        "max_tokens": 4096,
-        "system_prompt": """<s>[INST] <<SYS>>Be concise. You are a helpful, respectful and honest assistant. If a question does not make any sense, or is not factually coherent, explain why instead of answering something not correct. If you don't know the answer to a question, please don't share false information. <</SYS>>""",
-    },
-    "TinyPixel/small-llama2": {
-        "initializer": stateless_llama.export_transformer_model,
-        "hf_model_name": "TinyPixel/small-llama2",
-        "compile_flags": ["--iree-opt-const-expr-hoisting=True"],
-        "stop_token": 2,
-        "max_tokens": 1024,
-        "system_prompt": """<s>[INST] <<SYS>>Be concise. You are a helpful, respectful and honest assistant. If a question does not make any sense, or is not factually coherent, explain why instead of answering something not correct. If you don't know the answer to a question, please don't share false information. <</SYS>>""",
-    },
-}
-
 B_INST, E_INST = "[INST]", "[/INST]"
 B_SYS, E_SYS = "<s>", "</s>"
 
@@ -52,6 +30,14 @@ Be concise. You are a helpful, respectful and honest assistant. If a question do
 """
 
 
+# Entry points speculative decoding needs on top of the stateless llama ones.
+# run_verify takes [1, k + 1] tokens (the last accepted token and k
+# proposals), appends them to the KV cache and returns the greedy next token
+# after each of them. rollback_kvcache drops the last n cache entries.
+SPECULATIVE_TARGET_FUNCTIONS = ["run_verify", "rollback_kvcache"]
+SPECULATIVE_DRAFT_FUNCTIONS = ["rollback_kvcache"]
+
+
 def append_user_prompt(history, input_prompt):
     user_prompt = f"{B_INST} {input_prompt} {E_INST}"
     history += user_prompt
@@ -69,6 +55,8 @@ class LanguageModel:
         external_weights=None,
         use_system_prompt=True,
         streaming_llm=False,
+        draft_model=None,
+        num_draft_tokens=4,
     ):
         _, _, self.triple = parse_device(device)
         self.hf_model_name = llm_model_map[model_name]["hf_model_name"]
@@ -125,6 +113,7 @@ class LanguageModel:
         self.prev_token_len = 0
         self.first_input = True
         self.hf_auth_token = hf_auth_token
+        self.last_metrics = None
         if self.external_weight_file is not None:
             if not os.path.exists(self.external_weight_file):
                 print(
@@ -146,24 +135,14 @@ class LanguageModel:
         if os.path.exists(self.vmfb_name) and (
             external_weights is None or os.path.exists(str(self.external_weight_file))
         ):
-            self.runner = vmfbRunner(
-                device=self.driver,
-                vmfb_path=self.vmfb_name,
-                external_weight_path=self.external_weight_file,
-            )
-            if self.streaming_llm:
-                self.model = self.runner.ctx.modules.streaming_state_update
-            else:
-                self.model = self.runner.ctx.modules.state_update
+            self.load_vmfb()
             self.tokenizer = AutoTokenizer.from_pretrained(
                 self.hf_model_name,
                 use_fast=False,
                 use_auth_token=hf_auth_token,
             )
         elif not os.path.exists(self.tempfile_name):
-            self.torch_ir, self.tokenizer = llm_model_map[self.hf_model_name][
-                "initializer"
-            ](
+            self.torch_ir, self.tokenizer = stateless_llama.export_transformer_model(
                 self.hf_model_name,
                 hf_auth_token,
                 compile_to="torch",
@@ -188,6 +167,42 @@ class LanguageModel:
         # Reserved for running HF torch model as reference.
         self.hf_mod = None
 
+        # Optional small model used to draft tokens for speculative decoding.
+        # It only pays off when one target call can check all proposals, so
+        # it needs a target module exporting a multi-token verify entry point.
+        # The turbine stateless llama export doesn't provide one yet, so this
+        # is experimental and stays off with the shipped models.
+        self.draft = None
+        self.num_draft_tokens = num_draft_tokens
+        self.spec_stats = {"drafted": 0, "accepted": 0, "target_calls": 0}
+        if draft_model and not self.has_functions(*SPECULATIVE_TARGET_FUNCTIONS):
+            print(
+                f"[LOG] {self.hf_model_name} does not export "
+                f"{', '.join(SPECULATIVE_TARGET_FUNCTIONS)}, speculative "
+                "decoding is disabled."
+            )
+        elif draft_model:
+            self.draft = LanguageModel(
+                draft_model,
+                hf_auth_token=hf_auth_token,
+                device=device,
+                quantization="None",
+                use_system_prompt=use_system_prompt,
+                streaming_llm=False,
+            )
+            if self.draft.tokenizer.get_vocab() != self.tokenizer.get_vocab():
+                raise ValueError(
+                    f"Draft model {draft_model} does not share a vocabulary with "
+                    f"{self.hf_model_name} and can't be used for speculative decoding."
+                )
+            if not self.draft.has_functions(*SPECULATIVE_DRAFT_FUNCTIONS):
+                print(
+                    f"[LOG] Draft model {draft_model} does not export "
+                    f"{', '.join(SPECULATIVE_DRAFT_FUNCTIONS)}, speculative "
+                    "decoding is disabled."
+                )
+                self.draft = None
+
     def compile(self) -> None:
         # this comes with keys: "vmfb", "config", and "temp_file_to_unlink".
         # ONLY architecture/api-specific compile-time flags for each backend, if needed.
@@ -226,15 +241,23 @@ class LanguageModel:
             extra_args=flags,
             write_to=self.vmfb_name,
         )
-        self.runner = vmfbRunner(
-            device=self.driver,
-            vmfb_path=self.vmfb_name,
-            external_weight_path=self.external_weight_file,
+        self.load_vmfb()
+
+    def load_vmfb(self):
+        # External weights go through the process-wide parameter archive cache,
+        # so models sharing a weight file map it only once.
+        self.model, self.config, _ = load_vmfb_using_mmap(
+            self.vmfb_name,
+            self.driver,
+            rt_flags=[],
+            external_weight_file=self.external_weight_file,
         )
-        if self.streaming_llm:
-            self.model = self.runner.ctx.modules.streaming_state_update
-        else:
-            self.model = self.runner.ctx.modules.state_update
+
+    def has_functions(self, *names):
+        vm_module = getattr(self.model, "vm_module", None)
+        if vm_module is None:
+            return False
+        return all(name in vm_module.function_names for name in names)
 
     def sanitize_prompt(self, prompt):
         if isinstance(prompt, list):
@@ -249,7 +272,35 @@ class LanguageModel:
         else:
             return f"{B_INST} {prompt} {E_INST}"
 
-    def chat(self, prompt):
+    def artifact_bytes(self):
+        size = get_artifact_bytes([self.vmfb_name, self.external_weight_file])
+        if self.draft is not None:
+            size += self.draft.artifact_bytes()
+        return size
+
+    def to_device(self, tokens):
+        if not isinstance(tokens, torch.Tensor):
+            tokens = torch.tensor([tokens], dtype=torch.int64)
+        return ireert.asdevicearray(self.config.device, tokens)
+
+    def acceptance_rate(self):
+        if self.spec_stats["drafted"] == 0:
+            return 0.0
+        return self.spec_stats["accepted"] / self.spec_stats["drafted"]
+
+    def chat(self, prompt, queued_at=None, load_time=0.0):
+        # Per-request timings end up in self.last_metrics and the process-wide
+        # llm_metrics aggregate, including when the caller stops early.
+        self.last_metrics = LLMRequestMetrics(self.hf_model_name, queued_at, load_time)
+        try:
+            if self.draft is not None:
+                return (yield from self.chat_speculative(prompt))
+            return (yield from self.chat_greedy(prompt))
+        finally:
+            self.last_metrics.finish()
+            llm_metrics.add(self.last_metrics)
+
+    def chat_greedy(self, prompt):
         prompt = self.sanitize_prompt(prompt)
 
         input_tensor = self.tokenizer(prompt, return_tensors="pt").input_ids
@@ -265,10 +316,9 @@ class LanguageModel:
             if self.streaming_llm and self.model["get_seq_step"]() > 600:
                 print("Evicting cache space!")
                 self.model["evict_kvcache_space"]()
+                self.last_metrics.kv_cache_evictions += 1
             token_len = input_tensor.shape[-1]
-            device_inputs = [
-                ireert.asdevicearray(self.runner.config.device, input_tensor)
-            ]
+            device_inputs = [self.to_device(input_tensor)]
             if self.first_input or not self.streaming_llm:
                 st_time = time.time()
                 token = self.model["run_initialize"](*device_inputs)
@@ -280,6 +330,7 @@ class LanguageModel:
                 token = self.model["run_cached_initialize"](*device_inputs)
                 total_time = time.time() - st_time
                 token_len += 1
+            self.last_metrics.record_prefill(input_tensor.shape[-1], total_time)
 
             history.append(format_out(token))
             while (
@@ -290,9 +341,11 @@ class LanguageModel:
                 if self.streaming_llm and self.model["get_seq_step"]() > 600:
                     print("Evicting cache space!")
                     self.model["evict_kvcache_space"]()
+                    self.last_metrics.kv_cache_evictions += 1
                 token = self.model["run_forward"](token)
                 history.append(format_out(token))
                 total_time = time.time() - dec_time
+                self.last_metrics.record_token(total_time)
                 yield self.tokenizer.decode(history), total_time
 
             self.prev_token_len = token_len + len(history)
@@ -307,6 +360,102 @@ class LanguageModel:
         self.global_iter += 1
         return result_output, total_time
 
+    def chat_speculative(self, prompt):
+        # Greedy speculative decoding: the draft model proposes
+        # num_draft_tokens tokens and a single run_verify call of the target
+        # checks all of them. The longest matching prefix plus the target's
+        # own next token is kept, and both KV caches are rolled back past the
+        # rejected proposals. Output is identical to plain greedy decoding of
+        # the target.
+        prompt = self.sanitize_prompt(prompt)
+        stop_token = llm_model_map[self.hf_model_name]["stop_token"]
+        input_tensor = self.tokenizer(prompt, return_tensors="pt").input_ids
+        if self.streaming_llm:
+            token_slice = max(self.prev_token_len - 1, 0)
+            input_tensor = input_tensor[:, token_slice:]
+        token_len = input_tensor.shape[-1] + 1
+
+        def format_out(results):
+            return int(results.to_host()[0][0])
+
+        if self.streaming_llm and self.model["get_seq_step"]() > 600:
+            print("Evicting cache space!")
+            self.model["evict_kvcache_space"]()
+            self.last_metrics.kv_cache_evictions += 1
+        st_time = time.time()
+        if self.first_input or not self.streaming_llm:
+            token = self.model["run_initialize"](self.to_device(input_tensor))
+            self.first_input = False
+        else:
+            token = self.model["run_cached_initialize"](self.to_device(input_tensor))
+        self.spec_stats["target_calls"] += 1
+        self.draft.model["run_initialize"](self.draft.to_device(input_tensor))
+        total_time = time.time() - st_time
+        self.last_metrics.record_prefill(input_tensor.shape[-1], total_time)
+
+        # Neither cache holds the last token of context yet, it is fed first
+        # in the next step.
+        context = input_tensor[0].tolist()
+        history = [format_out(token)]
+        context.append(history[-1])
+        yield self.tokenizer.decode(history), total_time
+
+        while history[-1] != stop_token and len(history) < self.max_tokens:
+            dec_time = time.time()
+            if self.streaming_llm and self.model["get_seq_step"]() > 600:
+                print("Evicting cache space!")
+                self.model["evict_kvcache_space"]()
+                self.last_metrics.kv_cache_evictions += 1
+            drafted = []
+            draft_token = self.draft.to_device([context[-1]])
+            for _ in range(self.num_draft_tokens):
+                draft_token = self.draft.model["run_forward"](draft_token)
+                drafted.append(format_out(draft_token))
+                if drafted[-1] == stop_token:
+                    break
+
+            verified = self.model["run_verify"](
+                self.to_device(torch.tensor([[context[-1]] + drafted]))
+            )
+            verified = [int(t) for t in verified.to_host()[0]]
+            self.spec_stats["target_calls"] += 1
+            num_accepted = 0
+            while (
+                num_accepted < len(drafted)
+                and verified[num_accepted] == drafted[num_accepted]
+                and verified[num_accepted] != stop_token
+            ):
+                num_accepted += 1
+            new_tokens = verified[: num_accepted + 1]
+            self.spec_stats["drafted"] += len(drafted)
+            self.spec_stats["accepted"] += num_accepted
+
+            # The target cache now holds the last token and every proposal,
+            # the draft cache the last token and all proposals but the final
+            # one. Keep the last token and the accepted proposals in both.
+            rejected = len(drafted) - num_accepted
+            if rejected:
+                self.model["rollback_kvcache"](rejected)
+            if rejected > 1:
+                self.draft.model["rollback_kvcache"](rejected - 1)
+            elif rejected == 0:
+                self.draft.model["run_forward"](self.draft.to_device([drafted[-1]]))
+
+            new_tokens = new_tokens[: self.max_tokens - len(history)]
+            total_time = (time.time() - dec_time) / len(new_tokens)
+            for new_token in new_tokens:
+                history.append(new_token)
+                context.append(new_token)
+                self.last_metrics.record_token(total_time)
+                yield self.tokenizer.decode(history), total_time
+            if stop_token in new_tokens:
+                break
+
+        self.prev_token_len = token_len + len(history)
+        result_output = self.tokenizer.decode(history)
+        self.global_iter += 1
+        return result_output, total_time
+
     # Reference HF model function for sanity checks.
     def chat_hf(self, prompt):
         if self.hf_mod is None:
@@ -363,11 +512,45 @@ def get_mfma_spec_path(target_chip, save_dir):
     return spec_path
 
 
-def llm_chat_api(InputData: dict):
-    from datetime import datetime as dt
-
+def load_llm(model_name, device):
+    # Returns a resident LanguageModel for model_name on device, loading one if
+    # needed. Other resident models are only evicted if the budget requires it.
     import apps.shark_studio.web.utils.globals as global_obj
 
+    if "cuda" in device:
+        device = "cuda"
+    elif "vulkan" in device:
+        device = "vulkan"
+    elif "cpu" in device:
+        device = "cpu"
+    else:
+        print("unrecognized device")
+    residency = global_obj.get_residency()
+    llm_key = make_key("llm", {"model_name": model_name, "device": device})
+    if residency.get(llm_key) is None:
+        print("\n[LOG] Initializing new pipeline...")
+    llm_model = residency.load(
+        llm_key,
+        lambda: LanguageModel(
+            model_name=model_name,
+            hf_auth_token=cmd_opts.hf_auth_token,
+            device=device,
+            quantization=cmd_opts.quantization,
+            external_weights="safetensors",
+            use_system_prompt=True,
+            streaming_llm=False,
+            draft_model=cmd_opts.llm_draft_model,
+            num_draft_tokens=cmd_opts.llm_num_draft_tokens,
+        ),
+        "llm",
+        device=device,
+        sizer=lambda model: model.artifact_bytes(),
+    )
+    global_obj.set_llm_obj(llm_model, llm_key)
+    return llm_model
+
+
+def get_llm_api_job(InputData: dict):
     print(f"Input keys : {InputData.keys()}")
 
     # print(f"model : {InputData['model']}")
@@ -388,39 +571,10 @@ def llm_chat_api(InputData: dict):
         if "model" in InputData.keys()
         else "meta-llama/Llama-2-7b-chat-hf"
     )
-    model_path = llm_model_map[model_name]
     device = InputData["device"] if "device" in InputData.keys() else "cpu"
-    precision = "fp16"
     max_tokens = InputData["max_tokens"] if "max_tokens" in InputData.keys() else 4096
 
-    device_id = None
-    if not global_obj.get_llm_obj():
-        print("\n[LOG] Initializing new pipeline...")
-        global_obj.clear_cache()
-        gc.collect()
-        if "cuda" in device:
-            device = "cuda"
-        elif "vulkan" in device:
-            device_id = int(device.split("://")[1])
-            device = "vulkan"
-        elif "cpu" in device:
-            device = "cpu"
-            precision = "fp32"
-        else:
-            print("unrecognized device")
-        llm_model = LanguageModel(
-            model_name=model_name,
-            hf_auth_token=cmd_opts.hf_auth_token,
-            device=device,
-            quantization=cmd_opts.quantization,
-            external_weights="safetensors",
-            use_system_prompt=True,
-            streaming_llm=False,
-        )
-        global_obj.set_llm_obj(llm_model)
-    else:
-        llm_model = global_obj.get_llm_obj()
-
+    llm_model = load_llm(model_name, device)
     llm_model.max_tokens = max_tokens
     # TODO: add role dict for different models
     if is_chat_completion_api:
@@ -431,8 +585,18 @@ def llm_chat_api(InputData: dict):
     else:
         prompt = InputData["prompt"]
     print("prompt = ", prompt)
+    return llm_model, prompt, is_chat_completion_api
+
+
+def llm_chat_api(InputData: dict, queued_at=None):
+    from datetime import datetime as dt
+
+    queued_at = queued_at or time.time()
+    load_start = time.time()
+    llm_model, prompt, is_chat_completion_api = get_llm_api_job(InputData)
+    load_time = time.time() - load_start
 
-    for res_op, _ in llm_model.chat(prompt):
+    for res_op, _ in llm_model.chat(prompt, queued_at, load_time):
         if is_chat_completion_api:
             choices = [
                 {
@@ -459,9 +623,68 @@ def llm_chat_api(InputData: dict):
         "object": "chat.completion" if is_chat_completion_api else "text_completion",
         "created": int(end_time),
         "choices": choices,
+        "usage": llm_model.last_metrics.usage(),
     }
 
 
+def llm_chat_api_stream(InputData: dict, cancel_event=None, queued_at=None):
+    # Same job as llm_chat_api, but yields OpenAI-style chunks carrying only
+    # the text generated since the previous chunk. Setting cancel_event stops
+    # the decode loop after the current token.
+    from datetime import datetime as dt
+
+    queued_at = queued_at or time.time()
+    load_start = time.time()
+    llm_model, prompt, is_chat_completion_api = get_llm_api_job(InputData)
+    load_time = time.time() - load_start
+    chunk_id = dt.now().strftime("%Y%m%d%H%M%S%f")
+    created = int(time.time())
+
+    def make_chunk(delta, finish_reason=None):
+        if is_chat_completion_api:
+            choice = {"index": 0, "delta": {}, "finish_reason": finish_reason}
+            if delta is not None:
+                choice["delta"] = {"role": "assistant", "content": delta}
+        else:
+            choice = {
+                "text": delta or "",
+                "index": 0,
+                "logprobs": None,
+                "finish_reason": finish_reason,
+            }
+        return {
+            "id": chunk_id,
+            "object": (
+                "chat.completion.chunk" if is_chat_completion_api else "text_completion"
+            ),
+            "created": created,
+            "choices": [choice],
+        }
+
+    sent = ""
+    token_count = 0
+    finish_reason = "stop"
+    generator = llm_model.chat(prompt, queued_at, load_time)
+    for res_op, _ in generator:
+        if cancel_event is not None and cancel_event.is_set():
+            print("[LOG] Client disconnected, stopping generation.")
+            generator.close()
+            return
+        token_count += 1
+        # Detokenization can rewrite the tail of the text (e.g. merged
+        # whitespace), so only forward text once it extends what was sent.
+        if not res_op.startswith(sent) or res_op == sent:
+            continue
+        delta = res_op[len(sent) :]
+        sent = res_op
+        yield make_chunk(delta)
+    if token_count >= llm_model.max_tokens:
+        finish_reason = "length"
+    final_chunk = make_chunk(None, finish_reason)
+    final_chunk["usage"] = llm_model.last_metrics.usage()
+    yield final_chunk
+
+
 if __name__ == "__main__":
     lm = LanguageModel(
         "Trelis/Llama-2-7b-chat-hf-function-calling-v2",
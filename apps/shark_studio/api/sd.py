@@ -8,7 +8,9 @@ import numpy as np
 import copy
 import importlib.util
 import sys
+import threading
 from tqdm.auto import tqdm
+from concurrent.futures import Future, ThreadPoolExecutor
 
 from pathlib import Path
 from random import randint
@@ -21,6 +23,7 @@ from turbine_models.custom_models.sdxl_inference.sdxl_compiled_pipeline import (
 from apps.shark_studio.api.controlnet import control_adapter_map
 from apps.shark_studio.api.utils import parse_device
 from apps.shark_studio.web.utils.state import status_label
+from apps.shark_studio.web.utils.residency import make_key, get_artifact_bytes
 from apps.shark_studio.web.utils.file_utils import (
     safe_name,
     get_resource_path,
@@ -30,11 +33,18 @@ from apps.shark_studio.web.utils.file_utils import (
 from apps.shark_studio.modules.img_processing import (
     save_output_img,
 )
+from apps.shark_studio.modules.image_writer import get_image_writer
 
 from apps.shark_studio.modules.ckpt_processing import (
     preprocessCKPT,
     save_irpa,
 )
+from apps.shark_studio.modules.embeddings import get_lora_list, get_lora_merged_irpa
+
+# Serializes pipeline loading and execution between concurrent requests (the
+# UI and the API routes). Generator-based callers must release it before
+# yielding, since they may be resumed on a different thread.
+sd_exec_lock = threading.Lock()
 
 EMPTY_SD_MAP = {
     "clip": None,
@@ -129,8 +139,8 @@ class StableDiffusion:
             precision,
             triple,
         ]
-        if num_loras > 0:
-            pipe_id_list.append(str(num_loras) + "lora")
+        # LoRAs are merged into the external weights, so they don't change the
+        # compiled modules and aren't part of the pipe_id.
         if is_controlled:
             pipe_id_list.append("controlled")
         if custom_vae:
@@ -178,9 +188,13 @@ class StableDiffusion:
             external_weights=external_weights,
             custom_vae=custom_vae,
         )
+        self.prep_kwargs = None
         print(f"\n[LOG] Pipeline initialized with pipe_id: {self.pipe_id}.")
         gc.collect()
 
+    def artifact_bytes(self):
+        return get_artifact_bytes([self.pipeline_dir, self.weights_path])
+
     def prepare_pipe(
         self, custom_weights, adapters, embeddings, is_img2img, compiled_pipeline
     ):
@@ -193,6 +207,7 @@ class StableDiffusion:
             compiled_pipeline = False
         self.compiled_pipeline = compiled_pipeline
 
+        loras = get_lora_list(embeddings)
         if custom_weights:
             custom_weights = os.path.join(
                 get_checkpoints_path("checkpoints"),
@@ -200,46 +215,73 @@ class StableDiffusion:
                 custom_weights,
             )
             diffusers_weights_path = preprocessCKPT(custom_weights, self.precision)
-            for key in weights:
-                if key in ["scheduled_unet", "unet"]:
-                    unet_weights_path = os.path.join(
-                        diffusers_weights_path,
-                        "unet",
-                        "diffusion_pytorch_model.safetensors",
-                    )
-                    weights[key] = save_irpa(unet_weights_path, "unet.")
-
-                elif key in ["clip", "prompt_encoder"]:
-                    if not self.is_sdxl:
-                        sd1_path = os.path.join(
-                            diffusers_weights_path, "text_encoder", "model.safetensors"
+            # Each submodel's weights are converted on their own thread.
+            with ThreadPoolExecutor() as pool:
+
+                def convert(path, prepend_str, lora_prefix):
+                    if loras and lora_prefix:
+                        return pool.submit(
+                            get_lora_merged_irpa, path, prepend_str, loras, lora_prefix
                         )
-                        weights[key] = save_irpa(sd1_path, "text_encoder_model.")
-                    else:
-                        clip_1_path = os.path.join(
-                            diffusers_weights_path, "text_encoder", "model.safetensors"
+                    return pool.submit(save_irpa, path, prepend_str)
+
+                for key in weights:
+                    if key in ["scheduled_unet", "unet"]:
+                        unet_weights_path = os.path.join(
+                            diffusers_weights_path,
+                            "unet",
+                            "diffusion_pytorch_model.safetensors",
                         )
-                        clip_2_path = os.path.join(
+                        weights[key] = convert(unet_weights_path, "unet.", "lora_unet_")
+
+                    elif key in ["clip", "prompt_encoder"]:
+                        if not self.is_sdxl:
+                            sd1_path = os.path.join(
+                                diffusers_weights_path,
+                                "text_encoder",
+                                "model.safetensors",
+                            )
+                            weights[key] = convert(
+                                sd1_path, "text_encoder_model.", "lora_te_"
+                            )
+                        else:
+                            clip_1_path = os.path.join(
+                                diffusers_weights_path,
+                                "text_encoder",
+                                "model.safetensors",
+                            )
+                            clip_2_path = os.path.join(
+                                diffusers_weights_path,
+                                "text_encoder_2",
+                                "model.safetensors",
+                            )
+                            weights[key] = [
+                                convert(
+                                    clip_1_path, "text_encoder_model_1.", "lora_te1_"
+                                ),
+                                convert(
+                                    clip_2_path, "text_encoder_model_2.", "lora_te2_"
+                                ),
+                            ]
+
+                    elif key in ["vae_decode"] and weights[key] is None:
+                        vae_weights_path = os.path.join(
                             diffusers_weights_path,
-                            "text_encoder_2",
-                            "model.safetensors",
+                            "vae",
+                            "diffusion_pytorch_model.safetensors",
                         )
-                        weights[key] = [
-                            save_irpa(clip_1_path, "text_encoder_model_1."),
-                            save_irpa(clip_2_path, "text_encoder_model_2."),
-                        ]
-
-                elif key in ["vae_decode"] and weights[key] is None:
-                    vae_weights_path = os.path.join(
-                        diffusers_weights_path,
-                        "vae",
-                        "diffusion_pytorch_model.safetensors",
-                    )
-                    weights[key] = save_irpa(vae_weights_path, "vae.")
+                        weights[key] = convert(vae_weights_path, "vae.", None)
+            for key in weights:
+                if isinstance(weights[key], list):
+                    weights[key] = [w.result() for w in weights[key]]
+                elif isinstance(weights[key], Future):
+                    weights[key] = weights[key].result()
 
         vmfbs, weights = self.sd_pipe.check_prepared(
             mlirs, vmfbs, weights, interactive=False
         )
+        if loras:
+            weights = self.merge_loras(weights, loras)
         print(f"\n[LOG] Loading pipeline to device {self.rt_device}.")
         self.sd_pipe.load_pipeline(
             vmfbs, weights, self.rt_device, self.compiled_pipeline
@@ -249,6 +291,34 @@ class StableDiffusion:
         )
         return
 
+    def merge_loras(self, weights, loras):
+        # Swaps each submodel's default weights for a cached LoRA-merged
+        # archive. Custom weights are merged while being converted, and
+        # weights that aren't .safetensors are left as they are.
+        lora_prefixes = {
+            "unet": ["lora_unet_"],
+            "scheduled_unet": ["lora_unet_"],
+            "clip": ["lora_te_"],
+            "prompt_encoder": ["lora_te1_", "lora_te2_"],
+        }
+        merged = dict(weights)
+        for key, prefixes in lora_prefixes.items():
+            paths = weights.get(key)
+            if paths is None:
+                continue
+            is_list = isinstance(paths, list)
+            paths = paths if is_list else [paths]
+            paths = [
+                (
+                    get_lora_merged_irpa(str(path), "", loras, prefix)
+                    if str(path).endswith(".safetensors")
+                    else path
+                )
+                for path, prefix in zip(paths, prefixes)
+            ]
+            merged[key] = paths if is_list else paths[0]
+        return merged
+
     def generate_images(
         self,
         prompt,
@@ -353,10 +423,7 @@ def shark_sd_fn(
     is_controlled = False
     control_mode = None
     hints = []
-    num_loras = 0
     import_ir = True
-    for i in embeddings:
-        num_loras += 1 if embeddings[i] else 0
     if "model" in controlnets:
         for i, model in enumerate(controlnets["model"]):
             if "xl" not in base_model_id.lower():
@@ -388,7 +455,8 @@ def shark_sd_fn(
         "device": device,
         "target_triple": target_triple,
         "custom_vae": custom_vae,
-        "num_loras": num_loras,
+        # LoRAs are left out: they are merged into the weights by
+        # prepare_pipe, so changing them keeps the resident pipeline.
         "import_ir": import_ir,
         "is_controlled": is_controlled,
         "steps": steps,
@@ -413,34 +481,12 @@ def shark_sd_fn(
         "control_mode": control_mode,
         "hints": hints,
     }
-    if (
-        not global_obj.get_sd_obj()
-        or global_obj.get_pipe_kwargs() != submit_pipe_kwargs
-    ):
-        print("\n[LOG] Initializing new pipeline...")
-        global_obj.clear_cache()
-        gc.collect()
-
-        # Initializes the pipeline and retrieves IR based on all
-        # parameters that are static in the turbine output format,
-        # which is currently MLIR in the torch dialect.
-
-        sd_pipe = StableDiffusion(
-            **submit_pipe_kwargs,
-        )
-        global_obj.set_sd_obj(sd_pipe)
-        global_obj.set_pipe_kwargs(submit_pipe_kwargs)
-    if (
-        not global_obj.get_prep_kwargs()
-        or global_obj.get_prep_kwargs() != submit_prep_kwargs
-    ):
-        global_obj.set_prep_kwargs(submit_prep_kwargs)
-        global_obj.get_sd_obj().prepare_pipe(**submit_prep_kwargs)
-
     generated_imgs = []
     for current_batch in range(batch_count):
         start_time = time.time()
-        out_imgs = global_obj.get_sd_obj().generate_images(**submit_run_kwargs)
+        with sd_exec_lock:
+            sd_pipe = prepare_sd_pipe(submit_pipe_kwargs, submit_prep_kwargs)
+            out_imgs = sd_pipe.generate_images(**submit_run_kwargs)
         if not isinstance(out_imgs, list):
             out_imgs = [out_imgs]
         # total_time = time.time() - start_time
@@ -461,14 +507,53 @@ def shark_sd_fn(
         yield generated_imgs, status_label(
             "Stable Diffusion", current_batch + 1, batch_count, batch_size
         )
+    # Make sure this request's images are on disk before it completes.
+    try:
+        get_image_writer().flush()
+    except Exception as e:
+        yield generated_imgs, f"Stable Diffusion complete, but saving failed: {e}"
     return (generated_imgs, "")
 
 
+def prepare_sd_pipe(pipe_kwargs: dict, prep_kwargs: dict):
+    import apps.shark_studio.web.utils.globals as global_obj
+
+    sd_pipe, sd_key = load_sd_pipe(pipe_kwargs)
+    if sd_pipe.prep_kwargs != prep_kwargs:
+        sd_pipe.prepare_pipe(**prep_kwargs)
+        sd_pipe.prep_kwargs = prep_kwargs
+        global_obj.get_residency().refresh(sd_key)
+    global_obj.set_prep_kwargs(prep_kwargs)
+    return sd_pipe
+
+
+def load_sd_pipe(pipe_kwargs: dict):
+    # Returns a resident pipeline for these kwargs, initializing one if needed.
+    # Initialization retrieves IR based on all parameters that are static in
+    # the turbine output format, which is currently MLIR in the torch dialect.
+    import apps.shark_studio.web.utils.globals as global_obj
+
+    residency = global_obj.get_residency()
+    sd_key = make_key("sd", pipe_kwargs)
+    if residency.get(sd_key) is None:
+        print("\n[LOG] Initializing new pipeline...")
+    sd_pipe = residency.load(
+        sd_key,
+        lambda: StableDiffusion(**pipe_kwargs),
+        "sd",
+        device=pipe_kwargs["device"],
+        sizer=lambda pipe: pipe.artifact_bytes(),
+    )
+    global_obj.set_sd_obj(sd_pipe, sd_key)
+    global_obj.set_pipe_kwargs(pipe_kwargs)
+    return sd_pipe, sd_key
+
+
 def unload_sd():
     print("Unloading models.")
     import apps.shark_studio.web.utils.globals as global_obj
 
-    global_obj.clear_cache()
+    global_obj.get_residency().unload_kind("sd")
     gc.collect()
 
 
@@ -1,8 +1,11 @@
 import os
 import json
 import re
+import hashlib
+import struct
 import requests
 import torch
+import numpy as np
 import safetensors
 from iree.turbine.aot.params import (
     ParameterArchiveBuilder,
@@ -64,15 +67,89 @@ def preprocessCKPT(custom_weights, precision="fp16", is_inpaint=False):
     return path_to_diffusers
 
 
-def save_irpa(weights_path, prepend_str):
-    weights = safetensors.torch.load_file(weights_path)
-    archive = ParameterArchiveBuilder()
-    for key in weights.keys():
-        new_key = prepend_str + key
-        archive.add_tensor(new_key, weights[key])
+SAFETENSORS_DTYPES = {
+    "F64": np.float64,
+    "F32": np.float32,
+    "F16": np.float16,
+    "I64": np.int64,
+    "I32": np.int32,
+    "I16": np.int16,
+    "I8": np.int8,
+    "U8": np.uint8,
+    "BOOL": np.bool_,
+}
+
+
+def read_safetensors_header(weights_path):
+    # A .safetensors file is an 8 byte little-endian header length, a JSON
+    # header with each tensor's dtype, shape and byte range, then the data.
+    with open(weights_path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header_bytes = f.read(header_len)
+    return json.loads(header_bytes), 8 + header_len, header_bytes
+
+
+def iter_safetensors(weights_path):
+    """
+    Yields (name, tensor) for each tensor in a .safetensors file without
+    loading the file. Tensors are views into a copy-on-write memory map, so
+    pages are only read in when a tensor is used and can be dropped again.
+    """
+    header, data_start, _ = read_safetensors_header(weights_path)
+    header.pop("__metadata__", None)
+    mapped = np.memmap(weights_path, dtype=np.uint8, mode="c")
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        raw = mapped[data_start + start : data_start + end]
+        if info["dtype"] == "BF16":
+            tensor = torch.from_numpy(raw.view(np.int16)).view(torch.bfloat16)
+        else:
+            tensor = torch.from_numpy(raw.view(SAFETENSORS_DTYPES[info["dtype"]]))
+        yield name, tensor.reshape(info["shape"])
+
+
+def get_irpa_source_id(weights_path, prepend_str, key_prefix, dtype):
+    # Hashes the source header (names, shapes, dtypes, offsets), size and
+    # mtime along with the conversion options. Cheaper than hashing the data.
+    _, _, header_bytes = read_safetensors_header(weights_path)
+    stat = os.stat(weights_path)
+    source = hashlib.sha256(header_bytes)
+    source.update(
+        f"{stat.st_size}:{stat.st_mtime_ns}:{prepend_str}:{key_prefix}:{dtype}".encode()
+    )
+    return source.hexdigest()
 
+
+def save_irpa(weights_path, prepend_str, key_prefix=None, dtype=None):
+    """
+    Converts a .safetensors file to an .irpa parameter archive one tensor at a
+    time. Only tensors whose names start with key_prefix (if given) are kept,
+    and floating point tensors are cast to dtype (if given). Conversion is
+    skipped when an archive made from the same source and options exists.
+    """
     irpa_file = weights_path.replace(".safetensors", ".irpa")
-    archive.save(irpa_file)
+    stamp_file = irpa_file + ".json"
+    source_id = get_irpa_source_id(weights_path, prepend_str, key_prefix, dtype)
+    if os.path.isfile(irpa_file) and os.path.isfile(stamp_file):
+        with open(stamp_file, "r") as f:
+            if json.load(f).get("source_id") == source_id:
+                print(f"[LOG] Using up-to-date parameter archive {irpa_file}")
+                return irpa_file
+
+    archive = ParameterArchiveBuilder()
+    for key, tensor in iter_safetensors(weights_path):
+        if key_prefix is not None and not key.startswith(key_prefix):
+            continue
+        if dtype is not None and tensor.is_floating_point() and tensor.dtype != dtype:
+            tensor = tensor.to(dtype)
+        archive.add_tensor(prepend_str + key, tensor)
+
+    # Written under a temporary name so an interrupted conversion is redone.
+    tmp_file = irpa_file.replace(".irpa", ".tmp.irpa")
+    archive.save(tmp_file)
+    os.replace(tmp_file, irpa_file)
+    with open(stamp_file, "w") as f:
+        json.dump({"source_id": source_id, "source": weights_path}, f)
     return irpa_file
 
 
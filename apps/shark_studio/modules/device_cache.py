@@ -0,0 +1,150 @@
+import json
+import os
+import platform
+import sys
+import threading
+from importlib import metadata
+
+"""
+Caches the list of available devices on disk so startup doesn't have to probe
+every IREE driver. The cache is keyed on the installed runtime and the driver
+versions that can be read without loading a driver; a mismatch, or a missing
+cache, falls back to a full probe. A background revalidation re-probes after
+startup and reports if the device list changed anyway.
+"""
+
+# Files that change whenever the corresponding kernel/user-mode driver is
+# upgraded. They are only read, never loaded.
+DRIVER_VERSION_FILES = [
+    "/proc/driver/nvidia/version",
+    "/sys/module/amdgpu/version",
+    "/opt/rocm/.info/version",
+]
+VULKAN_ICD_DIRS = [
+    "/usr/share/vulkan/icd.d",
+    "/usr/local/share/vulkan/icd.d",
+    "/etc/vulkan/icd.d",
+]
+WINDOWS_DRIVER_DLLS = ["vulkan-1.dll", "nvcuda.dll", "amdhip64.dll"]
+DEVICE_ENV_VARS = [
+    "VK_ICD_FILENAMES",
+    "CUDA_VISIBLE_DEVICES",
+    "HIP_VISIBLE_DEVICES",
+    "ROCR_VISIBLE_DEVICES",
+]
+RUNTIME_PACKAGES = ["iree-runtime", "iree-base-runtime"]
+
+CACHE_VERSION = 1
+
+
+def get_package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+def get_file_stamp(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def get_driver_versions():
+    versions = {
+        "cache_version": CACHE_VERSION,
+        "platform": platform.platform(),
+    }
+    for name in RUNTIME_PACKAGES:
+        versions[name] = get_package_version(name)
+    for path in DRIVER_VERSION_FILES:
+        try:
+            with open(path) as f:
+                versions[path] = f.readline().strip()
+        except OSError:
+            continue
+    for icd_dir in VULKAN_ICD_DIRS:
+        if not os.path.isdir(icd_dir):
+            continue
+        for name in sorted(os.listdir(icd_dir)):
+            path = os.path.join(icd_dir, name)
+            versions[path] = get_file_stamp(path)
+    if sys.platform == "win32":
+        system32 = os.path.join(os.environ.get("SystemRoot", "C:\\Windows"), "System32")
+        for dll in WINDOWS_DRIVER_DLLS:
+            path = os.path.join(system32, dll)
+            versions[path] = get_file_stamp(path)
+    for var in DEVICE_ENV_VARS:
+        versions[var] = os.environ.get(var)
+    return versions
+
+
+class DeviceCache:
+    def __init__(self, path, discover, get_versions=get_driver_versions):
+        # discover() does the full probe and returns the device list.
+        self.path = path
+        self.discover = discover
+        self.get_versions = get_versions
+        self.devices = None
+        self.from_cache = False
+
+    def read(self, versions):
+        try:
+            with open(self.path) as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if cached.get("versions") != versions:
+            return None
+        return cached.get("devices")
+
+    def save(self, devices, versions):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"versions": versions, "devices": devices}, f, indent=4)
+        os.replace(tmp_path, self.path)
+
+    def refresh(self):
+        versions = self.get_versions()
+        devices = self.discover()
+        self.save(devices, versions)
+        return devices
+
+    def load(self):
+        """
+        Returns the cached device list if it was written for the current
+        drivers, otherwise probes the devices and caches the result.
+        """
+        devices = self.read(self.get_versions())
+        self.from_cache = devices is not None
+        if devices is None:
+            devices = self.refresh()
+        else:
+            print(f"[LOG] Using cached device list from {self.path}.")
+        self.devices = devices
+        return devices
+
+    def revalidate(self, on_change=None):
+        # Re-probes the devices and updates the cache, calling on_change(devices)
+        # if the list differs from the one handed out by load().
+        devices = self.refresh()
+        if devices != self.devices:
+            print("[LOG] Available devices changed since they were cached.")
+            self.devices = devices
+            if on_change is not None:
+                on_change(devices)
+        return devices
+
+    def start_revalidate(self, on_change=None):
+        def revalidate():
+            try:
+                self.revalidate(on_change)
+            except Exception as e:
+                print(f"[LOG] Device revalidation failed: {e}")
+
+        thread = threading.Thread(target=revalidate, daemon=True)
+        thread.start()
+        return thread
@@ -2,14 +2,20 @@ import os
 import sys
 import torch
 import json
+import hashlib
+import threading
 import safetensors
+from collections import OrderedDict
 from dataclasses import dataclass
 from safetensors.torch import load_file
 from apps.shark_studio.web.utils.file_utils import (
     get_checkpoint_pathfile,
+    get_checkpoints_path,
     get_path_stem,
 )
 
+DEFAULT_LORA_STRENGTH = 0.75
+
 
 @dataclass
 class LoRAweight:
@@ -19,13 +25,13 @@ class LoRAweight:
     alpha: torch.float32 = 1.0
 
 
-def processLoRA(model, use_lora, splitting_prefix, lora_strength=0.75):
-    state_dict = ""
+def load_lora_state_dict(use_lora):
     if ".safetensors" in use_lora:
-        state_dict = load_file(use_lora)
-    else:
-        state_dict = torch.load(use_lora)
+        return load_file(use_lora)
+    return torch.load(use_lora)
+
 
+def get_lora_weights(state_dict, splitting_prefix):
     # gather the weights from the LoRA in a more convenient form, assumes
     # everything will have an up.weight.
     weight_dict: dict[str, LoRAweight] = {}
@@ -48,14 +54,92 @@ def processLoRA(model, use_lora, splitting_prefix, lora_strength=0.75):
                         else 1.0
                     ),
                 )
+    return weight_dict
 
-    # Directly update weight in model
 
+def compute_lora_deltas(weight_dict: dict):
+    """
+    Returns {weight_key: up @ down * alpha} in float32, at unit strength.
+    Linear and 1x1 conv layers are grouped by shape and computed with one
+    batched matmul per group; 3x3 conv layers use a conv2d each.
+    """
     # Mostly adaptions of https://github.com/kohya-ss/sd-scripts/blob/main/networks/merge_lora.py
     # and similar code in https://github.com/huggingface/diffusers/issues/3064
 
     # TODO: handle mid weights (how do they even work?)
+    deltas = {}
+    groups = {}
     for key, lora_weight in weight_dict.items():
+        up = lora_weight.up.to(torch.float32)
+        down = lora_weight.down.to(torch.float32)
+        if down.dim() == 4 and down.size()[2:4] != (1, 1):
+            deltas[key] = (
+                torch.nn.functional.conv2d(down.permute(1, 0, 2, 3), up).permute(
+                    1, 0, 2, 3
+                )
+                * lora_weight.alpha
+            )
+            continue
+        is_conv = up.dim() == 4
+        up = up.flatten(1)
+        down = down.flatten(1)
+        group = groups.setdefault((up.shape, down.shape, is_conv), ([], [], [], []))
+        group[0].append(key)
+        group[1].append(up)
+        group[2].append(down)
+        group[3].append(float(lora_weight.alpha))
+
+    for (_, _, is_conv), (keys, ups, downs, alphas) in groups.items():
+        changes = torch.bmm(torch.stack(ups), torch.stack(downs))
+        changes *= torch.tensor(alphas).view(-1, 1, 1)
+        for key, change in zip(keys, changes):
+            deltas[key] = change.unsqueeze(2).unsqueeze(3) if is_conv else change
+    return deltas
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+_file_hashes = {}
+_delta_cache = OrderedDict()
+_delta_cache_lock = threading.Lock()
+MAX_CACHED_DELTAS = 4
+
+
+def get_lora_file_hash(use_lora):
+    stat = os.stat(use_lora)
+    identity = (use_lora, stat.st_size, stat.st_mtime_ns)
+    if identity not in _file_hashes:
+        _file_hashes[identity] = hash_file(use_lora)
+    return _file_hashes[identity]
+
+
+def get_lora_deltas(use_lora, splitting_prefix):
+    # Deltas are computed once per LoRA file and prefix, and only scaled by
+    # the strength when applied.
+    key = (get_lora_file_hash(use_lora), splitting_prefix)
+    with _delta_cache_lock:
+        if key in _delta_cache:
+            _delta_cache.move_to_end(key)
+            return _delta_cache[key]
+    deltas = compute_lora_deltas(
+        get_lora_weights(load_lora_state_dict(use_lora), splitting_prefix)
+    )
+    with _delta_cache_lock:
+        _delta_cache[key] = deltas
+        while len(_delta_cache) > MAX_CACHED_DELTAS:
+            _delta_cache.popitem(last=False)
+    return deltas
+
+
+def processLoRA(model, use_lora, splitting_prefix, lora_strength=0.75):
+    # Directly update weight in model
+    for key, change in get_lora_deltas(use_lora, splitting_prefix).items():
         curr_layer = model
         layer_infos = key.split(".")[0].split(splitting_prefix)[-1].split("_")
 
@@ -75,29 +159,120 @@ def processLoRA(model, use_lora, splitting_prefix, lora_strength=0.75):
                     temp_name = layer_infos.pop(0)
 
         weight = curr_layer.weight.data
-        scale = lora_weight.alpha * lora_strength
-        if len(weight.size()) == 2:
-            if len(lora_weight.up.shape) == 4:
-                weight_up = lora_weight.up.squeeze(3).squeeze(2).to(torch.float32)
-                weight_down = lora_weight.down.squeeze(3).squeeze(2).to(torch.float32)
-                change = torch.mm(weight_up, weight_down).unsqueeze(2).unsqueeze(3)
-            else:
-                change = torch.mm(lora_weight.up, lora_weight.down)
-        elif lora_weight.down.size()[2:4] == (1, 1):
-            weight_up = lora_weight.up.squeeze(3).squeeze(2).to(torch.float32)
-            weight_down = lora_weight.down.squeeze(3).squeeze(2).to(torch.float32)
-            change = torch.mm(weight_up, weight_down).unsqueeze(2).unsqueeze(3)
-        else:
-            change = torch.nn.functional.conv2d(
-                lora_weight.down.permute(1, 0, 2, 3),
-                lora_weight.up,
-            ).permute(1, 0, 2, 3)
-
-        curr_layer.weight.data += change * scale
+        weight += (change.reshape(weight.shape) * lora_strength).to(weight.dtype)
 
     return model
 
 
+def get_lora_list(embeddings):
+    """
+    Returns [(lora_path, strength)] from the "embeddings" request field, which
+    holds LoRA names either as a list or as a {name: strength} dict.
+    """
+    if not embeddings:
+        return []
+    loras = embeddings.get("embeddings", embeddings)
+    if isinstance(loras, dict):
+        items = loras.items()
+    else:
+        items = [(name, DEFAULT_LORA_STRENGTH) for name in loras]
+    return [
+        (get_checkpoint_pathfile(name, "lora"), float(strength))
+        for name, strength in items
+        if name and name != "None"
+    ]
+
+
+def to_lora_keys(param_name, lora_prefix):
+    # Candidate LoRA keys for a diffusers parameter name, e.g.
+    # "unet.down_blocks.0.attentions.0.proj_in.weight" ->
+    # "lora_unet_down_blocks_0_attentions_0_proj_in". The first component may
+    # be a module prefix added on export.
+    stem = param_name.removesuffix(".weight")
+    candidates = [stem]
+    if "." in stem:
+        candidates.append(stem.split(".", 1)[1])
+    return [lora_prefix + c.replace(".", "_") for c in candidates]
+
+
+def get_lora_merged_irpa(weights_path, prepend_str, loras, lora_prefix):
+    """
+    Returns the path to an .irpa holding the .safetensors weights at
+    weights_path with the given LoRAs merged in. Archives are cached by base
+    weights, LoRA file hashes and strengths, so switching back to a recent
+    LoRA combination reuses the archive instead of merging again.
+    """
+    from iree.turbine.aot.params import ParameterArchiveBuilder
+    from apps.shark_studio.modules.ckpt_processing import (
+        iter_safetensors,
+        get_irpa_source_id,
+    )
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                get_irpa_source_id(weights_path, prepend_str, None, None),
+                [(get_lora_file_hash(path), strength) for path, strength in loras],
+                lora_prefix,
+            ]
+        ).encode()
+    ).hexdigest()
+    cache_dir = get_checkpoints_path("lora_merged")
+    os.makedirs(cache_dir, exist_ok=True)
+    irpa_file = os.path.join(
+        cache_dir, f"{get_path_stem(weights_path)}_{lora_prefix}{key[:16]}.irpa"
+    )
+    if os.path.isfile(irpa_file):
+        print(f"[LOG] Using cached LoRA-merged weights {irpa_file}")
+        # The modification time tracks recent use for pruning.
+        os.utime(irpa_file)
+        return irpa_file
+
+    print(f"[LOG] Merging {len(loras)} LoRA(s) into {weights_path}")
+    all_deltas = [
+        (get_lora_deltas(path, lora_prefix), strength) for path, strength in loras
+    ]
+    archive = ParameterArchiveBuilder()
+    for name, tensor in iter_safetensors(weights_path):
+        changes = [
+            deltas[lora_key] * strength
+            for deltas, strength in all_deltas
+            for lora_key in to_lora_keys(name, lora_prefix)
+            if lora_key in deltas
+        ]
+        if changes:
+            merged = tensor.to(torch.float32)
+            for change in changes:
+                merged += change.reshape(merged.shape)
+            tensor = merged.to(tensor.dtype)
+        archive.add_tensor(prepend_str + name, tensor)
+    tmp_file = irpa_file.replace(".irpa", ".tmp.irpa")
+    archive.save(tmp_file)
+    os.replace(tmp_file, irpa_file)
+    prune_lora_merged_cache(cache_dir, cmd_opts.lora_cache_size)
+    return irpa_file
+
+
+def prune_lora_merged_cache(cache_dir, keep):
+    # Only finished archives count; *.tmp.irpa files may still be written by
+    # another merge.
+    if keep <= 0:
+        return
+    archives = sorted(
+        (
+            os.path.join(cache_dir, f)
+            for f in os.listdir(cache_dir)
+            if f.endswith(".irpa") and not f.endswith(".tmp.irpa")
+        ),
+        key=os.path.getmtime,
+        reverse=True,
+    )
+    for path in archives[keep:]:
+        print(f"[LOG] Removing least recently used LoRA-merged weights {path}")
+        os.remove(path)
+
+
 def update_lora_weight_for_unet(unet, use_lora, lora_strength):
     extensions = [".bin", ".safetensors", ".pt"]
     if not any([extension in use_lora for extension in extensions]):
@@ -0,0 +1,170 @@
+import atexit
+import json
+import os
+import queue
+import threading
+
+from csv import DictWriter
+from pathlib import Path
+
+"""
+Saves generated images and their details in background threads, so encoding
+and disk writes overlap with the next denoising run instead of delaying it.
+Rows for imgs_details.csv are collected and appended in batches. Once flush()
+returns, every image, .json and csv row submitted before it is on disk, and
+it raises the first write error since the previous flush.
+"""
+
+
+class ImageWriteJob:
+    def __init__(
+        self, img, img_path, save_kwargs, details, csv_path, json_path, seed=None
+    ):
+        self.img = img
+        self.img_path = img_path
+        self.save_kwargs = save_kwargs
+        self.details = details
+        self.csv_path = csv_path
+        self.json_path = json_path
+        self.seed = seed
+
+
+def write_synced(path, write_fn, mode="wb"):
+    # Writes to a temporary file and renames it into place, so readers never
+    # see a partially written file.
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, mode) as f:
+        write_fn(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class ImageWriter:
+    def __init__(
+        self, num_workers=2, max_pending=8, rows_per_flush=16, on_written=None
+    ):
+        # on_written(job) is called once a job's files are on disk.
+        self.on_written = on_written
+        self.num_workers = num_workers
+        self.rows_per_flush = rows_per_flush
+        self.jobs = queue.Queue(maxsize=max(max_pending, 1))
+        self.rows = {}
+        self.rows_lock = threading.Lock()
+        self.errors = []
+        self.errors_lock = threading.Lock()
+        self.workers = []
+        for _ in range(num_workers):
+            worker = threading.Thread(target=self._run, daemon=True)
+            worker.start()
+            self.workers.append(worker)
+        atexit.register(self.close)
+
+    def submit(self, job: ImageWriteJob):
+        if not self.workers:
+            self._write(job)
+            self.flush_rows()
+            return
+        # Blocks once max_pending images are waiting, which keeps generation
+        # from running arbitrarily far ahead of the disk.
+        self.jobs.put(job)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                if job is None:
+                    return
+                self._write(job)
+            except Exception as e:
+                print(f"[ERROR] Failed to save {job.img_path}: {e}")
+                with self.errors_lock:
+                    self.errors.append(e)
+            finally:
+                self.jobs.task_done()
+
+    def _write(self, job: ImageWriteJob):
+        Path(job.img_path).parent.mkdir(parents=True, exist_ok=True)
+        write_synced(job.img_path, lambda f: job.img.save(f, **job.save_kwargs))
+        write_synced(
+            job.json_path,
+            lambda f: json.dump(job.details, f, indent=4),
+            mode="w",
+        )
+        with self.rows_lock:
+            self.rows.setdefault(job.csv_path, []).append(job.details)
+            pending = sum(len(rows) for rows in self.rows.values())
+        if pending >= self.rows_per_flush:
+            self.flush_rows()
+        if self.on_written is not None:
+            self.on_written(job)
+
+    def flush_rows(self):
+        with self.rows_lock:
+            rows, self.rows = self.rows, {}
+            for csv_path, entries in rows.items():
+                csv_mode = "a" if os.path.isfile(csv_path) else "w"
+                with open(csv_path, csv_mode, encoding="utf-8") as csv_obj:
+                    dictwriter_obj = DictWriter(
+                        csv_obj, fieldnames=list(entries[0].keys())
+                    )
+                    if csv_mode == "w":
+                        dictwriter_obj.writeheader()
+                    dictwriter_obj.writerows(entries)
+                    csv_obj.flush()
+                    os.fsync(csv_obj.fileno())
+
+    def wait(self):
+        # Waits for every submitted image and its .json to be written.
+        self.jobs.join()
+
+    def flush(self):
+        # Waits for every submitted image to be written, then raises the first
+        # error any write hit since the last flush.
+        self.wait()
+        try:
+            self.flush_rows()
+        except Exception as e:
+            print(f"[ERROR] Failed to write image details: {e}")
+            with self.errors_lock:
+                self.errors.append(e)
+        with self.errors_lock:
+            errors, self.errors = self.errors, []
+        if errors:
+            raise errors[0]
+
+    def close(self):
+        if not self.workers:
+            return
+        try:
+            self.flush()
+        except Exception:
+            # Already reported when the write failed.
+            pass
+        for _ in self.workers:
+            self.jobs.put(None)
+        for worker in self.workers:
+            worker.join()
+        self.workers = []
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_image_writer():
+    global _writer
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+    from apps.shark_studio.web.utils.gallery_index import get_gallery_index
+
+    def index_image(job):
+        get_gallery_index().add_image(job.img_path, job.details, job.seed)
+
+    with _writer_lock:
+        if _writer is None:
+            _writer = ImageWriter(
+                cmd_opts.image_writer_threads,
+                cmd_opts.image_writer_queue_size,
+                on_written=index_image,
+            )
+        return _writer
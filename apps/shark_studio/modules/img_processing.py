@@ -1,10 +1,7 @@
 import os
 import re
-import json
-import torch
 import numpy as np
 
-from csv import DictWriter
 from PIL import Image, PngImagePlugin
 from pathlib import Path
 from datetime import datetime as dt
@@ -30,13 +27,16 @@ def save_output_img(output_img, img_seed, extra_info=None):
         get_generated_imgs_todays_subdir,
     )
     from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+    from apps.shark_studio.modules.image_writer import (
+        ImageWriteJob,
+        get_image_writer,
+    )
 
     if extra_info is None:
         extra_info = {}
     generated_imgs_path = Path(
         get_generated_imgs_path(), get_generated_imgs_todays_subdir()
     )
-    generated_imgs_path.mkdir(parents=True, exist_ok=True)
     csv_path = Path(generated_imgs_path, "imgs_details.csv")
 
     prompt_slice = re.sub("[^a-zA-Z0-9]", "_", extra_info["prompt"][0][:15])
@@ -59,7 +59,7 @@ def save_output_img(output_img, img_seed, extra_info=None):
 
     if cmd_opts.output_img_format == "jpg":
         out_img_path = Path(generated_imgs_path, f"{out_img_name}.jpg")
-        output_img.save(out_img_path, quality=95, subsampling=0)
+        save_kwargs = {"format": "JPEG", "quality": 95, "subsampling": 0}
     else:
         out_img_path = Path(generated_imgs_path, f"{out_img_name}.png")
         pngInfo = PngImagePlugin.PngInfo()
@@ -88,7 +88,7 @@ def save_output_img(output_img, img_seed, extra_info=None):
                 f"LoRA: {img_loras}",
             )
 
-        output_img.save(out_img_path, "PNG", pnginfo=pngInfo)
+        save_kwargs = {"format": "PNG", "pnginfo": pngInfo}
 
         if cmd_opts.output_img_format not in ["png", "jpg"]:
             print(
@@ -104,17 +104,19 @@ def save_output_img(output_img, img_seed, extra_info=None):
 
     new_entry.update(extra_info)
 
-    csv_mode = "a" if os.path.isfile(csv_path) else "w"
-    with open(csv_path, csv_mode, encoding="utf-8") as csv_obj:
-        dictwriter_obj = DictWriter(csv_obj, fieldnames=list(new_entry.keys()))
-        if csv_mode == "w":
-            dictwriter_obj.writeheader()
-        dictwriter_obj.writerow(new_entry)
-        csv_obj.close()
-
+    # Encoding and writing happen on the image writer's threads.
     json_path = Path(generated_imgs_path, f"{out_img_name}.json")
-    with open(json_path, "w") as f:
-        json.dump(new_entry, f, indent=4)
+    get_image_writer().submit(
+        ImageWriteJob(
+            output_img,
+            out_img_path,
+            save_kwargs,
+            new_entry,
+            csv_path,
+            json_path,
+            img_seed,
+        )
+    )
 
 
 # For stencil, the input image can be of any size, but we need to ensure that
@@ -192,6 +194,8 @@ def process_sd_init_image(self, sd_init_image, resample_type):
             # Fallback to Lanczos
             else Image.Resampling.LANCZOS
         )
+        import torch
+
         image = image.resize((self.width, self.height), resample=resample_type)
         image_arr = np.stack([np.array(i) for i in (image,)], axis=0)
         image_arr = image_arr / 255.0
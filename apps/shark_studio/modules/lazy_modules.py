@@ -0,0 +1,62 @@
+import importlib
+import threading
+import time
+
+"""
+Defers importing the modules that pull in torch, diffusers and turbine_models
+until a tab or API route first calls into them. The UI registers the wrappers
+below as its handlers, and preload_modules() can warm the imports up in the
+background once the server is running.
+"""
+
+_lock = threading.RLock()
+load_times = {}
+
+
+def load_module(name):
+    if name in load_times:
+        return importlib.import_module(name)
+    with _lock:
+        if name in load_times:
+            return importlib.import_module(name)
+        start = time.time()
+        module = importlib.import_module(name)
+        load_times[name] = time.time() - start
+        print(f"[LOG] Loaded {name} in {load_times[name]:.1f}s.")
+        return module
+
+
+def lazy_function(module_name, fn_name):
+    def call(*args, **kwargs):
+        return getattr(load_module(module_name), fn_name)(*args, **kwargs)
+
+    call.__name__ = fn_name
+    return call
+
+
+def lazy_generator(module_name, fn_name):
+    # Gradio checks whether a handler is a generator function to decide if it
+    # streams, so generators need a wrapper that is one as well.
+    def call(*args, **kwargs):
+        return (yield from getattr(load_module(module_name), fn_name)(*args, **kwargs))
+
+    call.__name__ = fn_name
+    return call
+
+
+def preload_modules(names):
+    from apps.shark_studio.modules.timer import startup_timer
+
+    def preload():
+        for name in names:
+            start = time.time()
+            try:
+                load_module(name)
+            except Exception as e:
+                print(f"[LOG] Failed to preload {name}: {e}")
+                continue
+            startup_timer.add_time_to_record(f"preload/{name}", time.time() - start)
+
+    thread = threading.Thread(target=preload, daemon=True)
+    thread.start()
+    return thread
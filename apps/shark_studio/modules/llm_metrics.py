@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import deque
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+LATENCY_BUCKETS = [
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    float("inf"),
+]
+# Upper bounds (in tokens/sec) of the decode throughput histogram buckets.
+THROUGHPUT_BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, float("inf")]
+
+
+def percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    idx = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[idx]
+
+
+class Histogram:
+    def __init__(self, buckets, window=2048):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        # Recent samples, used for percentiles.
+        self.samples = deque(maxlen=window)
+
+    def add(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": percentile(self.samples, 50),
+            "p90": percentile(self.samples, 90),
+            "p99": percentile(self.samples, 99),
+            "buckets": {
+                str(bound): count for bound, count in zip(self.buckets, self.counts)
+            },
+        }
+
+
+class LLMRequestMetrics:
+    # Timings for a single LanguageModel.chat call. queued_at is when the
+    # request arrived, which may be earlier than when generation started.
+    # load_time is the part of that gap spent loading the model.
+
+    def __init__(self, model_name, queued_at=None, load_time=0.0):
+        self.model_name = model_name
+        self.start_time = time.time()
+        self.queued_at = queued_at if queued_at is not None else self.start_time
+        self.load_time = load_time
+        self.prompt_tokens = 0
+        self.prefill_time = None
+        self.first_token_time = None
+        self.token_latencies = []
+        self.kv_cache_evictions = 0
+        self.end_time = None
+
+    def record_prefill(self, prompt_tokens, prefill_time):
+        self.prompt_tokens = prompt_tokens
+        self.prefill_time = prefill_time
+        self.first_token_time = time.time()
+
+    def record_token(self, latency):
+        self.token_latencies.append(latency)
+
+    @property
+    def completion_tokens(self):
+        # The prefill produces the first token.
+        return len(self.token_latencies) + (1 if self.first_token_time else 0)
+
+    def finish(self):
+        if self.end_time is None:
+            self.end_time = time.time()
+
+    def summary(self):
+        decode_time = sum(self.token_latencies)
+        return {
+            "model": self.model_name,
+            "queue_wait": max(self.start_time - self.queued_at - self.load_time, 0.0),
+            "load_time": self.load_time,
+            "prefill_time": self.prefill_time,
+            "time_to_first_token": (
+                self.first_token_time - self.queued_at
+                if self.first_token_time
+                else None
+            ),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "decode_tokens_per_sec": (
+                len(self.token_latencies) / decode_time if decode_time > 0 else None
+            ),
+            "inter_token_latency_p50": percentile(self.token_latencies, 50),
+            "inter_token_latency_p99": percentile(self.token_latencies, 99),
+            "kv_cache_evictions": self.kv_cache_evictions,
+            "total_time": (self.end_time or time.time()) - self.queued_at,
+        }
+
+    def usage(self):
+        summary = self.summary()
+        summary.pop("model")
+        summary["total_tokens"] = self.prompt_tokens + self.completion_tokens
+        return summary
+
+
+class LLMMetrics:
+    # Aggregates finished requests for the metrics endpoint.
+
+    def __init__(self, recent=64):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.kv_cache_evictions = 0
+        self.queue_wait = Histogram(LATENCY_BUCKETS)
+        self.load_time = Histogram(LATENCY_BUCKETS)
+        self.prefill_time = Histogram(LATENCY_BUCKETS)
+        self.time_to_first_token = Histogram(LATENCY_BUCKETS)
+        self.inter_token_latency = Histogram(LATENCY_BUCKETS)
+        self.decode_throughput = Histogram(THROUGHPUT_BUCKETS)
+        self.recent = deque(maxlen=recent)
+
+    def add(self, request: LLMRequestMetrics):
+        summary = request.summary()
+        with self.lock:
+            self.requests += 1
+            self.prompt_tokens += request.prompt_tokens
+            self.completion_tokens += request.completion_tokens
+            self.kv_cache_evictions += request.kv_cache_evictions
+            self.queue_wait.add(summary["queue_wait"])
+            self.load_time.add(summary["load_time"])
+            if request.prefill_time is not None:
+                self.prefill_time.add(request.prefill_time)
+            if summary["time_to_first_token"] is not None:
+                self.time_to_first_token.add(summary["time_to_first_token"])
+            for latency in request.token_latencies:
+                self.inter_token_latency.add(latency)
+            if summary["decode_tokens_per_sec"] is not None:
+                self.decode_throughput.add(summary["decode_tokens_per_sec"])
+            self.recent.append(summary)
+
+    def summary(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens,
+                "kv_cache_evictions": self.kv_cache_evictions,
+                "queue_wait": self.queue_wait.summary(),
+                "load_time": self.load_time.summary(),
+                "prefill_time": self.prefill_time.summary(),
+                "time_to_first_token": self.time_to_first_token.summary(),
+                "inter_token_latency": self.inter_token_latency.summary(),
+                "decode_tokens_per_sec": self.decode_throughput.summary(),
+                "recent_requests": list(self.recent),
+            }
+
+    def reset(self):
+        self.__init__(self.recent.maxlen)
+
+
+llm_metrics = LLMMetrics()
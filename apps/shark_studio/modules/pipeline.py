@@ -4,6 +4,7 @@ from shark.iree_utils.compile_utils import (
     clean_device_info,
     get_iree_target_triple,
 )
+from shark.iree_utils.trace import trace_span
 from apps.shark_studio.web.utils.file_utils import (
     get_checkpoints_path,
     get_resource_path,
@@ -183,13 +184,16 @@ class SharkPipelineBase:
     def run(self, submodel, inputs):
         if not isinstance(inputs, list):
             inputs = [inputs]
-        inp = [
-            ireert.asdevicearray(
-                self.iree_module_dict[submodel]["config"].device, input
-            )
-            for input in inputs
-        ]
-        return self.iree_module_dict[submodel]["vmfb"]["main"](*inp)
+        with trace_span(f"run:{submodel}", cat="studio"):
+            with trace_span("to_device", count=len(inputs)):
+                inp = [
+                    ireert.asdevicearray(
+                        self.iree_module_dict[submodel]["config"].device, input
+                    )
+                    for input in inputs
+                ]
+            with trace_span("invoke", function="main"):
+                return self.iree_module_dict[submodel]["vmfb"]["main"](*inp)
 
     def safe_name(self, name):
         return name.replace("/", "_").replace("-", "_").replace("\\", "_")
@@ -1,23 +1,25 @@
 # from shark_turbine.turbine_models.schedulers import export_scheduler_model
-from diffusers import (
-    LCMScheduler,
-    LMSDiscreteScheduler,
-    PNDMScheduler,
-    DDPMScheduler,
-    DDIMScheduler,
-    DPMSolverMultistepScheduler,
-    KDPM2DiscreteScheduler,
-    EulerDiscreteScheduler,
-    EulerAncestralDiscreteScheduler,
-    DEISMultistepScheduler,
-    DPMSolverSinglestepScheduler,
-    KDPM2AncestralDiscreteScheduler,
-    HeunDiscreteScheduler,
-)
 
 
 def get_schedulers(model_id):
     # TODO: switch over to turbine and run all on GPU
+    # diffusers is only imported once schedulers are created.
+    from diffusers import (
+        LCMScheduler,
+        LMSDiscreteScheduler,
+        PNDMScheduler,
+        DDPMScheduler,
+        DDIMScheduler,
+        DPMSolverMultistepScheduler,
+        KDPM2DiscreteScheduler,
+        EulerDiscreteScheduler,
+        EulerAncestralDiscreteScheduler,
+        DEISMultistepScheduler,
+        DPMSolverSinglestepScheduler,
+        KDPM2AncestralDiscreteScheduler,
+        HeunDiscreteScheduler,
+    )
+
     print(f"\n[LOG] Initializing schedulers from model id: {model_id}")
     schedulers = dict()
     schedulers["PNDM"] = PNDMScheduler.from_pretrained(
@@ -336,6 +336,22 @@ p.add_argument(
     "Supported options: jpg / png.",
 )
 
+p.add_argument(
+    "--image_writer_threads",
+    type=int,
+    default=2,
+    help="Number of background threads encoding and saving output images "
+    "while the next batch generates. 0 saves images synchronously.",
+)
+
+p.add_argument(
+    "--image_writer_queue_size",
+    type=int,
+    default=8,
+    help="Maximum number of output images waiting to be saved before "
+    "generation blocks.",
+)
+
 p.add_argument(
     "--output_dir",
     type=str,
@@ -415,6 +431,16 @@ p.add_argument(
     help="Use standalone LoRA weight using a HF ID or a checkpoint " "file (~3 MB).",
 )
 
+p.add_argument(
+    "--lora_cache_size",
+    type=int,
+    default=16,
+    help="Number of LoRA-merged weight archives kept on disk, so switching "
+    "back to a recently used LoRA combination doesn't merge again. Each "
+    "combination has one archive per submodel (UNet and text encoders). "
+    "0 keeps all of them.",
+)
+
 p.add_argument(
     "--use_quantize",
     type=str,
@@ -455,6 +481,46 @@ p.add_argument(
     "Example: --device_allocator_heap_key='*;1gib' (will limit caching on device to 1 gigabyte)",
 )
 
+p.add_argument(
+    "--residency_host_budget",
+    type=float,
+    default=0,
+    help="Host memory budget in GB for keeping multiple models loaded. "
+    "Least recently used models are unloaded once it is exceeded. "
+    "0 uses 75%% of system memory.",
+)
+
+p.add_argument(
+    "--residency_device_budget",
+    type=float,
+    default=0,
+    help="Per-device memory budget in GB for keeping multiple models loaded. "
+    "0 means unlimited.",
+)
+
+p.add_argument(
+    "--residency_max_models",
+    type=int,
+    default=2,
+    help="Maximum number of pipelines/models kept loaded at once. 0 means unlimited.",
+)
+
+p.add_argument(
+    "--device_cache",
+    default=True,
+    action=argparse.BooleanOptionalAction,
+    help="Cache the list of available devices on disk and revalidate it in the "
+    "background instead of probing every driver at startup.",
+)
+
+p.add_argument(
+    "--defer_imports",
+    default=True,
+    action=argparse.BooleanOptionalAction,
+    help="Import model libraries (torch, diffusers, turbine) the first time a "
+    "tab or API route needs them instead of at startup.",
+)
+
 ##############################################################################
 # IREE - Vulkan supported flags
 ##############################################################################
@@ -512,6 +578,14 @@ p.add_argument(
     'generated with "--dispatch_benchmarks".',
 )
 
+p.add_argument(
+    "--trace_file",
+    type=str,
+    default="",
+    help="Record compile, load and invoke spans and write them to this path "
+    "as a Chrome trace (chrome://tracing, Perfetto) on exit.",
+)
+
 p.add_argument(
     "--enable_rgp",
     default=False,
@@ -705,6 +779,14 @@ p.add_argument(
     "follow symlinks when listing subdirectories under --output_dir.",
 )
 
+p.add_argument(
+    "--output_gallery_page_size",
+    type=int,
+    default=0,
+    help="Number of images per page in the output gallery, newest first. 0 "
+    "shows all images of a subdirectory on one page.",
+)
+
 p.add_argument(
     "--api_log",
     default=False,
@@ -761,6 +843,29 @@ p.add_argument(
     help="Op to be optimized, options are matmul, bmm, conv and all.",
 )
 
+##############################################################################
+# LLM Flags
+##############################################################################
+
+p.add_argument(
+    "--llm_draft_model",
+    type=str,
+    default="",
+    help="Experimental: small model from llm_model_map used to draft tokens for "
+    "speculative decoding, e.g. TinyPixel/small-llama2. Disabled if empty. "
+    "The target vmfb must export run_verify and rollback_kvcache, which the "
+    "turbine stateless llama export does not do yet, so this is ignored with "
+    "the shipped models.",
+)
+
+p.add_argument(
+    "--llm_num_draft_tokens",
+    type=int,
+    default=4,
+    help="Experimental: number of tokens drafted per speculative decoding "
+    "step. Only used with --llm_draft_model.",
+)
+
 ##############################################################################
 # DocuChat Flags
 ##############################################################################
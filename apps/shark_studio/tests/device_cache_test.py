@@ -0,0 +1,49 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import os
+import tempfile
+import unittest
+from apps.shark_studio.modules.device_cache import DeviceCache
+
+
+class DeviceCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "device_cache.json")
+        self.versions = {"iree-runtime": "1.0"}
+        self.devices = ["cpu => cpu-task"]
+        self.probes = 0
+
+    def discover(self):
+        self.probes += 1
+        return list(self.devices)
+
+    def make_cache(self):
+        return DeviceCache(self.path, self.discover, lambda: dict(self.versions))
+
+    def test01_CachedUntilDriversChange(self):
+        assert self.make_cache().load() == self.devices
+        cache = self.make_cache()
+        assert cache.load() == self.devices
+        assert cache.from_cache and self.probes == 1
+        self.versions["iree-runtime"] = "2.0"
+        cache = self.make_cache()
+        assert cache.load() == self.devices
+        assert not cache.from_cache and self.probes == 2
+
+    def test02_Revalidate(self):
+        self.make_cache().load()
+        cache = self.make_cache()
+        cache.load()
+        changes = []
+        self.devices.append("gpu => vulkan://0")
+        cache.start_revalidate(on_change=changes.append).join()
+        assert changes == [self.devices]
+        assert self.make_cache().load() == self.devices
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,89 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import json
+import os
+import tempfile
+import unittest
+from apps.shark_studio.web.utils.gallery_index import GalleryIndex
+
+
+class GalleryIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, "20240101"))
+        self.index = GalleryIndex(os.path.join(self.root, "index.sqlite3"), self.root)
+
+    def make_image(self, name, mtime):
+        path = os.path.join(self.root, "20240101", name)
+        with open(path, "wb") as f:
+            f.write(b"png")
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test01_ListAndSearch(self):
+        old = self.make_image("old.png", 1000)
+        new = self.make_image("new.png", 2000)
+        self.index.add_image(old, {"prompt": ["a red car"], "base_model_id": "sd"})
+        self.index.add_image(new, {"prompt": ["a blue boat"], "base_model_id": "xl"})
+        assert self.index.list_images("20240101") == [new, old]
+        assert self.index.list_images("20240101", limit=1) == [new]
+        assert self.index.search(prompt="car") == [old]
+        assert self.index.search(model="xl") == [new]
+        assert self.index.get_params(old)["prompt"] == ["a red car"]
+
+    def test02_Reconcile(self):
+        indexed = self.make_image("indexed.png", 1000)
+        self.index.add_image(indexed, {"prompt": ["x"]})
+        outside = self.make_image("outside.png", 2000)
+        with open(os.path.splitext(outside)[0] + ".json", "w") as f:
+            json.dump({"prompt": ["from sidecar"]}, f)
+        os.remove(indexed)
+        assert self.index.reconcile("20240101") == (1, 1)
+        assert self.index.list_images("20240101") == [outside]
+        assert self.index.get_params(outside)["prompt"] == ["from sidecar"]
+
+    def test03_BackgroundReconcile(self):
+        outside = self.make_image("outside.png", 2000)
+        thread = self.index.start_reconcile("20240101")
+        thread.join()
+        assert self.index.list_images("20240101") == [outside]
+        assert self.index.reconciling == set()
+
+    def test04_Pages(self):
+        paths = [self.make_image(f"{i}.png", 1000 + i) for i in range(5)]
+        for path in paths:
+            self.index.add_image(path)
+        assert self.index.count_images("20240101") == 5
+        assert self.index.list_images("20240101", offset=2, limit=2) == [
+            paths[2],
+            paths[1],
+        ]
+
+    def test05_FilesGoneDuringReconcile(self):
+        kept = self.make_image("kept.png", 1000)
+        # Listed by the walk, but stat fails like for a file deleted meanwhile.
+        os.symlink(
+            os.path.join(self.root, "missing.png"),
+            os.path.join(self.root, "20240101", "gone.png"),
+        )
+        assert self.index.reconcile("20240101") == (1, 0)
+        assert self.index.list_images("20240101") == [kept]
+        assert not self.index.add_image(os.path.join(self.root, "missing.png"))
+
+    def test06_FirstListingReconciles(self):
+        # Images from before the index existed are listed right away.
+        outside = self.make_image("outside.png", 1000)
+        assert self.index.ensure_reconciled("20240101")
+        assert self.index.list_images("20240101") == [outside]
+        assert not self.index.ensure_reconciled("20240101")
+        other = GalleryIndex(os.path.join(self.root, "other.sqlite3"), self.root)
+        other.reconcile()
+        assert not other.ensure_reconciled("20240101")
+
+
+if __name__ == "__main__":
+    unittest.main()
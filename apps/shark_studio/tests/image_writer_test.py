@@ -0,0 +1,79 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import csv
+import os
+import tempfile
+import unittest
+from apps.shark_studio.modules.image_writer import ImageWriteJob, ImageWriter
+
+
+class FakeImage:
+    def save(self, f, format=None):
+        f.write(format.encode())
+
+
+class BrokenImage:
+    def save(self, f, format=None):
+        raise OSError("disk full")
+
+
+class ImageWriterTest(unittest.TestCase):
+    def write_images(self, num_workers):
+        out_dir = tempfile.mkdtemp()
+        writer = ImageWriter(num_workers=num_workers, max_pending=2)
+        csv_path = os.path.join(out_dir, "day", "imgs_details.csv")
+        for i in range(5):
+            writer.submit(
+                ImageWriteJob(
+                    FakeImage(),
+                    os.path.join(out_dir, "day", f"{i}.png"),
+                    {"format": "PNG"},
+                    {"seed": i},
+                    csv_path,
+                    os.path.join(out_dir, "day", f"{i}.json"),
+                )
+            )
+        writer.flush()
+        with open(csv_path) as f:
+            rows = list(csv.DictReader(f))
+        writer.close()
+        return out_dir, rows
+
+    def test01_FlushWritesEverything(self):
+        out_dir, rows = self.write_images(num_workers=2)
+        assert sorted(int(r["seed"]) for r in rows) == list(range(5))
+        files = os.listdir(os.path.join(out_dir, "day"))
+        assert len([f for f in files if f.endswith(".png")]) == 5
+        assert len([f for f in files if f.endswith(".json")]) == 5
+        assert not [f for f in files if f.endswith(".tmp")]
+
+    def test02_Synchronous(self):
+        _, rows = self.write_images(num_workers=0)
+        assert [int(r["seed"]) for r in rows] == list(range(5))
+
+    def test03_FlushRaisesWriteErrors(self):
+        out_dir = tempfile.mkdtemp()
+        writer = ImageWriter(num_workers=1)
+        writer.submit(
+            ImageWriteJob(
+                BrokenImage(),
+                os.path.join(out_dir, "0.png"),
+                {"format": "PNG"},
+                {"seed": 0},
+                os.path.join(out_dir, "imgs_details.csv"),
+                os.path.join(out_dir, "0.json"),
+            )
+        )
+        with self.assertRaises(OSError):
+            writer.flush()
+        # Each error is reported once.
+        writer.flush()
+        writer.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import time
+import unittest
+from apps.shark_studio.modules.llm_metrics import (
+    Histogram,
+    LLMMetrics,
+    LLMRequestMetrics,
+)
+
+
+class LLMMetricsTest(unittest.TestCase):
+    def test01_HistogramBuckets(self):
+        hist = Histogram([0.1, 1.0, float("inf")])
+        for value in [0.05, 0.5, 0.7, 5.0]:
+            hist.add(value)
+        assert hist.counts == [1, 2, 1]
+        assert hist.summary()["p50"] == 0.7
+
+    def test02_RequestUsage(self):
+        request = LLMRequestMetrics("llama2_7b", queued_at=0.0)
+        request.record_prefill(12, 0.2)
+        for latency in [0.05, 0.05]:
+            request.record_token(latency)
+        request.finish()
+        usage = request.usage()
+        assert usage["completion_tokens"] == 3
+        assert usage["total_tokens"] == 15
+        assert abs(usage["decode_tokens_per_sec"] - 20.0) < 1e-6
+
+    def test03_Aggregate(self):
+        metrics = LLMMetrics()
+        request = LLMRequestMetrics("llama2_7b")
+        request.record_prefill(4, 0.1)
+        request.record_token(0.02)
+        request.finish()
+        metrics.add(request)
+        summary = metrics.summary()
+        assert summary["requests"] == 1
+        assert summary["prompt_tokens"] == 4
+        assert summary["inter_token_latency"]["count"] == 1
+
+    def test04_LoadTimeNotQueueWait(self):
+        request = LLMRequestMetrics("llama2_7b", time.time() - 5.0, load_time=4.0)
+        summary = request.summary()
+        assert abs(summary["queue_wait"] - 1.0) < 0.1
+        assert summary["load_time"] == 4.0
+
+
+if __name__ == "__main__":
+    unittest.main()
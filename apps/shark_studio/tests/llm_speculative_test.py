@@ -0,0 +1,143 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import unittest
+import torch
+from apps.shark_studio.api.llm import LanguageModel, llm_model_map
+
+MODEL_NAME = "TinyPixel/small-llama2"
+STOP = llm_model_map[MODEL_NAME]["stop_token"]
+PROMPT = [101, 102, 103]
+# Greedy continuations of PROMPT. The draft disagrees with the target at
+# two positions.
+TARGET = [11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, STOP]
+DRAFT = [11, 12, 13, 14, 15, 99, 17, 18, 19, 98, 21, 22, STOP]
+
+
+def ints(tokens):
+    # Outputs are fed back as they are, like device arrays.
+    if isinstance(tokens, Result):
+        tokens = tokens.tokens[-1:]
+    if hasattr(tokens, "tolist"):
+        tokens = tokens.tolist()
+    while tokens and isinstance(tokens[0], list):
+        tokens = tokens[0]
+    return tokens if isinstance(tokens, list) else [tokens]
+
+
+class Result:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    def to_host(self):
+        return [self.tokens]
+
+
+class FakeModule:
+    # A KV cache of the tokens fed so far, predicting from `sequence`.
+    def __init__(self, sequence):
+        self.sequence = sequence
+        self.cache = []
+        self.calls = {}
+
+    def next_token(self):
+        index = len(self.cache) - len(PROMPT)
+        return self.sequence[min(index, len(self.sequence) - 1)]
+
+    def __getitem__(self, name):
+        def call(*args):
+            self.calls[name] = self.calls.get(name, 0) + 1
+            return getattr(self, name)(*args)
+
+        return call
+
+    def run_initialize(self, tokens):
+        self.cache = list(ints(tokens))
+        return Result([self.next_token()])
+
+    def run_forward(self, token):
+        self.cache += ints(token)
+        return Result([self.next_token()])
+
+    def run_verify(self, tokens):
+        out = []
+        for token in ints(tokens):
+            self.cache.append(token)
+            out.append(self.next_token())
+        return Result(out)
+
+    def rollback_kvcache(self, count):
+        del self.cache[-count:]
+
+
+class FakeTokenizer:
+    class Encoding:
+        input_ids = torch.tensor([PROMPT])
+
+    def __call__(self, prompt, return_tensors=None):
+        return self.Encoding()
+
+    def decode(self, tokens):
+        return " ".join(str(int(t)) for t in tokens)
+
+
+def make_model(sequence, draft=None, num_draft_tokens=4):
+    model = LanguageModel.__new__(LanguageModel)
+    model.hf_model_name = MODEL_NAME
+    model.model = FakeModule(sequence)
+    model.tokenizer = FakeTokenizer()
+    model.to_device = lambda tokens: tokens
+    model.use_system_prompt = False
+    model.streaming_llm = False
+    model.first_input = True
+    model.global_iter = 0
+    model.prev_token_len = 0
+    model.max_tokens = 64
+    model.draft = draft
+    model.num_draft_tokens = num_draft_tokens
+    model.spec_stats = {"drafted": 0, "accepted": 0, "target_calls": 0}
+    return model
+
+
+def forward_calls(module):
+    # Cache rollbacks don't run the model.
+    return sum(
+        count for name, count in module.calls.items() if name != "rollback_kvcache"
+    )
+
+
+def run(model):
+    outputs = list(model.chat("hi"))
+    return [int(t) for t in outputs[-1][0].split()]
+
+
+class SpeculativeDecodingTest(unittest.TestCase):
+    def test01_MatchesGreedyWithFewerTargetCalls(self):
+        greedy = make_model(TARGET)
+        assert run(greedy) == TARGET
+        greedy_calls = forward_calls(greedy.model)
+
+        spec = make_model(TARGET, draft=make_model(DRAFT))
+        assert run(spec) == TARGET
+        target_calls = forward_calls(spec.model)
+        assert target_calls == spec.spec_stats["target_calls"]
+        assert target_calls < greedy_calls
+        assert target_calls / len(TARGET) < 0.5
+        assert "run_initialize" not in spec.draft.model.calls or (
+            spec.draft.model.calls["run_initialize"] == 1
+        )
+
+    def test02_CachesRolledBackToAcceptedContext(self):
+        spec = make_model(TARGET, draft=make_model(DRAFT), num_draft_tokens=3)
+        assert run(spec) == TARGET
+        # Both caches end at the accepted context, never past a rejection.
+        generated = spec.model.cache[len(PROMPT) :]
+        assert generated == TARGET[: len(generated)]
+        assert spec.acceptance_rate() < 1.0
+
+
+if __name__ == "__main__":
+    unittest.main()
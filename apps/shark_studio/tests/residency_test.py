@@ -0,0 +1,89 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import threading
+import unittest
+from apps.shark_studio.web.utils.residency import ModelResidency, make_key
+
+
+class ResidencyTest(unittest.TestCase):
+    def test01_LRUEviction(self):
+        residency = ModelResidency(max_models=2)
+        residency.load("a", lambda: "model_a", "sd")
+        residency.load("b", lambda: "model_b", "llm")
+        # touching "a" makes "b" the least recently used entry.
+        assert residency.get("a") == "model_a"
+        residency.load("c", lambda: "model_c", "sd")
+        assert residency.get("b") is None
+        assert residency.get("a") == "model_a"
+        assert residency.get("c") == "model_c"
+
+    def test02_PinnedNotEvicted(self):
+        residency = ModelResidency(max_models=1)
+        residency.load("a", lambda: "model_a", "sd")
+        residency.pin("a")
+        residency.load("b", lambda: "model_b", "sd")
+        assert residency.get("a") == "model_a"
+        assert residency.get("b") == "model_b"
+
+    def test03_DeviceBudget(self):
+        residency = ModelResidency(device_budget=100)
+        sizer = lambda obj: 60
+        residency.load("a", lambda: "model_a", "sd", "vulkan://0", sizer)
+        residency.load("b", lambda: "model_b", "sd", "vulkan://1", sizer)
+        assert residency.get("a") == "model_a"
+        residency.load("c", lambda: "model_c", "llm", "vulkan://0", sizer)
+        assert residency.get("a") is None
+        assert residency.get("b") == "model_b"
+
+    def test04_KeyIsOrderIndependent(self):
+        assert make_key("sd", {"a": 1, "b": 2}) == make_key("sd", {"b": 2, "a": 1})
+
+    def test05_LoadDoesNotBlockOtherCallers(self):
+        residency = ModelResidency()
+        residency.load("a", lambda: "model_a", "sd")
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_loader():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "model_b"
+
+        results = []
+        loads = [
+            threading.Thread(
+                target=lambda: results.append(residency.load("b", slow_loader, "llm"))
+            )
+            for _ in range(2)
+        ]
+        loads[0].start()
+        assert started.wait(5)
+        loads[1].start()
+        # Other models and the status stay available while "b" loads.
+        assert residency.get("a") == "model_a"
+        assert residency.status()["loading"] == ["b"]
+        release.set()
+        for t in loads:
+            t.join(5)
+        assert results == ["model_b", "model_b"]
+        assert len(calls) == 1
+        assert residency.status()["loading"] == []
+
+    def test06_FailedLoadCanBeRetried(self):
+        residency = ModelResidency()
+
+        def failing_loader():
+            raise RuntimeError("compile failed")
+
+        with self.assertRaises(RuntimeError):
+            residency.load("a", failing_loader, "sd")
+        assert residency.load("a", lambda: "model_a", "sd") == "model_a"
+
+
+if __name__ == "__main__":
+    unittest.main()
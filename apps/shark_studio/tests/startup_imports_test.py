@@ -0,0 +1,46 @@
+# Copyright 2024 Nod Labs, Inc
+#
+# Licensed under the Apache License v2.0 with LLVM Exceptions.
+# See https://llvm.org/LICENSE.txt for license information.
+# SPDX-License-Identifier: Apache-2.0 WITH LLVM-exception
+
+import subprocess
+import sys
+import unittest
+
+# Runs the startup imports and builds the UI tabs the way index.py does, then
+# lists which model libraries got loaded on the way.
+STARTUP = """
+import sys
+import apps.shark_studio.api.initializers as initialize
+
+initialize.imports()
+from apps.shark_studio.web.ui.chat import chat_element
+from apps.shark_studio.web.ui.sd import sd_element
+from apps.shark_studio.web.ui.outputgallery import outputgallery_element
+
+print(",".join(m for m in {modules} if m in sys.modules))
+"""
+
+MODEL_LIBRARIES = ["torch", "diffusers", "transformers", "turbine_models"]
+
+
+class StartupImportsTest(unittest.TestCase):
+    def run_startup(self, *args):
+        result = subprocess.run(
+            [sys.executable, "-c", STARTUP.format(modules=MODEL_LIBRARIES), *args],
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.strip().splitlines()[-1]
+
+    def test01_DeferredImportsKeepModelLibrariesOut(self):
+        assert self.run_startup() == ""
+
+    def test02_EagerImportsLoadTorch(self):
+        assert "torch" in self.run_startup("--no-defer_imports").split(",")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,7 @@
+import asyncio
 import base64
 import io
+import json
 import os
 import time
 import datetime
@@ -15,13 +17,20 @@ from io import BytesIO
 from fastapi import APIRouter, Depends, FastAPI, Request, Response
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.exceptions import HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
 
 from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
 
 # from sdapi_v1 import shark_sd_api
-from apps.shark_studio.api.llm import llm_chat_api
+from apps.shark_studio.modules.lazy_modules import lazy_function, lazy_generator
+from apps.shark_studio.modules.llm_metrics import llm_metrics
+
+# Importing api.llm pulls in torch, transformers and turbine_models, so it is
+# deferred until the first chat request.
+llm_chat_api = lazy_function("apps.shark_studio.api.llm", "llm_chat_api")
+llm_chat_api_stream = lazy_generator("apps.shark_studio.api.llm", "llm_chat_api_stream")
 
 
 def decode_base64_to_image(encoding):
@@ -220,12 +229,28 @@ class ApiCompat:
         # self.add_api_route("/sdapi/v1/script-info", self.get_script_info, methods=["GET"], response_model=List[models.ScriptInfo])
 
         # chat APIs needed for compatibility with multiple extensions using OpenAI API
-        self.add_api_route("/v1/chat/completions", llm_chat_api, methods=["POST"])
-        self.add_api_route("/v1/completions", llm_chat_api, methods=["POST"])
-        self.add_api_route("/chat/completions", llm_chat_api, methods=["POST"])
-        self.add_api_route("/completions", llm_chat_api, methods=["POST"])
+        self.add_api_route("/v1/chat/completions", self.llm_chat, methods=["POST"])
+        self.add_api_route("/v1/completions", self.llm_chat, methods=["POST"])
+        self.add_api_route("/chat/completions", self.llm_chat, methods=["POST"])
+        self.add_api_route("/completions", self.llm_chat, methods=["POST"])
+        self.add_api_route(
+            "/v1/engines/codegen/completions", self.llm_chat, methods=["POST"]
+        )
+
+        # model residency management
+        self.add_api_route(
+            "/sdapi/v1/resident-models", self.get_resident_models, methods=["GET"]
+        )
+        self.add_api_route("/sdapi/v1/load-model", self.load_model, methods=["POST"])
+        self.add_api_route(
+            "/sdapi/v1/unload-model", self.unload_model, methods=["POST"]
+        )
+        self.add_api_route("/sdapi/v1/pin-model", self.pin_model, methods=["POST"])
+        self.add_api_route(
+            "/sdapi/v1/llm-metrics", self.get_llm_metrics, methods=["GET"]
+        )
         self.add_api_route(
-            "/v1/engines/codegen/completions", llm_chat_api, methods=["POST"]
+            "/sdapi/v1/trace-stats", self.get_trace_stats, methods=["GET"]
         )
 
         self.default_script_arg_txt2img = []
@@ -234,6 +259,116 @@ class ApiCompat:
     def add_api_route(self, path: str, endpoint, **kwargs):
         return self.app.add_api_route(path, endpoint, **kwargs)
 
+    def get_resident_models(self):
+        import apps.shark_studio.web.utils.globals as global_obj
+        from shark.iree_utils.parameter_utils import get_parameter_memory_stats
+
+        status = global_obj.get_residency().status()
+        status["parameter_archives"] = get_parameter_memory_stats()
+        return status
+
+    def load_model(self, InputData: dict):
+        # {"kind": "llm", "model": ..., "device": ...} or
+        # {"kind": "sd", "pipe_kwargs": {...}} with the pipeline init kwargs.
+        kind = InputData.get("kind", "llm")
+        with self.queue_lock:
+            if kind == "llm":
+                from apps.shark_studio.api.llm import load_llm
+
+                load_llm(
+                    InputData.get("model", "meta-llama/Llama-2-7b-chat-hf"),
+                    InputData.get("device", "cpu"),
+                )
+            elif kind == "sd":
+                from apps.shark_studio.api.sd import load_sd_pipe
+
+                load_sd_pipe(InputData["pipe_kwargs"])
+            else:
+                raise HTTPException(
+                    status_code=422, detail=f"Unknown model kind: {kind}"
+                )
+        return self.get_resident_models()
+
+    def unload_model(self, InputData: dict):
+        import apps.shark_studio.web.utils.globals as global_obj
+
+        with self.queue_lock:
+            unloaded = global_obj.get_residency().unload(InputData["key"])
+        if not unloaded:
+            raise HTTPException(status_code=404, detail="Model is not loaded")
+        return self.get_resident_models()
+
+    def pin_model(self, InputData: dict):
+        import apps.shark_studio.web.utils.globals as global_obj
+
+        pinned = InputData.get("pinned", True)
+        with self.queue_lock:
+            found = global_obj.get_residency().pin(InputData["key"], pinned)
+        if not found:
+            raise HTTPException(status_code=404, detail="Model is not loaded")
+        return self.get_resident_models()
+
+    def get_llm_metrics(self):
+        return llm_metrics.summary()
+
+    def get_trace_stats(self):
+        from shark.iree_utils.trace import tracer
+
+        return {"enabled": tracer.enabled, "spans": tracer.stats()}
+
+    def run_llm_chat(self, InputData: dict, queued_at):
+        with self.queue_lock:
+            return llm_chat_api(InputData, queued_at)
+
+    async def llm_chat(self, InputData: dict, request: Request):
+        queued_at = time.time()
+        if not InputData.get("stream", False):
+            return await run_in_threadpool(self.run_llm_chat, InputData, queued_at)
+        return StreamingResponse(
+            self.llm_chat_events(InputData, request, queued_at),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"},
+        )
+
+    async def llm_chat_events(self, InputData: dict, request: Request, queued_at):
+        # Generation runs on a worker thread and hands chunks to the event loop
+        # through a queue, so the server keeps serving other requests while
+        # tokens are decoded.
+        loop = asyncio.get_running_loop()
+        chunks = asyncio.Queue()
+        cancel_event = threading.Event()
+
+        def produce():
+            try:
+                with self.queue_lock:
+                    if cancel_event.is_set():
+                        return
+                    for chunk in llm_chat_api_stream(
+                        InputData, cancel_event, queued_at
+                    ):
+                        loop.call_soon_threadsafe(chunks.put_nowait, chunk)
+            finally:
+                loop.call_soon_threadsafe(chunks.put_nowait, None)
+
+        worker = loop.run_in_executor(None, produce)
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.get(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    continue
+                if chunk is None:
+                    break
+                yield f"data: {json.dumps(chunk)}\n\n"
+            if not cancel_event.is_set() and not await request.is_disconnected():
+                await worker
+                yield "data: [DONE]\n\n"
+        finally:
+            # Stops the decode loop if the client went away mid-stream.
+            cancel_event.set()
+
     # def refresh_checkpoints(self):
     #     with self.queue_lock:
     #         studio_data.refresh_checkpoints()
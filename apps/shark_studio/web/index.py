@@ -46,6 +46,7 @@ def api_only():
     # script_callbacks.app_started_callback(None, app)
 
     print(f"Startup time: {startup_timer.summary()}.")
+    initialize.preload(["apps.shark_studio.api.llm"])
     api.launch(
         server_name="0.0.0.0",
         port=cmd_opts.server_port,
@@ -198,6 +199,9 @@ def webui():
                 chat_element.render()
 
     studio_web.queue()
+    startup_timer.record("build ui")
+    print(f"Startup time: {startup_timer.summary()}.")
+    initialize.preload(["apps.shark_studio.api.sd", "apps.shark_studio.api.llm"])
 
     # if args.ui == "app":
     #    t = Process(
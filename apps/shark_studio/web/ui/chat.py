@@ -5,10 +5,7 @@ from pathlib import Path
 from datetime import datetime as dt
 import json
 import sys
-from apps.shark_studio.api.llm import (
-    llm_model_map,
-    LanguageModel,
-)
+from apps.shark_studio.api.llm_models import llm_model_map
 from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
 import apps.shark_studio.web.utils.globals as global_obj
 
@@ -56,6 +53,8 @@ def chat_fn(
         language_model = None
         return "Clearing history...", ""
     if language_model is None:
+        from apps.shark_studio.api.llm import LanguageModel
+
         history[-1][-1] = "Getting the model ready..."
         yield history, ""
         language_model = LanguageModel(
@@ -66,6 +65,8 @@ def chat_fn(
             use_system_prompt=prompt_prefix,
             streaming_llm=streaming_llm,
             hf_auth_token=cmd_opts.hf_auth_token,
+            draft_model=cmd_opts.llm_draft_model,
+            num_draft_tokens=cmd_opts.llm_num_draft_tokens,
         )
         history[-1][-1] = "Getting the model ready... Done"
         yield history, ""
@@ -84,7 +85,10 @@ def chat_fn(
             total_time += exec_time
             token_count += 1
             tokens_per_sec = token_count / total_time
-            yield history, f"Prefill: {prefill_time:.2f} seconds\n Decode: {tokens_per_sec:.2f} tokens/sec"
+            stats = f"Prefill: {prefill_time:.2f} seconds\n Decode: {tokens_per_sec:.2f} tokens/sec"
+            if language_model.draft is not None:
+                stats += f"\n Draft acceptance: {language_model.acceptance_rate():.0%}"
+            yield history, stats
 
 
 def view_json_file(file_obj):
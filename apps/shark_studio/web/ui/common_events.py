@@ -2,12 +2,14 @@ from apps.shark_studio.web.ui.utils import (
     HSLHue,
     hsl_color,
 )
-from apps.shark_studio.modules.embeddings import get_lora_metadata
 
 
 # Answers HTML to show the most frequent tags used when a LoRA was trained,
 # taken from the metadata of its .safetensors file.
 def lora_changed(lora_files):
+    # embeddings imports torch, so it's only loaded once a LoRA is picked.
+    from apps.shark_studio.modules.embeddings import get_lora_metadata
+
     # tag frequency percentage, that gets maximum amount of the staring hue
     TAG_COLOR_THRESHOLD = 0.55
     # tag frequency percentage, above which a tag is displayed
@@ -1,5 +1,5 @@
-import glob
 import gradio as gr
+import math
 import os
 import subprocess
 import sys
@@ -12,24 +12,50 @@ from apps.shark_studio.web.utils.file_utils import (
 )
 from apps.shark_studio.web.ui.utils import amdlogo_loc
 from apps.shark_studio.web.utils.metadata import displayable_metadata
+from apps.shark_studio.web.utils.gallery_index import get_gallery_index
+from apps.shark_studio.modules.image_writer import get_image_writer
 
 # -- Functions for file, directory and image info querying
 
 output_dir = get_generated_imgs_path()
 
 
-def outputgallery_filenames(subdir) -> list[str]:
+def outputgallery_filenames(subdir, page=1, reconcile=False) -> list[str]:
+    # Listed from the gallery index, newest first, one page at a time. With
+    # reconcile, the first listing of a subdirectory since startup waits for
+    # the index to pick up images added to or removed from it outside of
+    # Studio; later ones reconcile in the background and show changes on the
+    # next refresh.
     new_dir_path = os.path.join(output_dir, subdir)
     if os.path.exists(new_dir_path):
-        filenames = [
-            glob.glob(new_dir_path + "/" + ext) for ext in ("*.png", "*.jpg", "*.jpeg")
-        ]
-
-        return sorted(sum(filenames, []), key=os.path.getmtime, reverse=True)
+        index = get_gallery_index()
+        if reconcile and not index.ensure_reconciled(subdir):
+            index.start_reconcile(subdir)
+        page_size = cmd_opts.output_gallery_page_size
+        if page_size <= 0:
+            return index.list_images(subdir)
+        return index.list_images(
+            subdir, offset=(max(int(page or 1), 1) - 1) * page_size, limit=page_size
+        )
     else:
         return []
 
 
+def outputgallery_page_count(subdir) -> int:
+    page_size = cmd_opts.output_gallery_page_size
+    if page_size <= 0 or not os.path.exists(os.path.join(output_dir, subdir)):
+        return 1
+    return max(math.ceil(get_gallery_index().count_images(subdir) / page_size), 1)
+
+
+def outputgallery_label(subdir, images, page=1) -> str:
+    label = f"{len(images)} images in {os.path.join(output_dir, subdir)}"
+    page_count = outputgallery_page_count(subdir)
+    if page_count > 1:
+        label += f" (page {page} of {page_count})"
+    return label
+
+
 def output_subdirs() -> list[str]:
     # Gets a list of subdirectories of output_dir and below, as relative paths.
     relative_paths = [
@@ -132,6 +158,14 @@ with gr.Blocks() as outputgallery_element:
             image_columns = gr.Slider(
                 label="Columns shown", value=4, minimum=1, maximum=16, step=1
             )
+            gallery_page = gr.Number(
+                label="Page",
+                value=1,
+                minimum=1,
+                precision=0,
+                interactive=True,
+                visible=cmd_opts.output_gallery_page_size > 0,
+            )
             outputgallery_filename = gr.Textbox(
                 label="Filename",
                 value="None",
@@ -178,8 +212,26 @@ with gr.Blocks() as outputgallery_element:
 
     def on_select_subdir(subdir) -> list:
         # evt.value is the subdirectory name
-        new_images = outputgallery_filenames(subdir)
-        new_label = f"{len(new_images)} images in {os.path.join(output_dir, subdir)}"
+        new_images = outputgallery_filenames(subdir, reconcile=True)
+        new_label = outputgallery_label(subdir, new_images)
+        return [
+            new_images,
+            gr.Gallery(
+                value=new_images,
+                label=new_label,
+                visible=len(new_images) > 0,
+            ),
+            gr.Image(
+                label=new_label,
+                visible=len(new_images) == 0,
+            ),
+            gr.Number(value=1),
+        ]
+
+    def on_select_page(subdir, page) -> list:
+        page = min(max(int(page or 1), 1), outputgallery_page_count(subdir))
+        new_images = outputgallery_filenames(subdir, page)
+        new_label = outputgallery_label(subdir, new_images, page)
         return [
             new_images,
             gr.Gallery(
@@ -191,6 +243,7 @@ with gr.Blocks() as outputgallery_element:
                 label=new_label,
                 visible=len(new_images) == 0,
             ),
+            gr.Number(value=page),
         ]
 
     def on_open_subdir(subdir):
@@ -204,7 +257,7 @@ with gr.Blocks() as outputgallery_element:
             elif sys.platform == "win32":
                 os.startfile(subdir_path)
 
-    def on_refresh(current_subdir: str) -> list:
+    def on_refresh(current_subdir: str, page=1) -> list:
         # get an up-to-date subdirectory list
         refreshed_subdirs = output_subdirs()
         # get the images using either the current subdirectory or the most
@@ -214,10 +267,11 @@ with gr.Blocks() as outputgallery_element:
             if current_subdir in refreshed_subdirs
             else refreshed_subdirs[0]
         )
-        new_images = outputgallery_filenames(new_subdir)
-        new_label = (
-            f"{len(new_images)} images in " f"{os.path.join(output_dir, new_subdir)}"
-        )
+        if new_subdir != current_subdir:
+            page = 1
+        page = min(max(int(page or 1), 1), outputgallery_page_count(new_subdir))
+        new_images = outputgallery_filenames(new_subdir, page, reconcile=True)
+        new_label = outputgallery_label(new_subdir, new_images, page)
 
         return [
             gr.Dropdown(
@@ -231,9 +285,10 @@ with gr.Blocks() as outputgallery_element:
                 label=new_label,
                 visible=len(new_images) == 0,
             ),
+            gr.Number(value=page),
         ]
 
-    def on_new_image(subdir, subdir_paths, status) -> list:
+    def on_new_image(subdir, subdir_paths, page, status) -> list:
         # prevent error triggered when an image generates before the tab
         # has even been selected
         subdir_paths = (
@@ -243,13 +298,13 @@ with gr.Blocks() as outputgallery_element:
         )
 
         # only update if the current subdir is the most recent one as
-        # new images only go there
-        if subdir_paths[0] == subdir:
+        # new images only go there, and they go on the first page
+        if subdir_paths[0] == subdir and int(page or 1) == 1:
+            # Images are saved and indexed in the background, so wait for the
+            # one that triggered this before listing.
+            get_image_writer().wait()
             new_images = outputgallery_filenames(subdir)
-            new_label = (
-                f"{len(new_images)} images in "
-                f"{os.path.join(output_dir, subdir)} - {status}"
-            )
+            new_label = f"{outputgallery_label(subdir, new_images)} - {status}"
 
             return [
                 new_images,
@@ -325,6 +380,7 @@ with gr.Blocks() as outputgallery_element:
                 gr.update(),
                 gr.update(),
                 gr.update(),
+                gr.update(),
             )
 
     # clearing images when we need to completely change what's in the
@@ -341,7 +397,14 @@ with gr.Blocks() as outputgallery_element:
     subdirectories.select(**clear_gallery).then(
         on_select_subdir,
         [subdirectories],
-        [gallery_files, gallery, logo],
+        [gallery_files, gallery, logo, gallery_page],
+        queue=False,
+    )
+
+    gallery_page.input(**clear_gallery).then(
+        on_select_page,
+        [subdirectories, gallery_page],
+        [gallery_files, gallery, logo, gallery_page],
         queue=False,
     )
 
@@ -349,8 +412,15 @@ with gr.Blocks() as outputgallery_element:
 
     refresh.click(**clear_gallery).then(
         on_refresh,
-        [subdirectories],
-        [subdirectories, subdirectory_paths, gallery_files, gallery, logo],
+        [subdirectories, gallery_page],
+        [
+            subdirectories,
+            subdirectory_paths,
+            gallery_files,
+            gallery,
+            logo,
+            gallery_page,
+        ],
         queue=False,
     )
 
@@ -388,6 +458,7 @@ with gr.Blocks() as outputgallery_element:
                 gallery_files,
                 gallery,
                 logo,
+                gallery_page,
                 open_subdir,
             ],
             queue=False,
@@ -400,7 +471,7 @@ with gr.Blocks() as outputgallery_element:
         for component in components:
             component.change(
                 on_new_image,
-                inputs=[subdirectories, subdirectory_paths, component],
+                inputs=[subdirectories, subdirectory_paths, gallery_page, component],
                 outputs=[gallery_files, gallery, logo],
                 queue=False,
             )
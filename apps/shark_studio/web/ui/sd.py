@@ -16,11 +16,7 @@ from apps.shark_studio.web.utils.file_utils import (
     get_configs_path,
     write_default_sd_configs,
 )
-from apps.shark_studio.api.sd import (
-    shark_sd_fn_dict_input,
-    cancel_sd,
-    unload_sd,
-)
+from apps.shark_studio.modules.lazy_modules import lazy_function, lazy_generator
 from apps.shark_studio.api.controlnet import (
     cnet_preview,
 )
@@ -53,6 +49,15 @@ sd_default_models = [
 ]
 
 
+# api.sd imports torch, diffusers and turbine_models; it is loaded on the first
+# generation instead of when the tab is built.
+shark_sd_fn_dict_input = lazy_generator(
+    "apps.shark_studio.api.sd", "shark_sd_fn_dict_input"
+)
+cancel_sd = lazy_function("apps.shark_studio.api.sd", "cancel_sd")
+unload_sd = lazy_function("apps.shark_studio.api.sd", "unload_sd")
+
+
 def view_json_file(file_path):
     content = ""
     with open(file_path, "r") as fopen:
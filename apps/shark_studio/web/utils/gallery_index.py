@@ -0,0 +1,244 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+"""
+SQLite index of generated images for the output gallery. The image writer
+adds each image as it is saved, so listing a subdirectory, searching by prompt
+or model and looking up an image's parameters don't need to glob/stat the
+output directory or parse imgs_details.csv. reconcile() picks up images that
+were added or removed outside of Studio.
+"""
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    subdir TEXT NOT NULL,
+    prompt TEXT,
+    negative_prompt TEXT,
+    seed TEXT,
+    model TEXT,
+    lora TEXT,
+    width INTEGER,
+    height INTEGER,
+    created REAL,
+    mtime REAL,
+    params TEXT
+);
+CREATE INDEX IF NOT EXISTS images_by_subdir ON images (subdir, mtime DESC);
+CREATE INDEX IF NOT EXISTS images_by_model ON images (model, mtime DESC);
+"""
+
+
+def first(value):
+    # Prompts are stored as single-element lists in the generation kwargs.
+    if isinstance(value, (list, tuple)):
+        return value[0] if value else None
+    return value
+
+
+class GalleryIndex:
+    def __init__(self, db_path, root):
+        self.root = os.path.abspath(root)
+        self.lock = threading.Lock()
+        # Subdirs (None for the whole tree) with a background reconcile running,
+        # and those reconciled since startup.
+        self.reconciling = set()
+        self.reconciled = set()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    def get_subdir(self, path):
+        return os.path.relpath(os.path.dirname(os.path.abspath(path)), self.root)
+
+    def add_image(self, path, details: dict = None, seed=None):
+        # Returns False, without indexing anything, if the file is gone.
+        path = os.path.abspath(path)
+        details = details or {}
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return False
+        embeddings = details.get("embeddings")
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO images VALUES "
+                "(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path,
+                    self.get_subdir(path),
+                    first(details.get("prompt")),
+                    first(details.get("negative_prompt")),
+                    str(seed if seed is not None else details.get("seed")),
+                    details.get("custom_weights") or details.get("base_model_id"),
+                    json.dumps(embeddings, default=str) if embeddings else None,
+                    details.get("width"),
+                    details.get("height"),
+                    time.time(),
+                    stat.st_mtime,
+                    json.dumps(details, default=str),
+                ),
+            )
+            self.conn.commit()
+        return True
+
+    def remove_images(self, paths):
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM images WHERE path = ?", [(p,) for p in paths]
+            )
+            self.conn.commit()
+
+    def list_images(self, subdir, offset=0, limit=-1):
+        # Newest first, like the gallery shows them.
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path FROM images WHERE subdir = ? "
+                "ORDER BY mtime DESC LIMIT ? OFFSET ?",
+                (os.path.normpath(subdir), limit, offset),
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def count_images(self, subdir):
+        with self.lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM images WHERE subdir = ?",
+                (os.path.normpath(subdir),),
+            ).fetchone()[0]
+
+    def search(self, prompt=None, model=None, offset=0, limit=100):
+        query = "SELECT path FROM images WHERE 1 = 1"
+        args = []
+        if prompt:
+            query += " AND prompt LIKE ?"
+            args.append(f"%{prompt}%")
+        if model:
+            query += " AND model LIKE ?"
+            args.append(f"%{model}%")
+        query += " ORDER BY mtime DESC LIMIT ? OFFSET ?"
+        with self.lock:
+            rows = self.conn.execute(query, args + [limit, offset]).fetchall()
+        return [row[0] for row in rows]
+
+    def get_params(self, path):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT params FROM images WHERE path = ?", (os.path.abspath(path),)
+            ).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return json.loads(row[0])
+
+    def reconcile(self, subdir=None):
+        """
+        Brings the index in line with the files on disk, for one subdir or the
+        whole output tree. New images get their parameters from a .json
+        sidecar if there is one. Returns (added, removed) counts.
+        """
+        top = os.path.join(self.root, subdir) if subdir else self.root
+        on_disk = {}
+        for dirpath, _, filenames in os.walk(top):
+            for f in filenames:
+                if f.lower().endswith(IMAGE_EXTENSIONS):
+                    path = os.path.abspath(os.path.join(dirpath, f))
+                    try:
+                        on_disk[path] = os.path.getmtime(path)
+                    except OSError:
+                        # Deleted during the walk, or a broken link.
+                        continue
+            if subdir:
+                break
+
+        with self.lock:
+            if subdir:
+                rows = self.conn.execute(
+                    "SELECT path, mtime FROM images WHERE subdir = ?",
+                    (os.path.normpath(subdir),),
+                ).fetchall()
+            else:
+                rows = self.conn.execute("SELECT path, mtime FROM images").fetchall()
+        indexed = dict(rows)
+
+        removed = [p for p in indexed if p not in on_disk]
+        if removed:
+            self.remove_images(removed)
+        added = 0
+        for path, mtime in on_disk.items():
+            if indexed.get(path) == mtime:
+                continue
+            details = None
+            json_path = os.path.splitext(path)[0] + ".json"
+            if os.path.isfile(json_path):
+                try:
+                    with open(json_path) as f:
+                        details = json.load(f)
+                except (OSError, ValueError):
+                    details = None
+            if self.add_image(path, details):
+                added += 1
+        with self.lock:
+            self.reconciled.add(os.path.normpath(subdir) if subdir else None)
+        return added, len(removed)
+
+    def ensure_reconciled(self, subdir):
+        """
+        Reconciles subdir before returning unless it (or the whole tree) has
+        been reconciled since startup, so images from before the index existed
+        or added outside of Studio show up on the first listing. Returns
+        whether it reconciled.
+        """
+        with self.lock:
+            if {None, os.path.normpath(subdir)} & self.reconciled:
+                return False
+        self.reconcile(subdir)
+        return True
+
+    def start_reconcile(self, subdir=None):
+        """
+        Runs reconcile(subdir) on a background thread, so callers only ever
+        wait on index reads. Returns the thread, or None if a reconcile of
+        the same subdir is already running.
+        """
+        with self.lock:
+            if subdir in self.reconciling:
+                return None
+            self.reconciling.add(subdir)
+
+        def reconcile():
+            try:
+                added, removed = self.reconcile(subdir)
+            finally:
+                with self.lock:
+                    self.reconciling.discard(subdir)
+            if added or removed or subdir is None:
+                print(
+                    f"[LOG] Gallery index reconciled: {added} added, "
+                    f"{removed} removed."
+                )
+
+        thread = threading.Thread(target=reconcile, daemon=True)
+        thread.start()
+        return thread
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_gallery_index():
+    global _index
+    from apps.shark_studio.web.utils.file_utils import get_generated_imgs_path
+
+    with _index_lock:
+        if _index is None:
+            root = get_generated_imgs_path()
+            _index = GalleryIndex(os.path.join(root, "gallery_index.sqlite3"), root)
+            _index.start_reconcile()
+        return _index
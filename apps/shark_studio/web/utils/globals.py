@@ -1,58 +1,115 @@
 import gc
+import os
 from ...api.utils import get_available_devices
+from ...modules.device_cache import DeviceCache
+from ...modules.timer import startup_timer
+from .residency import ModelResidency, get_total_host_bytes
+from shark.iree_utils.parameter_utils import release_parameter_archives
 
 """
 The global objects include SD pipeline and config.
 Maintaining the global objects would avoid creating extra pipeline objects when switching modes.
-Also we could avoid memory leak when switching models by clearing the cache.
+Loaded pipelines and models live in a residency manager keyed by their init kwargs,
+so switching between SD and LLM jobs only reloads once the memory budget is exceeded.
 """
 
 
 def _init():
-    global _sd_obj
-    global _llm_obj
+    global _sd_key
+    global _llm_key
+    global _residency
     global _devices
     global _pipe_kwargs
     global _prep_kwargs
     global _gen_kwargs
     global _schedulers
-    _sd_obj = None
-    _llm_obj = None
+    global _sd_status
+    _sd_key = None
+    _llm_key = None
+    _sd_status = None
+    _residency = create_residency()
+    startup_timer.record("create residency")
     _devices = None
     _pipe_kwargs = None
     _prep_kwargs = None
     _gen_kwargs = None
     _schedulers = None
+    _sd_status = None
     set_devices()
+    startup_timer.record("list devices")
 
 
-def set_sd_obj(value):
-    global _sd_obj
-    global _llm_obj
-    _llm_obj = None
-    _sd_obj = value
+def create_residency():
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
 
+    GB = 1024**3
+    if cmd_opts.residency_host_budget > 0:
+        host_budget = int(cmd_opts.residency_host_budget * GB)
+    else:
+        total = get_total_host_bytes()
+        host_budget = int(total * 0.75) if total else None
+    device_budget = (
+        int(cmd_opts.residency_device_budget * GB)
+        if cmd_opts.residency_device_budget > 0
+        else None
+    )
+    max_models = (
+        cmd_opts.residency_max_models if cmd_opts.residency_max_models > 0 else None
+    )
+    return ModelResidency(host_budget, device_budget, max_models)
 
-def set_llm_obj(value):
-    global _sd_obj
-    global _llm_obj
-    _llm_obj = value
-    _sd_obj = None
+
+def get_residency():
+    global _residency
+    return _residency
+
+
+def set_sd_obj(value, key="sd", device=None, sizer=None):
+    global _sd_key
+    _sd_key = key
+    if value is not None and _residency.get(key) is None:
+        _residency.load(key, lambda: value, "sd", device=device, sizer=sizer)
+
+
+def set_llm_obj(value, key="llm", device=None, sizer=None):
+    global _llm_key
+    _llm_key = key
+    if value is not None and _residency.get(key) is None:
+        _residency.load(key, lambda: value, "llm", device=device, sizer=sizer)
 
 
 def set_devices():
     global _devices
-    _devices = get_available_devices()
+    from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+
+    if not cmd_opts.device_cache:
+        _devices = get_available_devices()
+        return
+    cache = DeviceCache(
+        os.path.join(cmd_opts.tmp_dir, "device_cache.json"), get_available_devices
+    )
+    _devices = cache.load()
+    if cache.from_cache:
+        cache.start_revalidate(on_change=update_devices)
+
+
+def update_devices(devices):
+    # Called from the device cache revalidation thread. Dropdowns that were
+    # already built keep their choices until the UI is reloaded.
+    global _devices
+    _devices = devices
 
 
 def set_sd_scheduler(key):
-    global _sd_obj
-    _sd_obj.scheduler = _schedulers[key]
+    sd_obj = get_sd_obj()
+    if sd_obj is not None:
+        sd_obj.scheduler = _schedulers[key]
 
 
 def set_sd_status(value):
-    global _sd_obj
-    _sd_obj.status = value
+    # Kept outside the pipeline, which the residency manager may evict.
+    global _sd_status
+    _sd_status = value
 
 
 def set_pipe_kwargs(value):
@@ -76,13 +133,13 @@ def set_schedulers(value):
 
 
 def get_sd_obj():
-    global _sd_obj
-    return _sd_obj
+    global _sd_key
+    return _residency.get(_sd_key) if _sd_key else None
 
 
 def get_llm_obj():
-    global _llm_obj
-    return _llm_obj
+    global _llm_key
+    return _residency.get(_llm_key) if _llm_key else None
 
 
 def get_device_list():
@@ -91,8 +148,8 @@ def get_device_list():
 
 
 def get_sd_status():
-    global _sd_obj
-    return _sd_obj.status
+    global _sd_status
+    return _sd_status
 
 
 def get_pipe_kwargs():
@@ -116,19 +173,21 @@ def get_scheduler(key):
 
 
 def clear_cache():
-    global _sd_obj
-    global _llm_obj
+    global _sd_key
+    global _llm_key
     global _pipe_kwargs
     global _prep_kwargs
     global _gen_kwargs
     global _schedulers
-    del _sd_obj
-    del _llm_obj
+    global _sd_status
+    _residency.clear()
+    release_parameter_archives()
     del _schedulers
     gc.collect()
-    _sd_obj = None
-    _llm_obj = None
+    _sd_key = None
+    _llm_key = None
     _pipe_kwargs = None
     _prep_kwargs = None
     _gen_kwargs = None
     _schedulers = None
+    _sd_status = None
@@ -5,6 +5,7 @@ from .png_metadata import parse_generation_parameters
 from .exif_metadata import has_exif, parse_exif
 from .csv_metadata import has_csv, parse_csv
 from .format import compact, humanize
+from ..gallery_index import get_gallery_index
 
 
 def displayable_metadata(image_filename: str) -> dict:
@@ -23,6 +24,14 @@ def displayable_metadata(image_filename: str) -> dict:
             ),
         }
 
+    # the gallery index has the parameters of images saved by Studio
+    params = get_gallery_index().get_params(image_filename)
+    if params:
+        return {
+            "source": "index",
+            "parameters": compact(humanize(params, includes_filename=False)),
+        }
+
     # we have a matching json file (next most likely to be accurate when it's there)
     json_path = os.path.splitext(image_filename)[0] + ".json"
     if os.path.isfile(json_path):
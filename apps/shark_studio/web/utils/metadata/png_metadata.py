@@ -3,8 +3,6 @@ from pathlib import Path
 from apps.shark_studio.web.utils.file_utils import (
     get_checkpoint_pathfile,
 )
-from apps.shark_studio.api.sd import EMPTY_SD_MAP as sd_model_map
-
 from apps.shark_studio.modules.schedulers import (
     scheduler_model_map,
 )
@@ -83,6 +81,9 @@ def try_find_model_base_from_png_metadata(file: str, folder: str = "models") ->
 def find_model_from_png_metadata(
     key: str, metadata: dict[str, str | int]
 ) -> tuple[str, str]:
+    # api.sd pulls in torch and turbine, so it's only imported when needed.
+    from apps.shark_studio.api.sd import EMPTY_SD_MAP as sd_model_map
+
     png_hf_id = ""
     png_custom = ""
 
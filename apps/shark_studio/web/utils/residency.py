@@ -0,0 +1,257 @@
+import gc
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+"""
+Keeps several loaded pipelines/models resident at once so that alternating
+between e.g. SD and chat requests doesn't force a reload every time.
+Entries are evicted least-recently-used first, and only once the host/device
+memory budget or the model count limit is exceeded. Pinned entries are never
+evicted.
+"""
+
+
+def make_key(kind, kwargs: dict):
+    return f"{kind}:" + json.dumps(kwargs, sort_keys=True, default=str)
+
+
+def get_rss_bytes():
+    try:
+        import psutil
+    except ImportError:
+        return 0
+    return psutil.Process(os.getpid()).memory_info().rss
+
+
+def get_total_host_bytes():
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.virtual_memory().total
+
+
+def get_artifact_bytes(paths):
+    # Size on disk of the compiled modules and weights backing a model, which
+    # is a reasonable stand-in for what it occupies once loaded.
+    total = 0
+    for path in paths:
+        if not path or not os.path.exists(path):
+            continue
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+            continue
+        for dirpath, _, filenames in os.walk(path):
+            for f in filenames:
+                total += os.path.getsize(os.path.join(dirpath, f))
+    return total
+
+
+def is_host_device(device):
+    return device is None or "cpu" in device or "local" in device
+
+
+class ResidentModel:
+    def __init__(self, key, obj, kind, device, sizer=None):
+        self.key = key
+        self.obj = obj
+        self.kind = kind
+        self.device = device
+        self.sizer = sizer
+        self.pinned = False
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.host_bytes = 0
+        self.device_bytes = 0
+
+    def info(self):
+        return {
+            "key": self.key,
+            "kind": self.kind,
+            "device": self.device,
+            "pinned": self.pinned,
+            "host_bytes": self.host_bytes,
+            "device_bytes": self.device_bytes,
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+        }
+
+
+class ModelResidency:
+    def __init__(self, host_budget=None, device_budget=None, max_models=None):
+        # Budgets are in bytes; None means unlimited.
+        self.host_budget = host_budget
+        self.device_budget = device_budget
+        self.max_models = max_models
+        self.entries = OrderedDict()
+        # Futures of the models being loaded, by key.
+        self.loading = {}
+        self.lock = threading.RLock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            entry = self.entries[key]
+            entry.last_used = time.time()
+            self.entries.move_to_end(key)
+            return entry.obj
+
+    def load(self, key, loader, kind, device=None, sizer=None, size_hint=0):
+        """Returns the resident object for key, calling loader() to build it
+        if it isn't loaded. sizer(obj) should return the estimated bytes of
+        the model's artifacts and is re-run by refresh() after weights change.
+        size_hint is the expected size before loading, if known.
+
+        loader() runs without holding the lock, so other models stay usable
+        while one compiles. Concurrent loads of the same key wait for the
+        first one instead of loading it again."""
+        with self.lock:
+            obj = self.get(key)
+            if obj is not None:
+                return obj
+            future = self.loading.get(key)
+            if future is None:
+                future = self.loading[key] = Future()
+                # Make room up front so the new model isn't loaded on top of
+                # an already full budget.
+                self._evict(
+                    host_needed=size_hint if is_host_device(device) else 0,
+                    device_needed=0 if is_host_device(device) else size_hint,
+                    device=device,
+                    count_needed=len(self.loading),
+                )
+            else:
+                loader = None
+        if loader is None:
+            return future.result()
+
+        try:
+            rss_before = get_rss_bytes()
+            obj = loader()
+            entry = ResidentModel(key, obj, kind, device, sizer)
+            entry.host_bytes = max(get_rss_bytes() - rss_before, 0)
+            self._size(entry)
+        except BaseException as e:
+            with self.lock:
+                del self.loading[key]
+            future.set_exception(e)
+            raise
+        with self.lock:
+            del self.loading[key]
+            self.entries[key] = entry
+            self._evict(keep=key)
+            print(f"[LOG] Resident models: {len(self.entries)}")
+        future.set_result(obj)
+        return obj
+
+    def refresh(self, key):
+        # Re-measure an entry after it has been prepared/compiled.
+        with self.lock:
+            entry = self.entries.get(key)
+        if entry is None:
+            return
+        self._size(entry)
+        with self.lock:
+            if key in self.entries:
+                self._evict(keep=key)
+
+    def unload(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        print(f"[LOG] Unloading {entry.key}")
+        del entry
+        gc.collect()
+        return True
+
+    def unload_kind(self, kind):
+        with self.lock:
+            keys = [k for k, e in self.entries.items() if e.kind == kind]
+        for key in keys:
+            self.unload(key)
+
+    def pin(self, key, pinned=True):
+        with self.lock:
+            if key not in self.entries:
+                return False
+            self.entries[key].pinned = pinned
+            return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+        gc.collect()
+
+    def status(self):
+        with self.lock:
+            return {
+                "host_budget": self.host_budget,
+                "device_budget": self.device_budget,
+                "max_models": self.max_models,
+                "host_bytes": self.host_bytes(),
+                "models": [e.info() for e in self.entries.values()],
+                "loading": list(self.loading),
+            }
+
+    def host_bytes(self):
+        return sum(e.host_bytes for e in self.entries.values())
+
+    def device_bytes(self, device):
+        return sum(e.device_bytes for e in self.entries.values() if e.device == device)
+
+    def _size(self, entry):
+        estimate = entry.sizer(entry.obj) if entry.sizer else 0
+        if is_host_device(entry.device):
+            entry.host_bytes = max(entry.host_bytes, estimate)
+        else:
+            entry.device_bytes = estimate
+
+    def _over_budget(self, host_needed, device_needed, device, count_needed):
+        # Returns a filter selecting the entries whose eviction would help, or
+        # None if everything fits.
+        if (
+            self.max_models is not None
+            and len(self.entries) + count_needed > self.max_models
+        ):
+            return lambda e: True
+        if (
+            self.host_budget is not None
+            and self.host_bytes() + host_needed > self.host_budget
+        ):
+            return lambda e: e.host_bytes > 0
+        devices = {e.device for e in self.entries.values()}
+        if device is not None:
+            devices.add(device)
+        for d in devices:
+            if is_host_device(d) or self.device_budget is None:
+                continue
+            needed = device_needed if d == device else 0
+            if self.device_bytes(d) + needed > self.device_budget:
+                return lambda e, d=d: e.device == d
+        return None
+
+    def _evict(
+        self, host_needed=0, device_needed=0, device=None, count_needed=0, keep=None
+    ):
+        while True:
+            candidates = self._over_budget(
+                host_needed, device_needed, device, count_needed
+            )
+            if candidates is None:
+                return
+            # Least recently used entries sit at the front of the dict.
+            victims = [
+                k
+                for k, e in self.entries.items()
+                if not e.pinned and k != keep and candidates(e)
+            ]
+            if not victims:
+                print("[WARN] Model residency budget exceeded by pinned models.")
+                return
+            self.unload(victims[0])
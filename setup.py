@@ -34,5 +34,8 @@ setup(
     install_requires=[
         "numpy",
         "PyYAML",
-    ]
+    ],
+    entry_points={
+        "torch_dynamo_backends": ["shark = shark:shark"],
+    },
 )
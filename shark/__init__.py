@@ -1,12 +1,10 @@
 import importlib
 import logging
-
-from torch._dynamo import register_backend
+import sys
 
 log = logging.getLogger(__name__)
 
 
-@register_backend
 def shark(model, inputs, *, options):
     try:
         from shark.dynamo_backend.utils import SharkBackend
@@ -20,6 +18,19 @@ def shark(model, inputs, *, options):
     return SharkBackend(model, inputs, options)
 
 
+def register_dynamo_backend():
+    from torch._dynamo import register_backend
+
+    register_backend(shark)
+
+
+# Importing torch._dynamo is slow, so the backend is only registered here when
+# torch is already loaded. Otherwise dynamo finds it through the
+# torch_dynamo_backends entry point, or call register_dynamo_backend().
+if "torch" in sys.modules:
+    register_dynamo_backend()
+
+
 def has_shark():
     try:
         importlib.import_module("shark")
@@ -1,5 +1,9 @@
 import functools
+import hashlib
+import itertools
+import os
 from typing import List, Optional
+import numpy as np
 import torch
 from torch.fx.experimental.proxy_tensor import make_fx
 from torch._functorch.compile_utils import strip_overloads
@@ -93,7 +97,95 @@ def _unwrap_single_tuple_return(fx_g: torch.fx.GraphModule) -> bool:
     return unwrapped_tuple
 
 
+def get_cache_dir(options: dict) -> str:
+    return options.get("cache_dir") or os.getenv(
+        "SHARK_DYNAMO_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "shark", "dynamo"),
+    )
+
+
+def _get_attr(module, target: str):
+    for atom in target.split("."):
+        module = getattr(module, atom)
+    return module
+
+
+def _hash_tensor(h, name: str, tensor: torch.Tensor):
+    h.update(name.encode())
+    h.update(f"{tuple(tensor.shape)}{tensor.dtype}".encode())
+    h.update(
+        tensor.detach().cpu().reshape(-1).contiguous().view(torch.uint8).numpy()
+    )
+
+
+def graph_hash(fx_g: torch.fx.GraphModule, device: str) -> str:
+    """
+    Hashes the graph's code, the modules it calls, its parameters, buffers
+    and tensor constants, and the versions of the tools that compile it, so
+    graphs that would compile to the same module share a cache entry.
+    """
+    import torch_mlir
+
+    h = hashlib.sha256()
+    h.update(fx_g.code.encode())
+    for node in fx_g.graph.nodes:
+        if node.op == "call_module":
+            h.update(repr(fx_g.get_submodule(node.target)).encode())
+        elif node.op == "get_attr":
+            value = _get_attr(fx_g, node.target)
+            if isinstance(value, torch.Tensor):
+                _hash_tensor(h, node.target, value)
+    for name, tensor in itertools.chain(
+        fx_g.named_parameters(), fx_g.named_buffers()
+    ):
+        _hash_tensor(h, name, tensor)
+    versions = [
+        device,
+        torch.__version__,
+        getattr(torch_mlir, "__version__", ""),
+    ]
+    try:
+        from importlib import metadata
+
+        versions.append(metadata.version("iree-compiler"))
+    except Exception:
+        pass
+    h.update(repr(versions).encode())
+    return h.hexdigest()
+
+
+def input_guards(inputs) -> tuple:
+    return tuple((tuple(x.shape), str(x.dtype)) for x in inputs)
+
+
+def to_numpy(tensor: torch.Tensor) -> np.ndarray:
+    # Contiguous CPU tensors are shared with numpy without a copy.
+    tensor = tensor.detach()
+    if tensor.device.type != "cpu" or not tensor.is_contiguous():
+        tensor = tensor.contiguous().cpu()
+    return tensor.numpy()
+
+
+def to_torch(value) -> torch.Tensor:
+    # Prefer DLPack so the tensor aliases the runtime's host-visible buffer;
+    # otherwise go through the numpy view of the mapped buffer.
+    if hasattr(value, "__dlpack__"):
+        try:
+            return torch.from_dlpack(value)
+        except (BufferError, RuntimeError, TypeError):
+            pass
+    return torch.from_numpy(np.asarray(value))
+
+
 class SharkBackend:
+    """
+    Compiles the graphs dynamo hands to the "shark" backend. Compiled
+    modules are cached on disk (options["cache_dir"], SHARK_DYNAMO_CACHE_DIR
+    or ~/.cache/shark/dynamo) keyed on the graph hash and the input shapes
+    and dtypes, so the same graph is only compiled once across processes.
+    Calls with new input shapes get their own module instead of failing.
+    """
+
     def __init__(
         self, fx_g: torch.fx.GraphModule, inputs: tuple, options: dict
     ):
@@ -101,53 +193,107 @@ class SharkBackend:
         self.inputs = inputs
         self.shark_module = None
         self.device: str = options.get("device", "cpu")
+        self.use_cache: bool = options.get("cache", True)
+        self.cache_dir: str = get_cache_dir(options)
         self.was_unwrapped: bool = False
         self.none_indices: list = []
+        self.modules: dict = {}
         self._modify_fx_g()
-        self.compile()
+        self.graph_key = (
+            graph_hash(self.fx_g, self.device) if self.use_cache else None
+        )
+        self.guards = input_guards(inputs)
+        self.shark_module, self.forward = self.get_module(inputs)
 
     def _modify_fx_g(self):
         self.none_indices = _remove_nones(self.fx_g)
         self.was_unwrapped = _unwrap_single_tuple_return(self.fx_g)
 
-    def compile(self):
+    def get_module(self, inputs):
+        guards = input_guards(inputs)
+        if guards not in self.modules:
+            shark_module = self.load_or_compile(inputs, guards)
+            forward = shark_module.shark_runner.iree_compilation_module[
+                "forward"
+            ]
+            self.modules[guards] = (shark_module, forward)
+        return self.modules[guards]
+
+    def load_or_compile(self, inputs, guards):
+        if not self.use_cache:
+            return self.compile(inputs)
+        key = hashlib.sha256(
+            f"{self.graph_key}{guards}".encode()
+        ).hexdigest()[:32]
+        vmfb_path = os.path.join(self.cache_dir, f"{key}.vmfb")
+        if not os.path.isfile(vmfb_path):
+            from shark.iree_utils.compile_utils import (
+                export_iree_module_to_vmfb,
+            )
+
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Compile under a per-process name and rename, so concurrent
+            # processes never load a partially written module.
+            tmp_path = export_iree_module_to_vmfb(
+                self.lower(inputs),
+                self.device,
+                self.cache_dir,
+                "tm_tensor",
+                module_name=f"{key}.{os.getpid()}",
+                compile_str=True,
+            )
+            os.replace(tmp_path, vmfb_path)
+        else:
+            print(f"Loading cached dynamo graph from {vmfb_path}.")
+        shark_module = SharkInference(
+            mlir_module=None, device=self.device, mlir_dialect="tm_tensor"
+        )
+        shark_module.load_module(vmfb_path)
+        return shark_module
+
+    def lower(self, inputs):
         gm = make_fx(
             functionalize(self.fx_g),
             decomposition_table=default_decompositions(),
-        )(*self.inputs)
+        )(*inputs)
         gm.graph.set_codegen(torch.fx.graph.CodeGen())
         gm.recompile()
         strip_overloads(gm)
         ts_g = torch.jit.script(gm)
         mlir_module = torch_mlir.compile(
-            ts_g, self.inputs, output_type="linalg-on-tensors"
+            ts_g, inputs, output_type="linalg-on-tensors"
         )
         bytecode_stream = io.BytesIO()
         mlir_module.operation.write_bytecode(bytecode_stream)
-        bytecode = bytecode_stream.getvalue()
+        return bytecode_stream.getvalue()
+
+    def compile(self, inputs=None):
+        inputs = self.inputs if inputs is None else inputs
         from shark.shark_inference import SharkInference
 
         shark_module = SharkInference(
-            mlir_module=bytecode,
+            mlir_module=self.lower(inputs),
             device=self.device,
             mlir_dialect="tm_tensor",
         )
         shark_module.compile(extra_args=[])
-        self.shark_module = shark_module
+        return shark_module
 
     def __call__(self, *inputs):
-        np_inputs = [x.contiguous().detach().cpu().numpy() for x in inputs]
-        np_outs = self.shark_module("forward", np_inputs)
+        forward = self.forward
+        if input_guards(inputs) != self.guards:
+            _, forward = self.get_module(inputs)
+        # Calls the compiled function directly; it takes numpy views of the
+        # inputs and returns device arrays that are read back without copies
+        # where the runtime allows.
+        outs = forward(*[to_numpy(x) for x in inputs])
         if self.was_unwrapped:
-            np_outs = [
-                np_outs,
-            ]
+            outs = (outs,)
 
-        if not isinstance(np_outs, list):
-            res = torch.from_numpy(np_outs)
-            return res
+        if not isinstance(outs, (tuple, list)):
+            return to_torch(outs)
 
-        result = [torch.from_numpy(x) for x in np_outs]
+        result = [to_torch(x) for x in outs]
         for r_in in self.none_indices:
             result.insert(r_in, None)
         result = tuple(result)
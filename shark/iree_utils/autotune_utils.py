@@ -0,0 +1,484 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compile flag autotuning. A flag space is a list of knobs, each with the
+# alternative flag sets to try, where the first one is the default. The
+# tuner walks the knobs one at a time, compiling every alternative of a
+# knob in parallel and benchmarking them interleaved with
+# iree-benchmark-module. An alternative only replaces the current best when
+# it is faster by a minimum margin and a Mann-Whitney U test says the
+# difference isn't noise. The winning flags are stored per (model hash,
+# target, device) and compile_module_to_flatbuffer applies them by default.
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import hashlib
+import json
+import math
+import os
+import platform
+import shutil
+import tempfile
+
+from shark.parser import shark_args
+from shark.iree_utils._common import iree_device_map, iree_target_map
+from shark.iree_utils.dispatch_benchmark_utils import (
+    UNIT_TO_MS,
+    get_benchmark_module_path,
+    run_pinned,
+)
+
+# Flag space for llvm-cpu. Each knob overrides the flag of the same name
+# that compile_module_to_flatbuffer would otherwise pass.
+LLVM_CPU_FLAG_SPACE = [
+    (
+        "ukernels",
+        [
+            [],
+            ["--iree-llvmcpu-enable-ukernels=all"],
+            ["--iree-llvmcpu-enable-ukernels=none"],
+        ],
+    ),
+    (
+        "data_tiling",
+        [
+            [],
+            ["--iree-opt-data-tiling=true"],
+            ["--iree-opt-data-tiling=false"],
+        ],
+    ),
+    (
+        "const_eval",
+        [
+            [],
+            ["--iree-opt-const-eval=true"],
+            ["--iree-opt-const-eval=false"],
+        ],
+    ),
+    ("const_expr_hoisting", [[], ["--iree-opt-const-expr-hoisting=false"]]),
+    ("aggressive_fusion", [[], ["--iree-flow-enable-aggressive-fusion"]]),
+    (
+        "fp_reassociation",
+        [[], ["--iree-llvmcpu-reassociate-fp-reductions=true"]],
+    ),
+]
+
+FLAG_SPACES = {"llvm-cpu": LLVM_CPU_FLAG_SPACE}
+
+
+def get_autotune_cache_path():
+    return shark_args.autotune_cache or os.path.join(
+        os.path.expanduser("~"), ".cache", "shark", "autotune.json"
+    )
+
+
+def get_flag_name(flag):
+    return flag.split("=", 1)[0]
+
+
+def override_flags(args, overrides):
+    """Drops the flags of `args` that `overrides` sets again, since
+    iree-compile rejects most flags given twice, and appends `overrides`."""
+    if not overrides:
+        return list(args)
+    names = {get_flag_name(flag) for flag in overrides}
+    return [flag for flag in args if get_flag_name(flag) not in names] + list(
+        overrides
+    )
+
+
+def merge_tuned_flags(args, tuned, explicit):
+    """Applies `tuned` flags over the default `args`, then appends the
+    `explicit` flags of the caller and user, which win over tuned ones."""
+    names = {get_flag_name(flag) for flag in explicit}
+    tuned = [flag for flag in tuned or [] if get_flag_name(flag) not in names]
+    return override_flags(args, tuned) + list(explicit)
+
+
+# Hashes of module files by (path, size, mtime), so compiling a large file
+# again doesn't read all of it.
+_file_hashes = {}
+
+
+def get_model_hash(module):
+    """Hash of a module given as a path, str or bytes. None for in-memory
+    module objects."""
+    if isinstance(module, str) and os.path.isfile(module):
+        stat = os.stat(module)
+        key = (os.path.abspath(module), stat.st_size, stat.st_mtime_ns)
+        if key not in _file_hashes:
+            h = hashlib.sha256()
+            with open(module, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            _file_hashes[key] = h.hexdigest()
+        return _file_hashes[key]
+    h = hashlib.sha256()
+    if isinstance(module, str):
+        h.update(module.encode())
+    elif isinstance(module, (bytes, bytearray)):
+        h.update(module)
+    else:
+        return None
+    return h.hexdigest()
+
+
+def get_cpu_model_name():
+    try:
+        with open("/proc/cpuinfo") as f:
+            for line in f:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def get_tuning_key(model_hash, device):
+    """(model hash, target, device). The cpu target is the host, so the cpu
+    model stands for the device."""
+    target = iree_target_map(device)
+    if target == "llvm-cpu":
+        device_name = get_cpu_model_name()
+    else:
+        device_name = iree_device_map(device)
+    return f"{model_hash}|{target}|{device_name}"
+
+
+def load_tuning_cache(path=None):
+    path = path or get_autotune_cache_path()
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_tuning_result(key, result, path=None):
+    path = path or get_autotune_cache_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    cache = load_tuning_cache(path)
+    cache[key] = result
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_tuned_flags(module, device, path=None):
+    """The tuned flags stored for this module and device, or None."""
+    if not shark_args.use_tuned_flags:
+        return None
+    cache = load_tuning_cache(path)
+    # Only hash the module if something was tuned for this device.
+    device_suffix = get_tuning_key("", device)
+    if not any(key.endswith(device_suffix) for key in cache):
+        return None
+    model_hash = get_model_hash(module)
+    if model_hash is None:
+        return None
+    result = cache.get(get_tuning_key(model_hash, device))
+    if result is None:
+        return None
+    print(f"Using tuned compile flags: {' '.join(result['flags'])}")
+    return result["flags"]
+
+
+def parse_benchmark_samples(stdout):
+    """Per repetition times in ms from iree-benchmark-module's json
+    output."""
+    report = json.loads(stdout[stdout.index("{") :])
+    samples = []
+    for bench in report.get("benchmarks", []):
+        if bench.get("run_type", "iteration") != "iteration":
+            continue
+        scale = UNIT_TO_MS.get(bench.get("time_unit", "ns"), 1e-6)
+        samples.append(bench["real_time"] * scale)
+    return samples
+
+
+def median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    if len(values) % 2:
+        return values[mid]
+    return (values[mid - 1] + values[mid]) / 2
+
+
+def mann_whitney_u(a, b):
+    """Two sided p-value of the Mann-Whitney U test, with the normal
+    approximation and a tie correction."""
+    ranked = sorted([(v, 0) for v in a] + [(v, 1) for v in b])
+    ranks = [0.0] * len(ranked)
+    ties = 0.0
+    i = 0
+    while i < len(ranked):
+        j = i
+        while j + 1 < len(ranked) and ranked[j + 1][0] == ranked[i][0]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[k] = (i + j) / 2 + 1
+        ties += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+    n1, n2 = len(a), len(b)
+    n = n1 + n2
+    r1 = sum(rank for rank, (_, group) in zip(ranks, ranked) if group == 0)
+    u = r1 - n1 * (n1 + 1) / 2
+    variance = n1 * n2 / 12 * ((n + 1) - ties / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (abs(u - n1 * n2 / 2) - 0.5) / math.sqrt(variance)
+    return math.erfc(max(z, 0) / math.sqrt(2))
+
+
+def is_improvement(candidate, best, min_improvement=0.02, alpha=0.05):
+    return (
+        median(candidate) < median(best) * (1 - min_improvement)
+        and mann_whitney_u(candidate, best) < alpha
+    )
+
+
+def _write_inputs(inputs, directory):
+    """iree-benchmark-module --input values. Arrays are saved as .npy,
+    strings like "1x3x224x224xf32" are passed through."""
+    import numpy as np
+
+    input_args = []
+    for i, value in enumerate(inputs):
+        if isinstance(value, str):
+            input_args.append(value)
+        else:
+            path = os.path.join(directory, f"input{i}.npy")
+            np.save(path, value)
+            input_args.append(f"@{path}")
+    return input_args
+
+
+class FlagAutotuner:
+    """
+    Tunes the compile flags of `module` for `device`.
+
+    ...
+
+    Attributes
+    ----------
+    space : list
+        (knob name, [flag sets]) pairs. Defaults to the space of the
+        device's target backend.
+    repetitions : int
+        Benchmark repetitions per candidate, split over `rounds`
+        interleaved rounds so drift in the machine's state hits every
+        candidate alike.
+    """
+
+    def __init__(
+        self,
+        module,
+        device="cpu",
+        frontend="linalg",
+        function_name="forward",
+        inputs=[],
+        space=None,
+        repetitions=20,
+        rounds=4,
+        min_improvement=0.02,
+        alpha=0.05,
+        workers=None,
+        cache_path=None,
+    ):
+        self.module = module
+        self.device = device
+        self.frontend = frontend
+        self.function_name = function_name
+        self.inputs = inputs
+        target = iree_target_map(device)
+        if space is None and target not in FLAG_SPACES:
+            raise ValueError(f"No flag space for target {target}")
+        self.space = FLAG_SPACES[target] if space is None else space
+        self.repetitions = repetitions
+        self.rounds = max(min(rounds, repetitions), 1)
+        self.min_improvement = min_improvement
+        self.alpha = alpha
+        self.workers = workers
+        self.cache_path = cache_path
+        self.compile_str = not (
+            isinstance(module, str) and os.path.isfile(module)
+        )
+        self.work_dir = tempfile.mkdtemp(prefix="shark_autotune_")
+        self.input_args = _write_inputs(inputs, self.work_dir)
+        self.cpus = None
+        if target == "llvm-cpu":
+            from shark.iree_utils.cpu_utils import get_cpu_topology
+
+            self.cpus = get_cpu_topology().cpus
+        self.history = []
+
+    def compile(self, flags):
+        from shark.iree_utils.compile_utils import (
+            compile_module_to_flatbuffer,
+        )
+
+        name = hashlib.sha256(" ".join(flags).encode()).hexdigest()[:16]
+        vmfb_path = os.path.join(self.work_dir, f"{name}.vmfb")
+        if not os.path.exists(vmfb_path):
+            compile_module_to_flatbuffer(
+                self.module,
+                self.device,
+                self.frontend,
+                None,
+                [],
+                compile_str=self.compile_str,
+                write_to=vmfb_path,
+                override_args=flags,
+            )
+        return vmfb_path
+
+    def benchmark(self, vmfb_path, repetitions):
+        cmd = [
+            get_benchmark_module_path(),
+            f"--module={vmfb_path}",
+            f"--function={self.function_name}",
+            f"--device={iree_device_map(self.device)}",
+            f"--benchmark_repetitions={repetitions}",
+            "--benchmark_format=json",
+        ] + [f"--input={input}" for input in self.input_args]
+        return parse_benchmark_samples(run_pinned(cmd, self.cpus))
+
+    def measure(self, candidates):
+        """Compiles the flag sets in parallel and benchmarks them in
+        interleaved rounds. Returns {index: samples}, without the flag sets
+        that failed to compile or run."""
+        with ThreadPoolExecutor(self.workers or len(candidates)) as pool:
+            futures = [
+                pool.submit(self.compile, flags) for flags in candidates
+            ]
+        vmfbs = {}
+        for i, future in enumerate(futures):
+            try:
+                vmfbs[i] = future.result()
+            except Exception as e:
+                print(f"Compiling {' '.join(candidates[i])} failed: {e}")
+        samples = {i: [] for i in vmfbs}
+        per_round = math.ceil(self.repetitions / self.rounds)
+        for _ in range(self.rounds):
+            for i in list(samples):
+                try:
+                    samples[i] += self.benchmark(vmfbs[i], per_round)
+                except Exception as e:
+                    print(f"Running {' '.join(candidates[i])} failed: {e}")
+                    del samples[i]
+        return samples
+
+    def tune(self):
+        """Coordinate descent over the knobs. Returns the best flags and
+        stores them in the autotune cache."""
+        try:
+            return self._tune()
+        finally:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+
+    def _tune(self):
+        best_choice = [0] * len(self.space)
+
+        def flags_for(choice):
+            return [
+                flag
+                for (_, options), index in zip(self.space, choice)
+                for flag in options[index]
+            ]
+
+        baseline = None
+        best_samples = None
+        for k, (knob, options) in enumerate(self.space):
+            choices = []
+            for index in range(len(options)):
+                choice = list(best_choice)
+                choice[k] = index
+                choices.append(choice)
+            samples = self.measure([flags_for(c) for c in choices])
+            current = best_choice[k]
+            if current not in samples:
+                raise RuntimeError(f"The current flags failed for {knob}")
+            # Remeasured with the others so all of them saw the same state.
+            best_samples = samples[current]
+            if baseline is None:
+                baseline = median(best_samples)
+            for index, candidate in samples.items():
+                if index != current and is_improvement(
+                    candidate,
+                    best_samples,
+                    self.min_improvement,
+                    self.alpha,
+                ):
+                    best_choice, best_samples = choices[index], candidate
+                    current = index
+            self.history.append(
+                {
+                    "knob": knob,
+                    "choice": options[best_choice[k]],
+                    "median_ms": {
+                        " ".join(options[i]) or "default": median(s)
+                        for i, s in samples.items()
+                    },
+                }
+            )
+            print(
+                f"{knob}: {' '.join(options[best_choice[k]]) or 'default'} "
+                f"({median(best_samples):.3f}ms)"
+            )
+
+        flags = flags_for(best_choice)
+        model_hash = get_model_hash(self.module)
+        result = {
+            "flags": flags,
+            "median_ms": median(best_samples),
+            "baseline_median_ms": baseline,
+            "history": self.history,
+        }
+        if model_hash is not None:
+            save_tuning_result(
+                get_tuning_key(model_hash, self.device),
+                result,
+                self.cache_path,
+            )
+        return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Tunes the compile flags of an MLIR module and stores "
+        "them for SharkInference to use."
+    )
+    parser.add_argument("module", type=str, help="Path of the MLIR module.")
+    parser.add_argument("--target_device", type=str, default="cpu")
+    parser.add_argument("--frontend", type=str, default="linalg")
+    parser.add_argument("--function", type=str, default="forward")
+    parser.add_argument(
+        "--input",
+        type=str,
+        action="append",
+        default=[],
+        help="iree-benchmark-module input, e.g. 1x3x224x224xf32.",
+    )
+    parser.add_argument("--repetitions", type=int, default=20)
+    args, _ = parser.parse_known_args()
+    result = FlagAutotuner(
+        args.module,
+        device=args.target_device,
+        frontend=args.frontend,
+        function_name=args.function,
+        inputs=args.input,
+        repetitions=args.repetitions,
+    ).tune()
+    print(json.dumps(result, indent=2))
@@ -13,7 +13,7 @@
 # limitations under the License.
 
 from shark.iree_utils._common import run_cmd, iree_device_map
-from shark.iree_utils.cpu_utils import get_cpu_count
+from shark.iree_utils.cpu_utils import get_iree_cpu_rt_args
 import numpy as np
 import os
 import re
@@ -80,9 +80,7 @@ def build_benchmark_args(
     for mlir_input in mlir_input_types:
         benchmark_cl.append(f"--input={mlir_input}")
     if device == "cpu":
-        num_cpus = get_cpu_count()
-        if num_cpus is not None:
-            benchmark_cl.append(f"--task_topology_max_group_count={num_cpus}")
+        benchmark_cl += get_iree_cpu_rt_args()
     # if time_extractor:
     #    benchmark_cl.append(time_extractor)
     benchmark_cl.append(f"--print_statistics=true")
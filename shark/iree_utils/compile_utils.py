@@ -22,10 +22,17 @@ import iree.runtime as ireert
 import iree.compiler as ireec
 from shark.parser import shark_args
 
-from .trace import DetailLogger
+from .trace import tracer, trace_span
 from ._common import iree_device_map, iree_target_map
-from .cpu_utils import get_iree_cpu_rt_args
+from .cpu_utils import get_iree_cpu_rt_args, pin_cpu_runtime
+from .parameter_utils import create_parameters_module
 from .benchmark_utils import *
+from .autotune_utils import get_tuned_flags, merge_tuned_flags
+from .dispatch_benchmark_utils import (
+    create_dispatch_dirs,
+    dump_isas,
+    compile_benchmark_dirs,
+)
 
 
 # Get the iree-compile arguments given device.
@@ -156,155 +163,6 @@ def get_model_specific_args():
     return ms_args
 
 
-def create_dispatch_dirs(bench_dir, device):
-    protected_files = ["ordered-dispatches.txt"]
-    bench_dir_path = bench_dir.split("/")
-    bench_dir_path[-1] = "temp_" + bench_dir_path[-1]
-    tmp_bench_dir = "/".join(bench_dir_path)
-    for f_ in os.listdir(bench_dir):
-        if os.path.isfile(f"{bench_dir}/{f_}") and f_ not in protected_files:
-            dir_name = re.sub("\.\S*$", "", f_)
-            if os.path.exists(f"{bench_dir}/{dir_name}"):
-                os.system(f"rm -rf {bench_dir}/{dir_name}")
-            os.system(f"mkdir {bench_dir}/{dir_name}")
-            os.system(f"mv {bench_dir}/{f_} {bench_dir}/{dir_name}/{f_}")
-    for f_ in os.listdir(tmp_bench_dir):
-        if os.path.isfile(f"{tmp_bench_dir}/{f_}"):
-            dir_name = ""
-            for d_ in os.listdir(bench_dir):
-                if re.search(f"{d_}(?=\D)", f_):
-                    dir_name = d_
-            if dir_name != "":
-                os.system(
-                    f"mv {tmp_bench_dir}/{f_} {bench_dir}/{dir_name}/{dir_name}_benchmark.mlir"
-                )
-
-
-def dump_isas(bench_dir):
-    for d_ in os.listdir(bench_dir):
-        if os.path.isdir(f"{bench_dir}/{d_}"):
-            for f_ in os.listdir(f"{bench_dir}/{d_}"):
-                if f_.endswith(".spv"):
-                    os.system(
-                        f"amdllpc -gfxip 11.0 {bench_dir}/{d_}/{f_} -v > \
-                         {bench_dir}/{d_}/isa.txt"
-                    )
-
-
-def compile_benchmark_dirs(bench_dir, device, dispatch_benchmarks):
-    benchmark_runtimes = {}
-    dispatch_list = []
-    all_dispatches = False
-
-    if dispatch_benchmarks.lower().strip() == "all":
-        all_dispatches = True
-    else:
-        try:
-            dispatch_list = [
-                int(dispatch_index)
-                for dispatch_index in dispatch_benchmarks.split(" ")
-            ]
-        except:
-            print("ERROR: Invalid dispatch benchmarks")
-            return None
-    for d_ in os.listdir(bench_dir):
-        if os.path.isdir(f"{bench_dir}/{d_}"):
-            in_dispatches = False
-            for dispatch in dispatch_list:
-                if str(dispatch) in d_:
-                    in_dispatches = True
-            if all_dispatches or in_dispatches:
-                for f_ in os.listdir(f"{bench_dir}/{d_}"):
-                    if "benchmark.mlir" in f_:
-                        dispatch_file = open(f"{bench_dir}/{d_}/{f_}", "r")
-                        module = dispatch_file.read()
-                        dispatch_file.close()
-
-                        flatbuffer_blob = ireec.compile_str(
-                            module, target_backends=[iree_target_map(device)]
-                        )
-
-                        vmfb_file = open(
-                            f"{bench_dir}/{d_}/{d_}_benchmark.vmfb", "wb"
-                        )
-                        vmfb_file.write(flatbuffer_blob)
-                        vmfb_file.close()
-
-                        config = get_iree_runtime_config(device)
-                        vm_module = ireert.VmModule.from_buffer(
-                            config.vm_instance,
-                            flatbuffer_blob,
-                            warn_if_copy=False,
-                        )
-
-                        benchmark_cl = build_benchmark_args_non_tensor_input(
-                            input_file=f"{bench_dir}/{d_}/{d_}_benchmark.vmfb",
-                            device=device,
-                            inputs=(0,),
-                            mlir_dialect="linalg",
-                            function_name="",
-                        )
-
-                        benchmark_bash = open(
-                            f"{bench_dir}/{d_}/{d_}_benchmark.sh", "w+"
-                        )
-                        benchmark_bash.write("#!/bin/bash\n")
-                        benchmark_bash.write(" ".join(benchmark_cl))
-                        benchmark_bash.close()
-
-                        iter_per_second, _, _ = run_benchmark_module(
-                            benchmark_cl
-                        )
-
-                        benchmark_file = open(
-                            f"{bench_dir}/{d_}/{d_}_data.txt", "w+"
-                        )
-                        benchmark_file.write(f"DISPATCH: {d_}\n")
-                        benchmark_file.write(str(iter_per_second) + "\n")
-                        benchmark_file.write(
-                            "SHARK BENCHMARK RESULT: "
-                            + str(1 / (iter_per_second * 0.001))
-                            + "\n"
-                        )
-                        benchmark_file.close()
-
-                        benchmark_runtimes[d_] = 1 / (iter_per_second * 0.001)
-
-                    elif ".mlir" in f_ and "benchmark" not in f_:
-                        dispatch_file = open(f"{bench_dir}/{d_}/{f_}", "r")
-                        module = dispatch_file.read()
-                        dispatch_file.close()
-
-                        module = re.sub(
-                            "hal.executable private",
-                            "hal.executable public",
-                            module,
-                        )
-
-                        flatbuffer_blob = ireec.compile_str(
-                            module,
-                            target_backends=[iree_target_map(device)],
-                            extra_args=["--compile-mode=hal-executable"],
-                        )
-
-                        spirv_file = open(
-                            f"{bench_dir}/{d_}/{d_}_spirv.vmfb", "wb"
-                        )
-                        spirv_file.write(flatbuffer_blob)
-                        spirv_file.close()
-
-    ordered_dispatches = [
-        (k, v)
-        for k, v in sorted(
-            benchmark_runtimes.items(), key=lambda item: item[1]
-        )
-    ][::-1]
-    f_ = open(f"{bench_dir}/ordered-dispatches.txt", "w+")
-    for dispatch in ordered_dispatches:
-        f_.write(f"{dispatch[0]}: {dispatch[1]}ms\n")
-    f_.close()
-
-
 def compile_module_to_flatbuffer(
     module,
     device,
@@ -315,6 +173,7 @@ def compile_module_to_flatbuffer(
     debug=False,
     compile_str=False,
     write_to=None,
+    override_args=None,
 ):
     # Setup Compile arguments wrt to frontends.
     input_type = "auto"
@@ -322,8 +181,15 @@ def compile_module_to_flatbuffer(
     args += get_iree_device_args(device, extra_args)
     args += get_iree_common_args(debug=debug)
     args += get_model_specific_args()
-    args += extra_args
-    args += shark_args.additional_compile_args
+    # Flags found by the autotuner for this module replace the defaults, but
+    # not flags the caller or user passed explicitly.
+    if override_args is None:
+        override_args = get_tuned_flags(module, device)
+    args = merge_tuned_flags(
+        args,
+        override_args,
+        list(extra_args) + list(shark_args.additional_compile_args),
+    )
 
     if frontend in ["tensorflow", "tf"]:
         input_type = "auto"
@@ -336,21 +202,22 @@ def compile_module_to_flatbuffer(
     elif frontend in ["torch", "pytorch"]:
         input_type = "torch"
 
-    if compile_str:
-        flatbuffer_blob = ireec.compile_str(
-            module,
-            target_backends=[iree_target_map(device)],
-            extra_args=args,
-            input_type=input_type,
-        )
-    else:
-        assert os.path.isfile(module)
-        flatbuffer_blob = ireec.compile_file(
-            str(module),
-            input_type=input_type,
-            target_backends=[iree_target_map(device)],
-            extra_args=args,
-        )
+    with trace_span("compile", device=device, frontend=frontend):
+        if compile_str:
+            flatbuffer_blob = ireec.compile_str(
+                module,
+                target_backends=[iree_target_map(device)],
+                extra_args=args,
+                input_type=input_type,
+            )
+        else:
+            assert os.path.isfile(module)
+            flatbuffer_blob = ireec.compile_file(
+                str(module),
+                input_type=input_type,
+                target_backends=[iree_target_map(device)],
+                extra_args=args,
+            )
 
     if write_to is not None:
         with open(write_to, "wb") as f:
@@ -367,9 +234,6 @@ def get_iree_module(
     rt_flags: list = [],
     external_weight_file=None,
 ):
-    if external_weight_file is not None:
-        index = ireert.ParameterIndex()
-        index.load(external_weight_file)
     # Returns the compiled module and the configs.
     for flag in rt_flags:
         ireert.flags.parse_flag(flag)
@@ -388,15 +252,20 @@ def get_iree_module(
         config.id = hal_device_id
     else:
         config = get_iree_runtime_config(device)
-    vm_module = ireert.VmModule.from_buffer(
-        config.vm_instance, flatbuffer_blob, warn_if_copy=False
-    )
-    modules = []
-    if external_weight_file is not None:
-        modules.append(index.create_provider(scope="model"))
-    ctx = ireert.SystemContext(vm_modules=modules, config=config)
-    ctx.add_vm_module(vm_module)
-    ModuleCompiled = getattr(ctx.modules, vm_module.name)
+    with trace_span("load_vmfb", device=device):
+        vm_module = ireert.VmModule.from_buffer(
+            config.vm_instance, flatbuffer_blob, warn_if_copy=False
+        )
+        modules = []
+        if external_weight_file is not None:
+            modules.append(
+                create_parameters_module(
+                    config.vm_instance, external_weight_file
+                )
+            )
+        ctx = ireert.SystemContext(vm_modules=modules, config=config)
+        ctx.add_vm_module(vm_module)
+        ModuleCompiled = getattr(ctx.modules, vm_module.name)
     return ModuleCompiled, config
 
 
@@ -409,6 +278,7 @@ def load_vmfb_using_mmap(
 ):
     print(f"Loading module {flatbuffer_blob_or_path}...")
     if "task" in device:
+        pin_cpu_runtime()
         print(
             f"[DEBUG] setting iree runtime flags for cpu:\n{' '.join(get_iree_cpu_rt_args())}"
         )
@@ -420,13 +290,13 @@ def load_vmfb_using_mmap(
 
     if "rocm" in device:
         device = "rocm"
-    with DetailLogger(timeout=2.5) as dl:
+    with trace_span("load_vmfb", device=device):
         # First get configs.
         if device_idx is not None:
-            dl.log(f"Mapping device id: {device_idx}")
+            tracer.instant(f"Mapping device id: {device_idx}")
             device = iree_device_map(device)
             haldriver = ireert.get_driver(device)
-            dl.log(f"ireert.get_driver()")
+            tracer.instant(f"ireert.get_driver()")
 
             hal_device_id = haldriver.query_available_devices()[device_idx][
                 "device_id"
@@ -435,13 +305,13 @@ def load_vmfb_using_mmap(
                 hal_device_id,
                 allocators=shark_args.device_allocator,
             )
-            dl.log(f"ireert.create_device()")
+            tracer.instant(f"ireert.create_device()")
             config = ireert.Config(device=haldevice)
             config.id = hal_device_id
-            dl.log(f"ireert.Config()")
+            tracer.instant(f"ireert.Config()")
         else:
             config = get_iree_runtime_config(device)
-            dl.log("get_iree_runtime_config")
+            tracer.instant("get_iree_runtime_config")
         if "task" in device:
             print(
                 f"[DEBUG] setting iree runtime flags for cpu:\n{' '.join(get_iree_cpu_rt_args())}"
@@ -468,27 +338,26 @@ def load_vmfb_using_mmap(
             )
             vm_modules = []
             if external_weight_file is not None:
-                index = ireert.ParameterIndex()
-                index.load(external_weight_file)
-                param_module = ireert.create_io_parameters_module(
-                    config.vm_instance, index.create_provider(scope="model")
+                vm_modules.append(
+                    create_parameters_module(
+                        config.vm_instance, external_weight_file
+                    )
                 )
-                vm_modules.append(param_module)
             vm_modules.append(mmaped_vmfb)
             vm_modules.append(
                 ireert.create_hal_module(config.vm_instance, config.device)
             )
-            dl.log(f"mmap {flatbuffer_blob_or_path}")
+            tracer.instant(f"mmap {flatbuffer_blob_or_path}")
             if "vulkan" in device:
                 # Vulkan pipeline creation consumes significant amount of time.
                 print(
                     "\tCompiling Vulkan shaders. This may take a few minutes."
                 )
             ctx = ireert.SystemContext(config=config, vm_modules=vm_modules)
-            dl.log(f"ireert.SystemContext created")
+            tracer.instant(f"ireert.SystemContext created")
             for flag in shark_args.additional_runtime_args:
                 ireert.flags.parse_flags(flag)
-            dl.log(f"module initialized")
+            tracer.instant(f"module initialized")
             mmaped_vmfb = getattr(ctx.modules, mmaped_vmfb.name)
         else:
             with tempfile.NamedTemporaryFile(delete=False) as tf:
@@ -497,7 +366,7 @@ def load_vmfb_using_mmap(
                 vmfb_file_path = tf.name
             temp_file_to_unlink = vmfb_file_path
             mmaped_vmfb = ireert.VmModule.mmap(instance, vmfb_file_path)
-            dl.log(f"mmap temp {vmfb_file_path}")
+            tracer.instant(f"mmap temp {vmfb_file_path}")
         return mmaped_vmfb, config, temp_file_to_unlink
 
 
@@ -640,11 +509,10 @@ def get_results(
     config,
     frontend="torch",
     send_to_host=True,
-    debug_timeout: float = 5.0,
     device: str = None,
 ):
     """Runs a .vmfb file given inputs and config and returns output."""
-    with DetailLogger(debug_timeout) as dl:
+    with trace_span("get_results", function=function_name):
         device_inputs = []
         if device == "rocm" and hasattr(config, "id"):
             haldriver = ireert.get_driver("rocm")
@@ -652,20 +520,19 @@ def get_results(
                 config.id,
                 allocators=shark_args.device_allocator,
             )
-        for input_array in input:
-            dl.log(f"Load to device: {input_array.shape}")
-            device_inputs.append(
-                ireert.asdevicearray(config.device, input_array)
-            )
-        dl.log(f"Invoke function: {function_name}")
-        result = compiled_vm[function_name](*device_inputs)
-        dl.log(f"Invoke complete")
+        with trace_span("to_device", count=len(input)):
+            for input_array in input:
+                device_inputs.append(
+                    ireert.asdevicearray(config.device, input_array)
+                )
+        with trace_span("invoke", function=function_name):
+            result = compiled_vm[function_name](*device_inputs)
         result_tensors = []
         if isinstance(result, tuple):
             if send_to_host:
-                for val in result:
-                    dl.log(f"Result to host: {val.shape}")
-                    result_tensors.append(np.asarray(val, val.dtype))
+                with trace_span("to_host", count=len(result)):
+                    for val in result:
+                        result_tensors.append(np.asarray(val, val.dtype))
             else:
                 for val in result:
                     result_tensors.append(val)
@@ -678,10 +545,9 @@ def get_results(
             return data
         else:
             if send_to_host and result is not None:
-                dl.log("Result to host")
-                return result.to_host()
+                with trace_span("to_host"):
+                    return result.to_host()
             return result
-        dl.log("Execution complete")
 
 
 @functools.cache
@@ -0,0 +1,317 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# CPU topology for the IREE cpu runtime. The usable cpus are the affinity
+# mask of the process, grouped into physical cores and NUMA nodes from
+# /sys, and capped by the cgroup cpu quota. From that we derive the task
+# topology group count, a NUMA-local cpu set and per-replica cpu sets, and
+# can calibrate the group count of a vmfb with iree-benchmark-module.
+
+import argparse
+import json
+import math
+import os
+import re
+
+SYS_CPU_DIR = "/sys/devices/system/cpu"
+SYS_NODE_DIR = "/sys/devices/system/node"
+CGROUP_DIR = "/sys/fs/cgroup"
+
+
+def parse_cpu_list(cpus):
+    """Parses a cpu list like "0-3,6" into a set of cpu ids."""
+    cpu_set = set()
+    for part in cpus.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpu_set.update(range(int(start), int(end) + 1))
+        else:
+            cpu_set.add(int(part))
+    return cpu_set
+
+
+def format_cpu_list(cpus):
+    """Formats a set of cpu ids as a cpu list like "0-3,6"."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(
+        str(start) if start == end else f"{start}-{end}"
+        for start, end in ranges
+    )
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def get_affinity_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return set(os.sched_getaffinity(0))
+    return set(range(os.cpu_count() or 1))
+
+
+def get_cgroup_cpu_limit(cgroup_dir=CGROUP_DIR):
+    """Number of cpus the cgroup quota allows, rounded up, or None when
+    there is no quota."""
+    # cgroup v2: "<quota> <period>" or "max <period>".
+    cpu_max = _read(os.path.join(cgroup_dir, "cpu.max"))
+    if cpu_max is not None:
+        quota, _, period = cpu_max.partition(" ")
+        if quota == "max" or not period:
+            return None
+        return max(math.ceil(int(quota) / int(period)), 1)
+    # cgroup v1.
+    quota = _read(os.path.join(cgroup_dir, "cpu", "cpu.cfs_quota_us"))
+    period = _read(os.path.join(cgroup_dir, "cpu", "cpu.cfs_period_us"))
+    if quota is None or period is None or int(quota) <= 0:
+        return None
+    return max(math.ceil(int(quota) / int(period)), 1)
+
+
+class CpuTopology:
+    """
+    The cpus available to this process, as physical cores and NUMA nodes.
+
+    Attributes
+    ----------
+    cpus : set
+        Logical cpus in the affinity mask of the process.
+    cores : dict
+        (package, core) -> sorted list of the SMT siblings in `cpus`.
+    nodes : dict
+        NUMA node -> set of its cpus in `cpus`. A single node 0 when /sys
+        doesn't describe any.
+    cpu_limit : int
+        The cgroup cpu quota in cpus, or None.
+    """
+
+    def __init__(
+        self,
+        cpus=None,
+        sys_cpu_dir=SYS_CPU_DIR,
+        sys_node_dir=SYS_NODE_DIR,
+        cgroup_dir=CGROUP_DIR,
+    ):
+        self.cpus = set(get_affinity_cpus() if cpus is None else cpus)
+        self.cpu_limit = get_cgroup_cpu_limit(cgroup_dir)
+        self.cores = {}
+        for cpu in sorted(self.cpus):
+            topology = os.path.join(sys_cpu_dir, f"cpu{cpu}", "topology")
+            package = _read(os.path.join(topology, "physical_package_id"))
+            core = _read(os.path.join(topology, "core_id"))
+            # Without topology info every cpu counts as its own core.
+            key = (
+                (int(package), int(core))
+                if package is not None and core is not None
+                else (0, -1 - cpu)
+            )
+            self.cores.setdefault(key, []).append(cpu)
+        self.nodes = {}
+        if os.path.isdir(sys_node_dir):
+            for name in os.listdir(sys_node_dir):
+                match = re.fullmatch(r"node(\d+)", name)
+                path = os.path.join(sys_node_dir, name, "cpulist")
+                cpulist = _read(path)
+                if match is None or not cpulist:
+                    continue
+                node_cpus = parse_cpu_list(cpulist) & self.cpus
+                if node_cpus:
+                    self.nodes[int(match.group(1))] = node_cpus
+        if not self.nodes:
+            self.nodes = {0: set(self.cpus)}
+
+    def get_node(self, cpu):
+        for node, node_cpus in self.nodes.items():
+            if cpu in node_cpus:
+                return node
+        return 0
+
+    def get_cores(self, cpus=None):
+        """Physical cores with at least one cpu in `cpus`, each as the list
+        of its siblings within `cpus`, ordered by node and core."""
+        cpus = self.cpus if cpus is None else set(cpus)
+        cores = []
+        for key in sorted(self.cores):
+            siblings = [cpu for cpu in self.cores[key] if cpu in cpus]
+            if siblings:
+                cores.append(siblings)
+        cores.sort(key=lambda siblings: self.get_node(siblings[0]))
+        return cores
+
+    def get_group_count(self, cpus=None):
+        """One worker group per physical core, capped by the cgroup quota.
+        SMT siblings share a core's execution units, so they don't add a
+        group."""
+        count = len(self.get_cores(cpus))
+        if self.cpu_limit is not None:
+            count = min(count, self.cpu_limit)
+        return max(count, 1)
+
+    def get_local_node(self):
+        """The NUMA node with the most physical cores available."""
+        return max(
+            self.nodes,
+            key=lambda node: (
+                len(self.get_cores(self.nodes[node])),
+                -node,
+            ),
+        )
+
+    def get_replica_cpus(self, index, count):
+        """
+        Splits the physical cores into `count` contiguous slices and returns
+        the cpus of slice `index`. Cores are ordered by NUMA node, so
+        replicas stay within a node wherever the split allows it.
+        """
+        if not 0 <= index < count:
+            raise ValueError(f"Invalid replica {index} of {count}")
+        cores = self.get_cores()
+        if count > len(cores):
+            raise ValueError(
+                f"Can't split {len(cores)} cores between {count} replicas"
+            )
+        start = index * len(cores) // count
+        end = (index + 1) * len(cores) // count
+        return {cpu for siblings in cores[start:end] for cpu in siblings}
+
+    def to_dict(self):
+        return {
+            "cpus": format_cpu_list(self.cpus),
+            "physical_cores": len(self.cores),
+            "cpu_limit": self.cpu_limit,
+            "nodes": {
+                node: format_cpu_list(node_cpus)
+                for node, node_cpus in sorted(self.nodes.items())
+            },
+        }
+
+
+def parse_replica(replica):
+    """Parses "INDEX/COUNT" into (index, count)."""
+    index, _, count = replica.partition("/")
+    return int(index), int(count)
+
+
+def get_runtime_cpus(topology, numa_node=None, replica=None):
+    """
+    The cpus the cpu runtime should run on. `numa_node` is a node id, or
+    "auto" for the node with the most cores. `replica` is "INDEX/COUNT".
+    Returns None when the whole affinity mask should be used.
+    """
+    cpus = None
+    if replica is not None:
+        cpus = topology.get_replica_cpus(*parse_replica(replica))
+    if numa_node is not None:
+        node = (
+            topology.get_local_node()
+            if str(numa_node) == "auto"
+            else int(numa_node)
+        )
+        if node not in topology.nodes:
+            raise ValueError(f"NUMA node {node} has no available cpus")
+        node_cpus = topology.nodes[node]
+        cpus = node_cpus if cpus is None else cpus & node_cpus
+    return cpus
+
+
+def calibrate_group_count(
+    vmfb_path,
+    function_name="forward",
+    inputs=[],
+    candidates=None,
+    repetitions=5,
+    cpus=None,
+):
+    """
+    Runs `function_name` of a cpu vmfb with iree-benchmark-module for each
+    candidate --task_topology_max_group_count and returns
+    (best group count, {group count: median ms}).
+    """
+    from shark.iree_utils.dispatch_benchmark_utils import (
+        get_benchmark_module_path,
+        parse_benchmark_json,
+        run_pinned,
+    )
+
+    topology = CpuTopology(cpus)
+    if candidates is None:
+        max_count = len(topology.get_cores())
+        candidates = {
+            max_count,
+            topology.get_group_count(),
+            len(topology.cpus),
+        }
+        count = 1
+        while count < max_count:
+            candidates.add(count)
+            count *= 2
+    timings = {}
+    for group_count in sorted(candidates):
+        cmd = [
+            get_benchmark_module_path(),
+            f"--module={vmfb_path}",
+            f"--function={function_name}",
+            "--device=local-task",
+            f"--task_topology_max_group_count={group_count}",
+            f"--benchmark_repetitions={repetitions}",
+            "--benchmark_report_aggregates_only=true",
+            "--benchmark_format=json",
+        ] + [f"--input={input}" for input in inputs]
+        times = parse_benchmark_json(run_pinned(cmd, topology.cpus))
+        timings[group_count] = times.get("median", times.get("mean"))
+        print(f"group count {group_count}: {timings[group_count]:.3f}ms")
+    best = min(timings, key=timings.get)
+    return best, timings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Shows the cpu topology used by the IREE cpu runtime, "
+        "or calibrates the task topology group count for a vmfb."
+    )
+    parser.add_argument("--calibrate", type=str, help="Path of a cpu vmfb.")
+    parser.add_argument("--function", type=str, default="forward")
+    parser.add_argument(
+        "--input",
+        type=str,
+        action="append",
+        default=[],
+        help="iree-benchmark-module input, e.g. 1x3x224x224xf32.",
+    )
+    parser.add_argument("--repetitions", type=int, default=5)
+    parser.add_argument("--cpus", type=str, default=None)
+    args = parser.parse_args()
+    cpus = parse_cpu_list(args.cpus) if args.cpus else None
+    if args.calibrate is None:
+        print(json.dumps(CpuTopology(cpus).to_dict(), indent=2))
+    else:
+        best, _ = calibrate_group_count(
+            args.calibrate,
+            args.function,
+            args.input,
+            repetitions=args.repetitions,
+            cpus=cpus,
+        )
+        print(f"--task_topology_max_group_count={best}")
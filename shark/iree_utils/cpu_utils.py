@@ -15,19 +15,31 @@
 # All the iree_cpu related functionalities go here.
 
 import functools
+import os
 import subprocess
 import platform
 from shark.parser import shark_args
+from shark.iree_utils.cpu_topology import (
+    CpuTopology,
+    format_cpu_list,
+    get_runtime_cpus,
+)
 
 
-def get_cpu_count():
-    import multiprocessing
+@functools.cache
+def get_cpu_topology():
+    return CpuTopology()
+
 
+def get_cpu_count():
+    # The cpus this process may run on, within its cgroup quota.
     try:
-        cpu_count = multiprocessing.cpu_count()
-        return cpu_count
-    except NotImplementedError:
-        return None
+        topology = get_cpu_topology()
+    except (OSError, ValueError):
+        return os.cpu_count()
+    if topology.cpu_limit is not None:
+        return min(len(topology.cpus), topology.cpu_limit)
+    return len(topology.cpus)
 
 
 # Get the default cpu args.
@@ -52,11 +64,41 @@ def get_iree_cpu_args():
     ]
 
 
+# The cpus picked by --cpu_numa_node and --cpu_replica, or None for all of
+# them. Cached so that pinning the process doesn't change the selection.
+@functools.cache
+def get_runtime_cpuset():
+    return get_runtime_cpus(
+        get_cpu_topology(), shark_args.cpu_numa_node, shark_args.cpu_replica
+    )
+
+
+def pin_cpu_runtime():
+    """
+    Restricts the process to the cpus of get_runtime_cpuset(). The runtime's
+    worker threads inherit the affinity of the process, so this has to run
+    before the cpu runtime is created. Returns the cpus, or None.
+    """
+    cpus = get_runtime_cpuset()
+    if cpus is None or not hasattr(os, "sched_setaffinity"):
+        return cpus
+    if set(os.sched_getaffinity(0)) != cpus:
+        os.sched_setaffinity(0, cpus)
+        # The cached topology still describes the old affinity mask.
+        get_cpu_topology.cache_clear()
+        print(f"Running the cpu runtime on cpus {format_cpu_list(cpus)}")
+    return cpus
+
+
 # Get iree runtime flags for cpu
 @functools.cache
 def get_iree_cpu_rt_args():
-    default = get_cpu_count()
-    default = default if default <= 8 else default - 2
+    topology = get_cpu_topology()
+    cpus = get_runtime_cpuset()
+    default = topology.get_group_count(cpus)
+    if len(topology.get_cores(cpus)) == len(cpus or topology.cpus):
+        # Without SMT siblings to spare, leave some cores to the host.
+        default = default if default <= 8 else default - 2
     cpu_count = (
         default
         if shark_args.task_topology_max_group_count is None
@@ -0,0 +1,322 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Per-dispatch benchmarking for --dispatch_benchmarks. The executables dumped
+# by iree-compile are sorted into one directory per dispatch, their benchmark
+# modules are compiled by a bounded pool of workers, and each one is run with
+# a pinned CPU affinity and a fixed number of repetitions. Timings, ISA dumps
+# and the benchmark command for every dispatch end up in a single
+# dispatch_benchmarks.json, ranked by their share of the total time.
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import platform
+import re
+import shutil
+import subprocess
+import time
+
+from shark.parser import shark_args
+from shark.iree_utils._common import iree_device_map, iree_target_map
+from shark.iree_utils.cpu_topology import parse_cpu_list
+from shark.iree_utils.cpu_utils import get_cpu_count
+
+PROTECTED_FILES = ["ordered-dispatches.txt", "dispatch_benchmarks.json"]
+RESULTS_FILE = "dispatch_benchmarks.json"
+UNIT_TO_MS = {"ns": 1e-6, "us": 1e-3, "ms": 1.0, "s": 1e3}
+
+
+def get_temp_bench_dir(bench_dir):
+    head, tail = os.path.split(os.path.normpath(bench_dir))
+    return os.path.join(head, "temp_" + tail)
+
+
+def create_dispatch_dirs(bench_dir, device):
+    """Moves each dumped executable into a directory named after it, along
+    with its benchmark module from the temporary benchmarks directory."""
+    for f_ in os.listdir(bench_dir):
+        path = os.path.join(bench_dir, f_)
+        if os.path.isfile(path) and f_ not in PROTECTED_FILES:
+            dir_name = os.path.join(bench_dir, re.sub(r"\.\S*$", "", f_))
+            if os.path.exists(dir_name):
+                shutil.rmtree(dir_name)
+            os.makedirs(dir_name)
+            os.replace(path, os.path.join(dir_name, f_))
+
+    tmp_bench_dir = get_temp_bench_dir(bench_dir)
+    if not os.path.isdir(tmp_bench_dir):
+        return
+    dispatch_dirs = [
+        d_
+        for d_ in os.listdir(bench_dir)
+        if os.path.isdir(os.path.join(bench_dir, d_))
+    ]
+    for f_ in os.listdir(tmp_bench_dir):
+        if not os.path.isfile(os.path.join(tmp_bench_dir, f_)):
+            continue
+        dir_name = ""
+        for d_ in dispatch_dirs:
+            if re.search(f"{re.escape(d_)}(?=\\D)", f_):
+                dir_name = d_
+        if dir_name != "":
+            os.replace(
+                os.path.join(tmp_bench_dir, f_),
+                os.path.join(
+                    bench_dir, dir_name, f"{dir_name}_benchmark.mlir"
+                ),
+            )
+
+
+def parse_dispatch_selection(dispatch_benchmarks):
+    """Returns None for "All", otherwise the set of dispatch indices."""
+    if dispatch_benchmarks.lower().strip() == "all":
+        return None
+    return {int(index) for index in dispatch_benchmarks.split()}
+
+
+def get_dispatch_index(dispatch_name):
+    match = re.search(r"dispatch_(\d+)", dispatch_name)
+    return int(match.group(1)) if match else None
+
+
+def select_dispatch_dirs(bench_dir, dispatch_benchmarks):
+    selection = parse_dispatch_selection(dispatch_benchmarks)
+    selected = []
+    for d_ in sorted(os.listdir(bench_dir)):
+        if not os.path.isdir(os.path.join(bench_dir, d_)):
+            continue
+        if selection is None or get_dispatch_index(d_) in selection:
+            selected.append(d_)
+    return selected
+
+
+def get_benchmark_affinity():
+    if shark_args.dispatch_benchmark_cpus:
+        return parse_cpu_list(shark_args.dispatch_benchmark_cpus)
+    if hasattr(os, "sched_getaffinity"):
+        # Leave cpu 0 to the OS and the compile workers when possible.
+        available = sorted(os.sched_getaffinity(0))
+        return set(available[1:] or available)
+    return None
+
+
+def get_benchmark_module_path():
+    name = "iree-benchmark-module"
+    if platform.system() == "Windows":
+        name += ".exe"
+    if "VIRTUAL_ENV" in os.environ:
+        path = os.path.join(os.environ["VIRTUAL_ENV"], "bin", name)
+        if os.path.exists(path):
+            return path
+    return shutil.which(name) or name
+
+
+def build_dispatch_benchmark_args(vmfb_path, device, repetitions):
+    return [
+        get_benchmark_module_path(),
+        f"--module={vmfb_path}",
+        f"--device={iree_device_map(device)}",
+        f"--benchmark_repetitions={repetitions}",
+        "--benchmark_report_aggregates_only=true",
+        "--benchmark_format=json",
+    ]
+
+
+def parse_benchmark_json(stdout):
+    """Returns {aggregate: time in ms} summed over the benchmark functions
+    in the module, from iree-benchmark-module's json output."""
+    report = json.loads(stdout[stdout.index("{") :])
+    times = {}
+    for bench in report.get("benchmarks", []):
+        aggregate = bench.get("aggregate_name", "mean")
+        scale = UNIT_TO_MS.get(bench.get("time_unit", "ns"), 1e-6)
+        times[aggregate] = (
+            times.get(aggregate, 0.0) + bench["real_time"] * scale
+        )
+    return times
+
+
+def run_pinned(cmd, cpus=None, stdout_path=None):
+    preexec_fn = None
+    if cpus and hasattr(os, "sched_setaffinity"):
+        preexec_fn = lambda: os.sched_setaffinity(0, cpus)
+    if stdout_path is None:
+        return subprocess.run(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            check=True,
+            preexec_fn=preexec_fn,
+        ).stdout
+    with open(stdout_path, "w") as f:
+        subprocess.run(
+            cmd,
+            stdout=f,
+            stderr=subprocess.STDOUT,
+            check=True,
+            preexec_fn=preexec_fn,
+        )
+    return stdout_path
+
+
+def dump_dispatch_isa(dispatch_dir):
+    """Disassembles the executable binaries dumped for a dispatch into
+    isa.txt. Returns the path, or None if no disassembler applies."""
+    for f_ in sorted(os.listdir(dispatch_dir)):
+        path = os.path.join(dispatch_dir, f_)
+        if f_.endswith(".spv"):
+            cmd = ["amdllpc", "-gfxip", "11.0", path, "-v"]
+        elif f_.endswith((".so", ".o", ".dll")):
+            cmd = ["objdump", "-d", "--no-show-raw-insn", path]
+        else:
+            continue
+        if shutil.which(cmd[0]) is None:
+            return None
+        return run_pinned(
+            cmd, stdout_path=os.path.join(dispatch_dir, "isa.txt")
+        )
+    return None
+
+
+def dump_isas(bench_dir):
+    dispatch_dirs = [
+        os.path.join(bench_dir, d_)
+        for d_ in os.listdir(bench_dir)
+        if os.path.isdir(os.path.join(bench_dir, d_))
+    ]
+    with ThreadPoolExecutor(get_num_workers()) as pool:
+        return list(pool.map(dump_dispatch_isa, dispatch_dirs))
+
+
+def get_num_workers():
+    if shark_args.dispatch_benchmark_workers > 0:
+        return shark_args.dispatch_benchmark_workers
+    return max((get_cpu_count() or 2) // 2, 1)
+
+
+def compile_dispatch(bench_dir, dispatch, device):
+    import iree.compiler as ireec
+
+    dispatch_dir = os.path.join(bench_dir, dispatch)
+    result = {"dispatch": dispatch, "index": get_dispatch_index(dispatch)}
+    start = time.time()
+    try:
+        for f_ in os.listdir(dispatch_dir):
+            path = os.path.join(dispatch_dir, f_)
+            if f_.endswith("benchmark.mlir"):
+                flatbuffer_blob = ireec.compile_file(
+                    path, target_backends=[iree_target_map(device)]
+                )
+                vmfb_path = os.path.join(
+                    dispatch_dir, f"{dispatch}_benchmark.vmfb"
+                )
+                with open(vmfb_path, "wb") as f:
+                    f.write(flatbuffer_blob)
+                result["vmfb"] = vmfb_path
+            elif f_.endswith(".mlir") and "benchmark" not in f_:
+                with open(path) as f:
+                    module = f.read()
+                module = re.sub(
+                    "hal.executable private", "hal.executable public", module
+                )
+                flatbuffer_blob = ireec.compile_str(
+                    module,
+                    target_backends=[iree_target_map(device)],
+                    extra_args=["--compile-mode=hal-executable"],
+                )
+                with open(
+                    os.path.join(dispatch_dir, f"{dispatch}_spirv.vmfb"), "wb"
+                ) as f:
+                    f.write(flatbuffer_blob)
+        if shark_args.dump_isa:
+            result["isa"] = dump_dispatch_isa(dispatch_dir)
+    except Exception as e:
+        result["error"] = f"compile failed: {e}"
+    result["compile_s"] = time.time() - start
+    return result
+
+
+def benchmark_dispatch(result, device, repetitions, cpus):
+    if "vmfb" not in result or "error" in result:
+        return result
+    cmd = build_dispatch_benchmark_args(result["vmfb"], device, repetitions)
+    result["command"] = " ".join(cmd)
+    try:
+        times = parse_benchmark_json(run_pinned(cmd, cpus))
+    except Exception as e:
+        result["error"] = f"benchmark failed: {e}"
+        return result
+    result["mean_ms"] = times.get("mean")
+    result["median_ms"] = times.get("median")
+    result["stddev_ms"] = times.get("stddev")
+    return result
+
+
+def rank_dispatches(results):
+    """Sorts dispatches by mean time, slowest first, and adds each one's
+    share of the summed time. Every dispatch counts once per model
+    invocation, since the dumped benchmarks don't carry call counts."""
+    timed = [r for r in results if r.get("mean_ms") is not None]
+    total = sum(r["mean_ms"] for r in timed)
+    for r in timed:
+        r["time_share"] = r["mean_ms"] / total if total else 0.0
+    timed.sort(key=lambda r: r["mean_ms"], reverse=True)
+    failed = [r for r in results if r.get("mean_ms") is None]
+    return timed + failed
+
+
+def compile_benchmark_dirs(bench_dir, device, dispatch_benchmarks):
+    try:
+        dispatches = select_dispatch_dirs(bench_dir, dispatch_benchmarks)
+    except ValueError:
+        print("ERROR: Invalid dispatch benchmarks")
+        return None
+
+    start = time.time()
+    with ThreadPoolExecutor(get_num_workers()) as pool:
+        results = list(
+            pool.map(
+                lambda d_: compile_dispatch(bench_dir, d_, device), dispatches
+            )
+        )
+    compile_time = time.time() - start
+
+    # Benchmarks run one at a time so they don't compete for the device.
+    repetitions = shark_args.dispatch_benchmark_repetitions
+    cpus = get_benchmark_affinity() if "cpu" in device else None
+    for result in results:
+        benchmark_dispatch(result, device, repetitions, cpus)
+    results = rank_dispatches(results)
+
+    report = {
+        "device": device,
+        "repetitions": repetitions,
+        "cpu_affinity": sorted(cpus) if cpus else None,
+        "compile_time_s": compile_time,
+        "benchmark_time_s": time.time() - start - compile_time,
+        "dispatches": results,
+    }
+    with open(os.path.join(bench_dir, RESULTS_FILE), "w") as f:
+        json.dump(report, f, indent=2)
+    with open(os.path.join(bench_dir, "ordered-dispatches.txt"), "w") as f:
+        for result in results:
+            if result.get("mean_ms") is not None:
+                f.write(f"{result['dispatch']}: {result['mean_ms']}ms\n")
+    print(
+        f"Benchmarked {len(results)} dispatches, results in "
+        f"{os.path.join(bench_dir, RESULTS_FILE)}."
+    )
+    return report
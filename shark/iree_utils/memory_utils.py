@@ -0,0 +1,238 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Memory accounting for SharkRunner invocations. With --track_memory or a
+# --device_memory_budget, every run records the peak host RSS delta, the
+# device buffers it allocated, the bytes copied each way and what the HAL
+# allocator reports, and calls that would go over the budget are refused
+# before any input is copied to the device.
+
+from contextlib import contextmanager
+import os
+import re
+
+from shark.parser import shark_args
+
+SIZE_UNITS = {
+    "": 1,
+    "b": 1,
+    "kb": 1000,
+    "mb": 1000**2,
+    "gb": 1000**3,
+    "kib": 1024,
+    "mib": 1024**2,
+    "gib": 1024**3,
+}
+
+
+def parse_size(size):
+    """Parses sizes like "512mib", "4GB" or "1024" into bytes."""
+    if size is None or isinstance(size, int):
+        return size
+    match = re.fullmatch(r"\s*([\d.]+)\s*([a-zA-Z]*)\s*", str(size))
+    if match is None or match.group(2).lower() not in SIZE_UNITS:
+        raise ValueError(f"Invalid memory size: {size}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2).lower()])
+
+
+def get_host_rss_bytes():
+    try:
+        import psutil
+
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """Resets the kernel's high water mark of the process RSS. Returns False
+    where that isn't supported."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def get_peak_rss_bytes():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def get_allocator_statistics(device):
+    """The HAL allocator's statistics, empty if the runtime was built
+    without them."""
+    try:
+        statistics = device.allocator.statistics
+    except AttributeError:
+        return {}
+    return dict(statistics) if isinstance(statistics, dict) else {}
+
+
+def get_live_device_bytes(statistics):
+    if "device_bytes_allocated" not in statistics:
+        return None
+    return statistics["device_bytes_allocated"] - statistics.get(
+        "device_bytes_freed", 0
+    )
+
+
+def get_nbytes(value):
+    nbytes = getattr(value, "nbytes", None)
+    if nbytes is not None:
+        return int(nbytes)
+    shape = getattr(value, "shape", None)
+    dtype = getattr(value, "dtype", None)
+    if shape is None or dtype is None:
+        return 0
+    count = 1
+    for dim in shape:
+        count *= dim
+    return count * getattr(dtype, "itemsize", 0)
+
+
+def flatten_outputs(outputs):
+    if outputs is None:
+        return []
+    if isinstance(outputs, (list, tuple)):
+        return list(outputs)
+    return [outputs]
+
+
+class DeviceMemoryBudgetError(MemoryError):
+    pass
+
+
+class MemoryTracker:
+    """
+    Accumulates memory usage over the invocations of a module.
+
+    The device buffers counted are the inputs copied to the device and the
+    outputs returned by the module. Intermediate buffers only show up in the
+    allocator statistics, when the runtime provides them.
+    """
+
+    def __init__(self, budget_bytes=None, allocators=None):
+        self.budget_bytes = parse_size(budget_bytes)
+        self.allocator_name = "+".join(allocators or []) or "default"
+        self.invocations = 0
+        self.host_to_device_bytes = 0
+        self.device_to_host_bytes = 0
+        self.peak_host_rss_delta_bytes = 0
+        self.allocations = {}
+        self.last_invocation = None
+        # Output size of the previous call of each function, used to
+        # estimate what the next one will need.
+        self._output_bytes = {}
+
+    def check_budget(self, device, function_name, input_bytes):
+        if self.budget_bytes is None:
+            return
+        live = get_live_device_bytes(get_allocator_statistics(device)) or 0
+        needed = input_bytes + self._output_bytes.get(function_name, 0)
+        if live + needed > self.budget_bytes:
+            raise DeviceMemoryBudgetError(
+                f"Running {function_name} needs about {needed} bytes on the "
+                f"device with {live} bytes already in use, which exceeds "
+                f"the device memory budget of {self.budget_bytes} bytes."
+            )
+
+    @contextmanager
+    def invocation(self, device, function_name, inputs, send_to_host):
+        """Wraps one call of the module. The caller sets the outputs on the
+        yielded dict before leaving the block."""
+        input_bytes = sum(get_nbytes(value) for value in inputs)
+        self.check_budget(device, function_name, input_bytes)
+        rss_before = get_host_rss_bytes()
+        peak_reset = reset_peak_rss()
+        statistics_before = get_allocator_statistics(device)
+        record = {"outputs": None}
+        yield record
+
+        outputs = flatten_outputs(record["outputs"])
+        output_bytes = sum(get_nbytes(value) for value in outputs)
+        self._output_bytes[function_name] = output_bytes
+        rss_after = get_host_rss_bytes()
+        peak = get_peak_rss_bytes() if peak_reset else rss_after
+        rss_delta = None
+        if rss_before is not None and peak is not None:
+            rss_delta = max(peak - rss_before, 0)
+            self.peak_host_rss_delta_bytes = max(
+                self.peak_host_rss_delta_bytes, rss_delta
+            )
+
+        statistics = get_allocator_statistics(device)
+        device_bytes_allocated = None
+        if "device_bytes_allocated" in statistics:
+            device_bytes_allocated = statistics[
+                "device_bytes_allocated"
+            ] - statistics_before.get("device_bytes_allocated", 0)
+
+        allocations = self.allocations.setdefault(
+            self.allocator_name, {"count": 0, "bytes": 0}
+        )
+        allocations["count"] += len(inputs) + len(outputs)
+        allocations["bytes"] += input_bytes + output_bytes
+        device_to_host = output_bytes if send_to_host else 0
+        self.host_to_device_bytes += input_bytes
+        self.device_to_host_bytes += device_to_host
+        self.invocations += 1
+        self.last_invocation = {
+            "function": function_name,
+            "host_rss_peak_delta_bytes": rss_delta,
+            "host_to_device_bytes": input_bytes,
+            "device_to_host_bytes": device_to_host,
+            "device_buffers": len(inputs) + len(outputs),
+            "device_buffer_bytes": input_bytes + output_bytes,
+            "allocator_device_bytes_allocated": device_bytes_allocated,
+        }
+
+    def report(self, device=None):
+        statistics = get_allocator_statistics(device) if device else {}
+        # Freed blocks stay with the caching allocator for reuse, so what
+        # the allocator still holds is the size of its pool plus live
+        # buffers.
+        pool_bytes = None
+        if "caching" in self.allocator_name:
+            pool_bytes = get_live_device_bytes(statistics)
+        return {
+            "invocations": self.invocations,
+            "budget_bytes": self.budget_bytes,
+            "host_to_device_bytes": self.host_to_device_bytes,
+            "device_to_host_bytes": self.device_to_host_bytes,
+            "peak_host_rss_delta_bytes": self.peak_host_rss_delta_bytes,
+            "allocations": self.allocations,
+            "allocator_statistics": statistics,
+            "allocator_pool_bytes": pool_bytes,
+            "last_invocation": self.last_invocation,
+        }
+
+
+def create_memory_tracker(budget=None):
+    budget = budget if budget is not None else shark_args.device_memory_budget
+    if not shark_args.track_memory and budget is None:
+        return None
+    return MemoryTracker(budget, shark_args.device_allocator)
@@ -0,0 +1,101 @@
+# Copyright 2024 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+## Process-wide cache of external parameter archives (.safetensors/.irpa/.gguf).
+# Each weight file is memory-mapped once and its index/provider is shared by
+# every module and device context that references it, so two pipelines using
+# the same UNet or text encoder don't hold two copies of the weights.
+import os
+import threading
+
+import iree.runtime as ireert
+
+
+class ParameterArchive:
+    def __init__(self, path):
+        self.path = path
+        self.index = ireert.ParameterIndex()
+        self.index.load(path, mmap=True)
+        self.provider = self.index.create_provider(scope="model")
+        self.file_bytes = os.path.getsize(path)
+        self.num_modules = 0
+
+    def create_module(self, instance):
+        self.num_modules += 1
+        return ireert.create_io_parameters_module(instance, self.provider)
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def get_parameter_archive(path):
+    path = os.path.realpath(str(path))
+    with _archives_lock:
+        if path not in _archives:
+            print(f"Mapping parameter archive {path}")
+            _archives[path] = ParameterArchive(path)
+        return _archives[path]
+
+
+def create_parameters_module(instance, path):
+    """Returns an io_parameters VM module backed by the shared archive."""
+    return get_parameter_archive(path).create_module(instance)
+
+
+def release_parameter_archives():
+    # Modules created from an archive keep its provider alive, so this only
+    # drops the cache's references.
+    with _archives_lock:
+        _archives.clear()
+
+
+def _get_mapping_stats(path):
+    # Sums the Size/Rss of every mapping of `path` in this process. Only
+    # available on Linux; elsewhere nothing is reported.
+    mapped, resident = 0, 0
+    try:
+        with open("/proc/self/smaps", "r") as smaps:
+            in_mapping = False
+            for line in smaps:
+                fields = line.split()
+                if not fields:
+                    continue
+                if not fields[0].endswith(":"):
+                    # Mapping header: address perms offset dev inode [path]
+                    in_mapping = len(fields) >= 6 and fields[5] == path
+                elif in_mapping and fields[0] == "Size:":
+                    mapped += int(fields[1]) * 1024
+                elif in_mapping and fields[0] == "Rss:":
+                    resident += int(fields[1]) * 1024
+    except OSError:
+        return None, None
+    return mapped, resident
+
+
+def get_parameter_memory_stats():
+    """Returns {path: {file_bytes, mapped_bytes, resident_bytes, num_modules}}
+    for every archive loaded in this process."""
+    with _archives_lock:
+        archives = list(_archives.values())
+    stats = {}
+    for archive in archives:
+        mapped, resident = _get_mapping_stats(archive.path)
+        stats[archive.path] = {
+            "file_bytes": archive.file_bytes,
+            "mapped_bytes": mapped,
+            "resident_bytes": resident,
+            "num_modules": archive.num_modules,
+        }
+    return stats
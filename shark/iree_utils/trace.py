@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+from collections import deque
 from typing import List, Tuple
 
+import atexit
+import json
 import os
 import threading
 import time
@@ -74,3 +77,190 @@ class DetailLogger:
                         f"  +{(timestamp - self._start_time) * 1000}ms: {msg}"
                     )
             self._active = False
+
+
+def _trace_file() -> str:
+    return os.getenv("SHARK_TRACE_FILE", "")
+
+
+def _enable_trace() -> bool:
+    return os.getenv("SHARK_TRACE", "0") == "1" or bool(_trace_file())
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("_buffer", "_name", "_cat", "_args", "_start")
+
+    def __init__(self, buffer, name, cat, args):
+        self._buffer = buffer
+        self._name = name
+        self._cat = cat
+        self._args = args
+
+    def __enter__(self):
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        end = time.perf_counter_ns()
+        self._buffer.append(
+            (self._name, self._cat, self._start, end - self._start, self._args)
+        )
+        return False
+
+
+class Tracer:
+    """Records timed spans into a fixed-size ring buffer per thread.
+
+    Disabled tracers hand out a shared no-op span, so instrumented code only
+    pays for one attribute check. Spans can be exported as a Chrome
+    trace (chrome://tracing, Perfetto) or aggregated per span name.
+    """
+
+    def __init__(self, enabled: bool = False, buffer_size: int = 65536):
+        self.enabled = enabled
+        self.buffer_size = buffer_size
+        self._origin = time.perf_counter_ns()
+        self._local = threading.local()
+        self._buffers = []
+        self._lock = threading.Lock()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def _buffer(self):
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = deque(maxlen=self.buffer_size)
+            self._local.buffer = buffer
+            thread = threading.current_thread()
+            with self._lock:
+                self._buffers.append((thread.ident, thread.name, buffer))
+        return buffer
+
+    def span(self, name: str, cat: str = "shark", **args):
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self._buffer(), name, cat, args)
+
+    def instant(self, name: str, cat: str = "shark", **args):
+        # Marks a point in time inside the current span.
+        if self.enabled:
+            self._buffer().append(
+                (name, cat, time.perf_counter_ns(), None, args)
+            )
+
+    def clear(self):
+        with self._lock:
+            for _, _, buffer in self._buffers:
+                buffer.clear()
+
+    def events(self):
+        with self._lock:
+            buffers = list(self._buffers)
+        for tid, thread_name, buffer in buffers:
+            for event in list(buffer):
+                yield tid, thread_name, event
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        trace_events = []
+        thread_names = {}
+        for tid, thread_name, (name, cat, start, dur, args) in self.events():
+            thread_names[tid] = thread_name
+            event = {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": (start - self._origin) / 1000,
+                "pid": pid,
+                "tid": tid,
+                "args": {k: str(v) for k, v in args.items()},
+            }
+            if dur is None:
+                event["ph"] = "i"
+                event["s"] = "t"
+            else:
+                event["dur"] = dur / 1000
+            trace_events.append(event)
+        for tid, thread_name in thread_names.items():
+            trace_events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": thread_name},
+                }
+            )
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms"}
+
+    def export_chrome_trace(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.chrome_trace(), f)
+        print(f"Saved trace in {path}.")
+        return path
+
+    def stats(self):
+        """Returns {span name: count, total/mean/p50/p95/max in ms}."""
+        durations = {}
+        for _, _, (name, _, _, dur, _) in self.events():
+            if dur is None:
+                continue
+            durations.setdefault(name, []).append(dur / 1e6)
+        stats = {}
+        for name, values in durations.items():
+            values.sort()
+            stats[name] = {
+                "count": len(values),
+                "total_ms": sum(values),
+                "mean_ms": sum(values) / len(values),
+                "p50_ms": values[len(values) // 2],
+                "p95_ms": values[min(int(len(values) * 0.95), len(values) - 1)],
+                "max_ms": values[-1],
+            }
+        return stats
+
+    def format_stats(self):
+        rows = sorted(
+            self.stats().items(), key=lambda kv: kv[1]["total_ms"], reverse=True
+        )
+        lines = [
+            f"{'span':<40} {'count':>7} {'total ms':>11} {'mean ms':>10} "
+            f"{'p95 ms':>10}"
+        ]
+        for name, s in rows:
+            lines.append(
+                f"{name:<40} {s['count']:>7} {s['total_ms']:>11.3f} "
+                f"{s['mean_ms']:>10.3f} {s['p95_ms']:>10.3f}"
+            )
+        return "\n".join(lines)
+
+
+tracer = Tracer(
+    enabled=_enable_trace(),
+    buffer_size=int(os.getenv("SHARK_TRACE_BUFFER_SIZE", "65536")),
+)
+
+
+def trace_span(name: str, cat: str = "shark", **args):
+    return tracer.span(name, cat, **args)
+
+
+def _export_at_exit():
+    if tracer.enabled and _trace_file():
+        tracer.export_chrome_trace(_trace_file())
+        print(tracer.format_stats())
+
+
+atexit.register(_export_at_exit)
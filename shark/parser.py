@@ -116,6 +116,34 @@ parser.add_argument(
     help='directory where you want to store dispatch data generated with "--dispatch_benchmarks"',
 )
 
+parser.add_argument(
+    "--dispatch_benchmark_workers",
+    type=int,
+    default=0,
+    help="Number of dispatch benchmark modules to compile in parallel. 0 uses half the cpu count.",
+)
+
+parser.add_argument(
+    "--dispatch_benchmark_repetitions",
+    type=int,
+    default=5,
+    help="Number of times each dispatch benchmark is repeated; mean, median and stddev are reported.",
+)
+
+parser.add_argument(
+    "--dispatch_benchmark_cpus",
+    type=str,
+    default="",
+    help='cpus to pin dispatch benchmarks to, e.g. "2-7". Defaults to every available cpu but the first.',
+)
+
+parser.add_argument(
+    "--dump_isa",
+    default=False,
+    action="store_true",
+    help="Disassemble each benchmarked dispatch into isa.txt (amdllpc for spirv, objdump for cpu).",
+)
+
 parser.add_argument(
     "--enable_conv_transform",
     default=False,
@@ -146,12 +174,53 @@ parser.add_argument(
     "to augment the base device allocator",
     choices=["debug", "caching"],
 )
+parser.add_argument(
+    "--track_memory",
+    default=False,
+    action=argparse.BooleanOptionalAction,
+    help="Records host and device memory usage of every module invocation.",
+)
+parser.add_argument(
+    "--device_memory_budget",
+    type=str,
+    default=None,
+    help="Device memory budget, e.g. 4gib. Invocations that would exceed it "
+    "fail before any input is copied to the device. Implies --track_memory.",
+)
 parser.add_argument(
     "--task_topology_max_group_count",
     type=str,
     default=None,
     help="passthrough flag for the iree flag of the same name. If None, defaults to cpu-count",
 )
+parser.add_argument(
+    "--cpu_numa_node",
+    type=str,
+    default=None,
+    help="Runs the cpu runtime on the cpus of this NUMA node. "
+    "'auto' picks the node with the most cores.",
+)
+parser.add_argument(
+    "--cpu_replica",
+    type=str,
+    default=None,
+    help="INDEX/COUNT. Splits the physical cores between COUNT replicas "
+    "and runs the cpu runtime on the share of replica INDEX.",
+)
+parser.add_argument(
+    "--use_tuned_flags",
+    default=True,
+    action=argparse.BooleanOptionalAction,
+    help="Compiles modules with the flags stored by the autotuner for them, "
+    "when there are any.",
+)
+parser.add_argument(
+    "--autotune_cache",
+    type=str,
+    default=None,
+    help="Path of the autotuner's results. Defaults to "
+    "~/.cache/shark/autotune.json.",
+)
 
 parser.add_argument(
     "--vulkan_debug_utils",
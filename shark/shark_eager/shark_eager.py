@@ -1,11 +1,12 @@
 from typing import Any, Dict, List, Tuple
 from collections import defaultdict
 from shark.shark_importer import import_with_fx, save_mlir
-import torchvision.models as models
 import copy
 import io
 import numpy as np
+import operator
 import sys
+import threading
 import torch
 import torch.fx
 from torch.fx.node import Node
@@ -37,6 +38,91 @@ def shark_backend(fx_g: torch.fx.GraphModule, inputs, device: str = "cpu"):
     return shark_module
 
 
+# Ops that fail to compile and always run in torch.
+EAGER_FALLBACK_OPS = [torch.ops.aten.empty]
+
+# Process-wide cache of compiled op/subgraph modules, keyed by
+# (graph signature, input shapes and dtypes, device).
+_module_cache = {}
+_module_cache_lock = threading.Lock()
+_module_cache_stats = {"hits": 0, "misses": 0}
+# Cached in place of a module for graphs that failed to compile, so they run
+# in torch without being compiled again.
+_COMPILE_FAILED = object()
+
+
+def _signature_arg(arg, index):
+    if isinstance(arg, Node):
+        return ("node", index[arg])
+    if isinstance(arg, (list, tuple)):
+        return type(arg).__name__, tuple(_signature_arg(a, index) for a in arg)
+    if isinstance(arg, dict):
+        return tuple((k, _signature_arg(v, index)) for k, v in arg.items())
+    return repr(arg)
+
+
+def graph_signature(gm: torch.fx.GraphModule):
+    """Structural signature of a graph that ignores node names, so identical
+    ops (or subgraphs) in different places of a model share a module."""
+    index = {}
+    signature = []
+    for i, node in enumerate(gm.graph.nodes):
+        index[node] = i
+        signature.append(
+            (
+                node.op,
+                str(node.target) if node.op != "placeholder" else "",
+                _signature_arg(node.args, index),
+                _signature_arg(node.kwargs, index),
+            )
+        )
+    return tuple(signature)
+
+
+def input_signature(inputs):
+    return tuple(
+        (tuple(x.shape), str(x.dtype)) if isinstance(x, torch.Tensor) else x
+        for x in inputs
+    )
+
+
+def get_compiled_module(gm: torch.fx.GraphModule, inputs, device="cpu"):
+    """Returns the module compiled for the graph and inputs, or None if the
+    graph fails to compile."""
+    key = (graph_signature(gm), input_signature(inputs), device)
+    with _module_cache_lock:
+        module = _module_cache.get(key)
+        if module is not None:
+            _module_cache_stats["hits"] += 1
+            return None if module is _COMPILE_FAILED else module
+        _module_cache_stats["misses"] += 1
+    try:
+        module = shark_backend(gm, inputs, device)
+    except Exception as e:
+        print(
+            f"[WARNING] Compiling a graph of {len(gm.graph.nodes)} nodes "
+            f"failed, running it in torch instead: {e}"
+        )
+        module = _COMPILE_FAILED
+    with _module_cache_lock:
+        module = _module_cache.setdefault(key, module)
+    return None if module is _COMPILE_FAILED else module
+
+
+def module_cache_info():
+    with _module_cache_lock:
+        failed = sum(m is _COMPILE_FAILED for m in _module_cache.values())
+        return dict(
+            _module_cache_stats, size=len(_module_cache), failed=failed
+        )
+
+
+def clear_module_cache():
+    with _module_cache_lock:
+        _module_cache.clear()
+        _module_cache_stats.update(hits=0, misses=0)
+
+
 def _make_single_op_gm(node, captured_val, compiled_graph):
     """Make a GraphModule that just executes the given node."""
     g = torch.fx.Graph()
@@ -55,7 +141,7 @@ def _make_single_op_gm(node, captured_val, compiled_graph):
     g.output(call)
     g.lint()
     single_node = torch.fx.GraphModule(torch.nn.Module(), g)
-    compiled_module = shark_backend(single_node, inputs)
+    compiled_module = get_compiled_module(single_node, inputs)
     compiled_graph[node.name] = {
         "module": compiled_module,
         "inputs": [i for i in env],
@@ -70,13 +156,13 @@ def compiled_graph(gm: torch.fx.GraphModule, attr_info):
     for node in g.nodes:
         if node.op == "call_function":
             if not (
-                node.target in [torch.ops.aten.empty]
+                node.target in EAGER_FALLBACK_OPS
                 or node.name.startswith("getitem")
             ):
                 _make_single_op_gm(node, attr_info, compiled_graph)
 
             # Currently torch.aten.empty has an compilation issue, so running natively.
-            elif node.target in [torch.ops.aten.empty]:
+            elif node.target in EAGER_FALLBACK_OPS:
                 compiled_graph[node.name] = {
                     "target": node.target,
                     "args": node.args,
@@ -160,53 +246,200 @@ class ShapeProp:
         # return load_arg(self.graph.result)
 
 
-resnet18 = models.resnet18(pretrained=True)
-resnet18.train(False)
-input = (torch.randn(1, 3, 224, 224),)
+def _is_supported(node: Node, region: set) -> bool:
+    if node.op != "call_function" or node.target in EAGER_FALLBACK_OPS:
+        return False
+    # getitem can only be compiled together with the op producing the tuple.
+    if node.target is operator.getitem:
+        return node.args[0] in region
+    return True
 
-print(resnet18(input[0]))
 
-fx_graph = import_with_fx(resnet18, input, mlir_type="fx")
+def partition_graph(gm: torch.fx.GraphModule):
+    """
+    Splits the graph into maximal runs of consecutive supported nodes, to be
+    compiled as one module each, and single nodes that run in torch. Returns
+    a list of ("compiled", [nodes]) and ("eager", node) steps in graph order.
+    """
+    steps = []
+    region = []
+    members = set()
+    for node in gm.graph.nodes:
+        if node.op in ["placeholder", "get_attr", "output"]:
+            continue
+        if _is_supported(node, members):
+            region.append(node)
+            members.add(node)
+            continue
+        if region:
+            steps.append(("compiled", region))
+            region = []
+            members = set()
+        steps.append(("eager", node))
+    if region:
+        steps.append(("compiled", region))
+    return steps
+
+
+def _make_region_gm(nodes: list):
+    """Builds a GraphModule for a region. Values produced outside of it,
+    including weights, become placeholders; values used after it become
+    outputs. Returns the module, its input nodes and its output nodes."""
+    members = set(nodes)
+    g = torch.fx.Graph()
+    env = {}
+    input_nodes = []
+
+    def lookup(arg):
+        if arg not in env:
+            env[arg] = g.placeholder(f"arg{len(input_nodes)}")
+            input_nodes.append(arg)
+        return env[arg]
+
+    for node in nodes:
+        for arg in node.all_input_nodes:
+            if arg not in members:
+                lookup(arg)
+    for node in nodes:
+        env[node] = g.node_copy(node, lambda n: env[n])
+    output_nodes = [
+        node
+        for node in nodes
+        if any(user not in members for user in node.users)
+    ]
+    if len(output_nodes) == 1:
+        g.output(env[output_nodes[0]])
+    else:
+        g.output(tuple(env[node] for node in output_nodes))
+    g.lint()
+    region_gm = torch.fx.GraphModule(torch.nn.Module(), g)
+    return region_gm, input_nodes, output_nodes
 
-shape_prop = ShapeProp(fx_graph)
 
-x = shape_prop.propagate(input[0])
+def _specialize_region(region_gm: torch.fx.GraphModule, inputs):
+    """Copies a region's graph with its non-tensor inputs, like the ints
+    returned by size(), inlined as constants. Returns the module and its
+    remaining tensor inputs."""
+    g = torch.fx.Graph()
+    env = {}
+    tensor_inputs = []
+    placeholders = [n for n in region_gm.graph.nodes if n.op == "placeholder"]
+    for node, value in zip(placeholders, inputs):
+        if isinstance(value, torch.Tensor):
+            env[node] = g.placeholder(node.name)
+            tensor_inputs.append(value)
+        else:
+            env[node] = value
+    for node in region_gm.graph.nodes:
+        if node.op == "output":
+            g.output(torch.fx.graph.map_arg(node.args[0], lambda n: env[n]))
+        elif node.op != "placeholder":
+            env[node] = g.node_copy(node, lambda n: env[n])
+    g.lint()
+    return torch.fx.GraphModule(torch.nn.Module(), g), tensor_inputs
 
-shark_graph = compiled_graph(fx_graph, x)
 
+def _to_numpy(value):
+    return value.detach().contiguous().numpy()
 
-for key in shark_graph:
-    if key.startswith("getitem"):
-        input_val = shark_graph[key]["input"]
-        pos = shark_graph[key]["pos"]
-        if input_val not in shark_graph:
-            shark_graph[key]["result"] = x[input_val][pos].detach()
-        else:
-            shark_graph[key]["result"] = shark_graph[input_val]["result"][
-                pos
-            ].detach()
-    elif key.startswith("empty"):
-        operator = shark_graph[key]["target"]
-        args = shark_graph[key]["args"]
-        kwargs = shark_graph[key]["kwargs"]
-        shark_graph[key]["result"] = operator(*args, **kwargs).detach()
-    else:
-        input_val = shark_graph[key]["inputs"]
-        input_tensors = []
-        for input in input_val:
-            if input not in shark_graph:
-                input_tensors.append(x[input].detach())
+
+class SharkEagerModule:
+    """
+    Runs an FX graph with its supported regions compiled by SHARK and the
+    rest in torch. Regions compile on first use for the shapes they see and
+    come from the process-wide module cache afterwards, so identical
+    regions, repeated calls and other SharkEagerModules share modules.
+    """
+
+    def __init__(self, gm: torch.fx.GraphModule, device: str = "cpu"):
+        self.gm = gm
+        self.device = device
+        self.modules = dict(gm.named_modules())
+        self.steps = []
+        for kind, value in partition_graph(gm):
+            if kind == "compiled":
+                value = (value, *_make_region_gm(value))
+            self.steps.append((kind, value))
+        # Regions specialized for the non-tensor inputs they were called
+        # with, keyed by the region and those inputs.
+        self._specialized = {}
+
+    def _fetch_attr(self, target: str):
+        attr_itr = self.gm
+        for atom in target.split("."):
+            attr_itr = getattr(attr_itr, atom)
+        return attr_itr
+
+    def _run_eager(self, node, env):
+        def load_arg(a):
+            return torch.fx.graph.map_arg(a, lambda n: env[n])
+
+        args, kwargs = load_arg(node.args), load_arg(node.kwargs)
+        if node.op == "call_function":
+            return node.target(*args, **kwargs)
+        if node.op == "call_method":
+            self_obj, *args = args
+            return getattr(self_obj, node.target)(*args, **kwargs)
+        return self.modules[node.target](*args, **kwargs)
+
+    def _specialize(self, region_gm, inputs):
+        constants = tuple(
+            (i, repr(x))
+            for i, x in enumerate(inputs)
+            if not isinstance(x, torch.Tensor)
+        )
+        if not constants:
+            return region_gm, inputs
+        key = (id(region_gm), constants)
+        if key not in self._specialized:
+            self._specialized[key] = _specialize_region(region_gm, inputs)[0]
+        tensors = [x for x in inputs if isinstance(x, torch.Tensor)]
+        return self._specialized[key], tensors
+
+    def _run_compiled(self, region, env):
+        nodes, region_gm, input_nodes, output_nodes = region
+        inputs = [env[node] for node in input_nodes]
+        region_gm, inputs = self._specialize(region_gm, inputs)
+        module = get_compiled_module(region_gm, inputs, self.device)
+        if module is None:
+            for node in nodes:
+                env[node] = self._run_eager(node, env)
+            return
+        outs = module("forward", [_to_numpy(x) for x in inputs])
+        if len(output_nodes) == 1:
+            outs = [outs]
+        for node, out in zip(output_nodes, outs):
+            env[node] = torch.from_numpy(np.asarray(out))
+
+    def __call__(self, *args):
+        args_iter = iter(args)
+        env = {}
+        for node in self.gm.graph.nodes:
+            if node.op == "placeholder":
+                env[node] = next(args_iter)
+            elif node.op == "get_attr":
+                env[node] = self._fetch_attr(node.target)
+        for kind, value in self.steps:
+            if kind == "compiled":
+                self._run_compiled(value, env)
             else:
-                input_tensors.append(shark_graph[input]["result"])
-
-        val = shark_graph[key]["module"]("forward", input_tensors)
-        if isinstance(val, (tuple, list)):
-            list_val = []
-            for v in val:
-                list_val.append(torch.from_numpy(v))
-            shark_graph[key]["result"] = list_val
-        else:
-            shark_graph[key]["result"] = torch.from_numpy(val)
+                env[value] = self._run_eager(value, env)
+        output = next(n for n in self.gm.graph.nodes if n.op == "output")
+        return torch.fx.graph.map_arg(output.args[0], lambda n: env[n])
+
+
+if __name__ == "__main__":
+    import torchvision.models as models
+
+    resnet18 = models.resnet18(pretrained=True)
+    resnet18.train(False)
+    input = (torch.randn(1, 3, 224, 224),)
 
+    print(resnet18(input[0]))
 
-print(shark_graph)
+    fx_graph = import_with_fx(resnet18, input, mlir_type="fx")
+    eager_module = SharkEagerModule(fx_graph)
+    print(eager_module(*input))
+    # The second call reuses the modules compiled by the first.
+    print(eager_module(*input))
+    print(module_cache_info())
@@ -7,6 +7,7 @@ import os
 import hashlib
 
 from apps.shark_studio.modules.shared_cmd_opts import cmd_opts
+from shark.iree_utils.trace import trace_span
 
 def create_hash(file_name):
     with open(file_name, "rb") as f:
@@ -124,21 +125,22 @@ class SharkImporter:
         save_dir=cmd_opts.tmp_dir, #"./shark_tmp/",
         mlir_type="linalg",
     ):
-        if self.frontend in ["torch", "pytorch"]:
-            if self.inputs == None:
-                print(
-                    "Please pass in the inputs, the inputs are required to determine the shape of the mlir_module"
+        with trace_span("import", frontend=self.frontend):
+            if self.frontend in ["torch", "pytorch"]:
+                if self.inputs == None:
+                    print(
+                        "Please pass in the inputs, the inputs are required to determine the shape of the mlir_module"
+                    )
+                    sys.exit(1)
+                return (
+                    self._torch_mlir(is_dynamic, tracing_required, mlir_type),
+                    func_name,
                 )
-                sys.exit(1)
-            return (
-                self._torch_mlir(is_dynamic, tracing_required, mlir_type),
-                func_name,
-            )
-        if self.frontend in ["tf", "tensorflow"]:
-            return self._tf_mlir(func_name, save_dir), func_name
-        if self.frontend in ["tflite", "tf-lite"]:
-            func_name = "main"
-            return self._tflite_mlir(func_name, save_dir), func_name
+            if self.frontend in ["tf", "tensorflow"]:
+                return self._tf_mlir(func_name, save_dir), func_name
+            if self.frontend in ["tflite", "tf-lite"]:
+                func_name = "main"
+                return self._tflite_mlir(func_name, save_dir), func_name
 
     # Converts the frontend specific tensors into np array.
     def convert_to_numpy(self, array_tuple: tuple):
@@ -15,8 +15,12 @@ from shark.iree_utils.compile_utils import (
     create_dispatch_dirs,
     compile_benchmark_dirs,
 )
+from shark.iree_utils.dispatch_benchmark_utils import get_temp_bench_dir
+from shark.iree_utils.trace import trace_span
 import os
+import shutil
 from shark.shark_runner import SharkRunner
+from shark.iree_utils.memory_utils import create_memory_tracker
 from shark.parser import shark_args
 import numpy as np
 
@@ -50,6 +54,9 @@ class SharkInference:
         Whether this SharkInference module should be benchmark-enabled.
     mmap: bool
         Whether to load/run vmfb using mmap. It's `True` by default.
+    device_memory_budget: str
+        Device memory budget like "4gib". Invocations that would exceed it
+        raise a DeviceMemoryBudgetError. Defaults to --device_memory_budget.
 
     Methods
     -------
@@ -60,6 +67,9 @@ class SharkInference:
     input_info():
         Gives the information about the inputs required by the `function_name`.
         This can be expensive as it does string matching to do so.
+    memory_report():
+        Gives the host and device memory used by the invocations so far, when
+        --track_memory or a memory budget is set.
 
     """
 
@@ -74,6 +84,7 @@ class SharkInference:
         device_idx: int = None,
         mmap: bool = True,
         rt_flags: list = [],
+        device_memory_budget: str = None,
     ):
         self.mlir_module = mlir_module
         if mlir_module is not None:
@@ -102,6 +113,7 @@ class SharkInference:
         self.shark_runner = None
         self.mmap = mmap
         self.rt_flags = rt_flags
+        self.device_memory_budget = device_memory_budget
 
     def compile(self, extra_args=[]):
         if self.dispatch_benchmarks is not None:
@@ -111,10 +123,9 @@ class SharkInference:
             extra_args.append(
                 f"--iree-hal-dump-executable-binaries-to={self.dispatch_benchmarks_dir}"
             )
-            temp_dir = self.dispatch_benchmarks_dir.split("/")
-            temp_dir[-1] = "temp_" + temp_dir[-1]
-            temp_dir = "/".join(temp_dir)
-            self.temp_dispatch_benchmarks_dir = temp_dir
+            self.temp_dispatch_benchmarks_dir = get_temp_bench_dir(
+                self.dispatch_benchmarks_dir
+            )
             extra_args.append(
                 f"--iree-hal-dump-executable-benchmarks-to={self.temp_dispatch_benchmarks_dir}"
             )
@@ -139,6 +150,8 @@ class SharkInference:
                 rt_flags=self.rt_flags,
             )
 
+        self._set_memory_budget()
+
         if self.dispatch_benchmarks is not None:
             create_dispatch_dirs(self.dispatch_benchmarks_dir, self.device)
             compile_benchmark_dirs(
@@ -146,19 +159,34 @@ class SharkInference:
                 self.device,
                 self.dispatch_benchmarks,
             )
-            os.system(f"rm -rf {self.temp_dispatch_benchmarks_dir}")
+            shutil.rmtree(
+                self.temp_dispatch_benchmarks_dir, ignore_errors=True
+            )
+
+    def _set_memory_budget(self):
+        if self.device_memory_budget is not None:
+            self.shark_runner.memory_tracker = create_memory_tracker(
+                self.device_memory_budget
+            )
+
+    def memory_report(self):
+        if self.shark_runner is None:
+            return None
+        return self.shark_runner.memory_report()
 
     # inputs are considered to be tuple of np.array.
     def __call__(self, function_name: str, inputs: tuple, send_to_host=True):
-        return self.shark_runner.run(
-            function_name, inputs, send_to_host, device=self.device
-        )
+        with trace_span("SharkInference.__call__", function=function_name):
+            return self.shark_runner.run(
+                function_name, inputs, send_to_host, device=self.device
+            )
 
     # forward function.
     def forward(self, inputs: tuple, send_to_host=True):
-        return self.shark_runner.run(
-            "forward", inputs, send_to_host, device=self.device
-        )
+        with trace_span("SharkInference.forward", function="forward"):
+            return self.shark_runner.run(
+                "forward", inputs, send_to_host, device=self.device
+            )
 
     # Get all function names defined within the compiled module.
     def get_functions_in_module(self):
@@ -240,4 +268,5 @@ class SharkInference:
         self.shark_runner.iree_config = params["config"]
         self.shark_runner.temp_file_to_unlink = params["temp_file_to_unlink"]
         del params
+        self._set_memory_budget()
         return
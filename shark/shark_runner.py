@@ -19,6 +19,7 @@ from shark.iree_utils.compile_utils import (
     load_flatbuffer,
 )
 from shark.iree_utils._common import check_device_drivers, device_driver_info
+from shark.iree_utils.memory_utils import create_memory_tracker
 from shark.parser import shark_args
 import os
 import sys
@@ -62,6 +63,9 @@ class SharkRunner:
     input_info():
         Gives the information about the inputs required by the `function_name`.
         This can be expensive as it does string matching to do so.
+    memory_report():
+        Gives the memory usage recorded with --track_memory or a
+        --device_memory_budget, None otherwise.
     """
 
     def __init__(
@@ -88,6 +92,7 @@ class SharkRunner:
         self.extra_args = extra_args
         self.device_idx = device_idx
         self.rt_flags = rt_flags
+        self.memory_tracker = create_memory_tracker()
 
         if check_device_drivers(self.device):
             print(device_driver_info(self.device))
@@ -112,15 +117,34 @@ class SharkRunner:
     def run(
         self, function_name, inputs: tuple, send_to_host=False, device=None
     ):
-        return get_results(
-            self.iree_compilation_module,
-            function_name,
-            inputs,
-            self.iree_config,
-            self.mlir_dialect,
-            send_to_host,
-            device=device,
-        )
+        if self.memory_tracker is None:
+            return get_results(
+                self.iree_compilation_module,
+                function_name,
+                inputs,
+                self.iree_config,
+                self.mlir_dialect,
+                send_to_host,
+                device=device,
+            )
+        with self.memory_tracker.invocation(
+            self.iree_config.device, function_name, inputs, send_to_host
+        ) as invocation:
+            invocation["outputs"] = get_results(
+                self.iree_compilation_module,
+                function_name,
+                inputs,
+                self.iree_config,
+                self.mlir_dialect,
+                send_to_host,
+                device=device,
+            )
+        return invocation["outputs"]
+
+    def memory_report(self):
+        if self.memory_tracker is None:
+            return None
+        return self.memory_tracker.report(self.iree_config.device)
 
     # Get all function names defined within the compiled module.
     def get_functions_in_module(self):
@@ -16,8 +16,10 @@ from shark.parser import shark_args
 from shark.shark_runner import SharkRunner
 from shark.backward_makefx import MakeFxModule
 from shark.shark_importer import import_with_fx, save_mlir
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from tqdm import tqdm
+import os
 import sys
 
 
@@ -51,6 +53,11 @@ class SharkTrainer:
         self.device = device if device is not None else shark_args.device
 
         self.shark_runner = None
+        # Parameters, buffers and optimizer state as device arrays, carried
+        # from one training step to the next without host round trips.
+        self.device_state = None
+        self._checkpoint_pool = ThreadPoolExecutor(max_workers=1)
+        self._checkpoints = []
 
     # Sets the frontend i.e `pytorch` or `tensorflow`.
     def set_frontend(self, frontend: str):
@@ -116,18 +123,68 @@ class SharkTrainer:
         buffers = [i.detach() for i in self.model.buffers()]
         return params + buffers
 
+    def get_torch_param_names(self):
+        return [name for name, _ in self.model.named_parameters()] + [
+            name for name, _ in self.model.named_buffers()
+        ]
+
+    def _to_device(self, arrays):
+        import iree.runtime as ireert
+
+        device = self.shark_runner.iree_config.device
+        return [ireert.asdevicearray(device, x) for x in arrays]
+
+    def get_host_state(self):
+        """Copies the device-resident training state back to the host."""
+        return [np.asarray(x) for x in self.device_state]
+
+    def checkpoint(self, path):
+        """
+        Writes the current training state to `path` (.npz) in the background.
+        The state is read back here, between steps, so the worker thread only
+        writes host arrays and never touches the device while training runs.
+        """
+        state = self.get_host_state()
+        names = self.get_torch_param_names()
+        names += [f"state_{i}" for i in range(len(names), len(state))]
+
+        def save():
+            tmp_path = f"{path}.tmp.npz"
+            np.savez(tmp_path, **dict(zip(names, state)))
+            os.replace(tmp_path, path)
+            return path
+
+        future = self._checkpoint_pool.submit(save)
+        self._checkpoints.append(future)
+        return future
+
+    def wait_for_checkpoints(self):
+        for future in self._checkpoints:
+            future.result()
+        self._checkpoints = []
+
     # Function to train pytorch module.
-    def _train_torch(self, num_iters):
+    def _train_torch(self, num_iters, checkpoint_every=0, checkpoint_dir=None):
         """Returns the updated weights after num_iters"""
-        params = self.get_torch_params()
-        params = [x.numpy() for x in params]
+        if self.device_state is None:
+            params = [x.numpy() for x in self.get_torch_params()]
+            self.device_state = self._to_device(params)
+        inputs = self._to_device([np.asarray(x) for x in self.input])
         print(f"Training started for {num_iters} iterations:")
         for i in tqdm(range(num_iters)):
-            params = self.shark_runner.run(
-                "forward", params + self.input, self.frontend
+            outputs = self.shark_runner.run(
+                "forward", self.device_state + inputs, send_to_host=False
+            )
+            self.device_state = (
+                outputs if isinstance(outputs, list) else [outputs]
             )
+            if checkpoint_every and (i + 1) % checkpoint_every == 0:
+                self.checkpoint(
+                    os.path.join(checkpoint_dir, f"checkpoint_{i + 1}.npz")
+                )
 
-        return params
+        self.wait_for_checkpoints()
+        return self.get_host_state()
 
     # Function to train tensorflow module.
     # Output final loss.
@@ -153,9 +210,11 @@ class SharkTrainer:
             outputs = self.shark_runner.forward(input_list, self.frontend)
         return outputs
 
-    def train(self, num_iters=1):
+    def train(self, num_iters=1, checkpoint_every=0, checkpoint_dir="."):
         if self.frontend in ["torch", "pytorch"]:
-            return self._train_torch(num_iters)
+            return self._train_torch(
+                num_iters, checkpoint_every, checkpoint_dir
+            )
         elif self.frontend in ["tf", "tensorflow", "mhlo"]:
             return self._train_tf(num_iters)
         else:
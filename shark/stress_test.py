@@ -21,9 +21,18 @@ import argparse
 from shark.iree_utils._common import _IREE_DEVICE_MAP
 import multiprocessing
 from shark.shark_runner import supported_dialects
+from shark.stress_test_telemetry import (
+    StressTestTelemetry,
+    detect_regressions,
+    get_device_memory_bytes,
+)
 import logging
 from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from concurrent.futures.thread import ThreadPoolExecutor
+import json
+import sys
+import threading
 import time
 import numpy as np
 
@@ -42,6 +51,9 @@ def stress_test_compiled_model(
     inference_timeout_seconds: float,
     tolerance_nulp: int,
     stress_test_index: int,
+    report_interval_seconds: float = 10,
+    warmup_iterations: int = 1,
+    start_barrier=None,
 ):
     logging.info(
         f"Running stress test {stress_test_index} on device {device}."
@@ -50,42 +62,108 @@ def stress_test_compiled_model(
     # We are using execution in a sperate thread in order to be able
     # to wait with a timeout on the inference operation.
     module_executor = ThreadPoolExecutor(1)
+    # Every worker maps the same vmfb for its device type, so the module is
+    # only read from disk once and its pages are shared between processes.
     shark_module = module_executor.submit(
         SharkInference,
         mlir_module=bytes(),
         function_name=function_name,
         device=device,
+        mmap=True,
     ).result()
     module_executor.submit(
         shark_module.load_module, shark_module_path
     ).result()
     input_batches = [np.repeat(arr, batch_size, axis=0) for arr in inputs]
     golden_output_batches = np.repeat(golden_out, batch_size, axis=0)
-    report_interval_seconds = 10
-    start_time = time.time()
-    previous_report_time = start_time
     first_iteration_output = None
+    try:
+        for i in range(warmup_iterations):
+            output = module_executor.submit(
+                shark_module.forward, input_batches
+            ).result(inference_timeout_seconds)
+            if first_iteration_output is None:
+                np.testing.assert_array_almost_equal_nulp(
+                    golden_output_batches, output, nulp=tolerance_nulp
+                )
+                first_iteration_output = output
+    except BaseException:
+        # Don't keep the other workers waiting for this one.
+        if start_barrier is not None:
+            start_barrier.abort()
+        raise
+    if start_barrier is not None:
+        try:
+            start_barrier.wait()
+        except threading.BrokenBarrierError:
+            logging.warning(
+                f"Stress test {stress_test_index} on device {device} is "
+                "starting without the other workers."
+            )
+    telemetry = StressTestTelemetry(
+        device,
+        stress_test_index,
+        batch_size=batch_size,
+        bucket_seconds=report_interval_seconds,
+        memory_fn=lambda: module_executor.submit(
+            get_device_memory_bytes, shark_module
+        ).result(inference_timeout_seconds),
+    )
+    start_time = time.time()
     for i in range(max_iterations):
-        output = module_executor.submit(
-            shark_module.forward, input_batches
-        ).result(inference_timeout_seconds)
-        if first_iteration_output is None:
-            np.testing.assert_array_almost_equal_nulp(
-                golden_output_batches, output, nulp=tolerance_nulp
+        iteration_start = time.time()
+        try:
+            output = module_executor.submit(
+                shark_module.forward, input_batches
+            ).result(inference_timeout_seconds)
+        except FutureTimeoutError:
+            # The module thread is still stuck in the call, so nothing
+            # else can run on this device.
+            logging.error(
+                f"Stress test {stress_test_index} on device {device} timed "
+                f"out at iteration {i+1}."
+            )
+            telemetry.record_timeout()
+            telemetry.aborted = "timeout"
+            break
+        except Exception as e:
+            logging.error(
+                f"Stress test {stress_test_index} on device {device} failed "
+                f"at iteration {i+1}: {e}"
             )
-            first_iteration_output = output
+            summary = telemetry.record_error()
         else:
-            np.testing.assert_array_equal(output, first_iteration_output)
-        current_time = time.time()
-        if report_interval_seconds < current_time - previous_report_time:
+            latency = time.time() - iteration_start
+            try:
+                if first_iteration_output is None:
+                    np.testing.assert_array_almost_equal_nulp(
+                        golden_output_batches, output, nulp=tolerance_nulp
+                    )
+                    first_iteration_output = output
+                else:
+                    np.testing.assert_array_equal(
+                        output, first_iteration_output
+                    )
+                summary = telemetry.record_latency(latency)
+            except AssertionError as e:
+                logging.error(
+                    f"Stress test {stress_test_index} on device {device} "
+                    f"produced a wrong result at iteration {i+1}: {e}"
+                )
+                summary = telemetry.record_error()
+        if summary is not None:
             logging.info(
-                f"Stress test {stress_test_index} on device "
-                f"{device} at iteration {i+1}"
+                f"Stress test {stress_test_index} on device {device} at "
+                f"iteration {i+1}: {summary['throughput']:.2f} samples/s, "
+                f"p50 {summary['latency_p50_ms']}ms, "
+                f"p99 {summary['latency_p99_ms']}ms, "
+                f"{summary['errors']} errors"
             )
-            previous_report_time = current_time
-        if max_duration_seconds < current_time - start_time:
-            return
+        if max_duration_seconds < time.time() - start_time:
+            break
+    module_executor.shutdown(wait=telemetry.aborted is None)
     logging.info(f"Stress test {stress_test_index} on device {device} done.")
+    return telemetry.finish()
 
 
 def get_device_type(device_name: str):
@@ -118,22 +196,45 @@ def query_devices(device_types: Optional[List[str]] = None) -> List[str]:
     return devices
 
 
+def compile_stress_test_module_for_device_type(
+    device_type: str, mlir_model: str, func_name: str, mlir_dialect: str
+) -> str:
+    logging.info(
+        f"Compiling stress test model for device type {device_type}."
+    )
+    shark_module = SharkInference(
+        mlir_model,
+        func_name,
+        mlir_dialect=mlir_dialect,
+        device=device_type,
+    )
+    return shark_module.save_module()
+
+
 def compile_stress_test_module(
-    device_types: List[str], mlir_model: str, func_name: str, mlir_dialect: str
+    device_types: List[str],
+    mlir_model: str,
+    func_name: str,
+    mlir_dialect: str,
+    max_workers: Optional[int] = None,
 ) -> List[str]:
-    shark_module_paths = []
-    for device_type in device_types:
-        logging.info(
-            f"Compiling stress test model for device type {device_type}."
-        )
-        shark_module = SharkInference(
-            mlir_model,
-            func_name,
-            mlir_dialect=mlir_dialect,
-            device=device_type,
-        )
-        shark_module_paths.append(shark_module.save_module())
-    return shark_module_paths
+    # Each device type compiles in its own process. This runs the compiles
+    # in parallel and keeps CUDA from being intialized in this process,
+    # where cuInit would fail in the workers forked later.
+    with ProcessPoolExecutor(
+        max_workers or max(len(device_types), 1)
+    ) as executor:
+        futures = [
+            executor.submit(
+                compile_stress_test_module_for_device_type,
+                device_type,
+                mlir_model,
+                func_name,
+                mlir_dialect,
+            )
+            for device_type in device_types
+        ]
+        return [future.result() for future in futures]
 
 
 def stress_test(
@@ -149,6 +250,13 @@ def stress_test(
     frontend: str = "torch",
     oversubscription_factor: int = 1,
     tolerance_nulp: int = 50000,
+    report_interval_seconds: float = 10,
+    telemetry_output: Optional[str] = None,
+    soak: bool = False,
+    soak_latency_drift: float = 0.1,
+    soak_memory_growth_mb_per_hour: float = 64,
+    compile_workers: Optional[int] = None,
+    warmup_iterations: int = 1,
 ):
     logging.info(f"Downloading stress test model {model_name}.")
     mlir_model, func_name, inputs, golden_out = download_model(
@@ -165,17 +273,13 @@ def stress_test(
             )
 
     device_types_set = list(set(get_device_types(device_names)))
-    with ProcessPoolExecutor() as executor:
-        # This needs to run in a subprocess because when compiling for CUDA,
-        # some stuff get intialized and cuInit will fail in a forked process
-        # later. It should be just compiling, but alas.
-        shark_module_paths_set = executor.submit(
-            compile_stress_test_module,
-            device_types_set,
-            mlir_model,
-            func_name,
-            mlir_dialect,
-        ).result()
+    shark_module_paths_set = compile_stress_test_module(
+        device_types_set,
+        mlir_model,
+        func_name,
+        mlir_dialect,
+        max_workers=compile_workers,
+    )
     device_type_shark_module_path_map = {
         device_type: module_path
         for device_type, module_path in zip(
@@ -192,10 +296,16 @@ def stress_test(
     # This needs to run in a spearate process, because it uses the drvier chache
     # in IREE and a subsequent call to `iree.runtime.SystemContext.add_vm_module`
     # in a forked process will hang.
-    with multiprocessing.Pool(
+    num_workers = (
         len(device_name_shark_module_path_map) * oversubscription_factor
+    )
+    # Workers load and warm up at their own pace, then wait for each other
+    # so the measured phase starts on all devices at once.
+    with multiprocessing.Manager() as manager, multiprocessing.Pool(
+        num_workers
     ) as process_pool:
-        process_pool.starmap(
+        start_barrier = manager.Barrier(num_workers)
+        reports = process_pool.starmap(
             stress_test_compiled_model,
             [
                 (
@@ -210,6 +320,9 @@ def stress_test(
                     inference_timeout_seconds,
                     tolerance_nulp,
                     stress_test_index,
+                    report_interval_seconds,
+                    warmup_iterations,
+                    start_barrier,
                 )
                 for stress_test_index, (device_name, module_path) in enumerate(
                     list(device_name_shark_module_path_map.items())
@@ -218,6 +331,40 @@ def stress_test(
             ],
         )
 
+    for report in reports:
+        report["regressions"] = []
+        if report["aborted"] is not None:
+            logging.warning(
+                f"Stress test {report['stress_test_index']} on device "
+                f"{report['device']} aborted: {report['aborted']}."
+            )
+        if soak:
+            report["regressions"] = detect_regressions(
+                report,
+                max_latency_drift=soak_latency_drift,
+                max_memory_growth_per_hour=soak_memory_growth_mb_per_hour
+                * 1024**2,
+            )
+            for finding in report["regressions"]:
+                logging.warning(
+                    f"Stress test {report['stress_test_index']} on device "
+                    f"{report['device']}: {finding}"
+                )
+    if telemetry_output is not None:
+        with open(telemetry_output, "w") as f:
+            json.dump(
+                {
+                    "model": model_name,
+                    "batch_size": batch_size,
+                    "soak": soak,
+                    "workers": reports,
+                },
+                f,
+                indent=2,
+            )
+        logging.info(f"Stress test telemetry written to {telemetry_output}.")
+    return reports
+
 
 if __name__ == "__main__":
     logging.basicConfig(encoding="utf-8", level=logging.INFO)
@@ -297,9 +444,57 @@ if __name__ == "__main__":
         "when verifing results with the golden reference output.",
         default=50000,
     )
+    parser.add_argument(
+        "--report-interval",
+        type=float,
+        help="Length in seconds of each telemetry bucket.",
+        default=10,
+    )
+    parser.add_argument(
+        "--telemetry-output",
+        type=str,
+        help="Path of a JSON file to write the per worker telemetry to.",
+        default=None,
+    )
+    parser.add_argument(
+        "--soak",
+        help="Check the telemetry for latency drift and memory growth and "
+        "exit with a non-zero status if any is found.",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--soak-latency-drift",
+        type=float,
+        help="Maximum relative increase of the p50 latency between the start "
+        "and the end of a soak run.",
+        default=0.1,
+    )
+    parser.add_argument(
+        "--soak-memory-growth",
+        type=float,
+        help="Maximum host or device memory growth in MiB per hour "
+        "during a soak run.",
+        default=64,
+    )
+
+    parser.add_argument(
+        "--compile-workers",
+        type=int,
+        help="Number of device types to compile for in parallel. "
+        "Defaults to all of them.",
+        default=None,
+    )
+    parser.add_argument(
+        "--warmup-iterations",
+        type=int,
+        help="Number of unmeasured iterations each worker runs before all "
+        "workers start the stress test together.",
+        default=1,
+    )
 
     args = parser.parse_known_args()[0]
-    stress_test(
+    reports = stress_test(
         model_name=args.model,
         dynamic_model=args.dynamic,
         frontend=args.frontend,
@@ -312,4 +507,18 @@ if __name__ == "__main__":
         max_duration_seconds=args.max_duration,
         inference_timeout_seconds=args.inference_timeout,
         tolerance_nulp=args.tolerance_nulp,
+        report_interval_seconds=args.report_interval,
+        telemetry_output=args.telemetry_output,
+        soak=args.soak,
+        soak_latency_drift=args.soak_latency_drift,
+        soak_memory_growth_mb_per_hour=args.soak_memory_growth,
+        compile_workers=args.compile_workers,
+        warmup_iterations=args.warmup_iterations,
     )
+    if any(
+        report["regressions"]
+        or report["errors"]
+        or report["aborted"] is not None
+        for report in reports
+    ):
+        sys.exit(1)
@@ -0,0 +1,191 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Telemetry for shark.stress_test. Every stress test worker collects
+# time-bucketed series of throughput, latency percentiles, host RSS, device
+# memory and error/timeout counts. Soak runs compare the end of the run with
+# its start to flag latency drift and memory growth.
+
+from typing import List, Optional
+import time
+
+from shark.iree_utils.memory_utils import (
+    get_allocator_statistics,
+    get_host_rss_bytes,
+    get_live_device_bytes,
+)
+
+
+def get_device_memory_bytes(shark_module) -> Optional[int]:
+    """Bytes currently allocated on the module's device, if the runtime's
+    allocator reports it."""
+    try:
+        device = shark_module.shark_runner.iree_config.device
+    except AttributeError:
+        return None
+    return get_live_device_bytes(get_allocator_statistics(device))
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    if not sorted_values:
+        return None
+    index = int(round(q * (len(sorted_values) - 1)))
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+class TelemetryBucket:
+    def __init__(self, start: float):
+        self.start = start
+        self.latencies = []
+        self.errors = 0
+        self.timeouts = 0
+
+    def summarize(self, end: float, batch_size: int, rss, device_memory):
+        latencies = sorted(self.latencies)
+        duration = max(end - self.start, 1e-9)
+        return {
+            "start": self.start,
+            "end": end,
+            "iterations": len(latencies),
+            "throughput": len(latencies) * batch_size / duration,
+            "latency_p50_ms": _to_ms(percentile(latencies, 0.5)),
+            "latency_p90_ms": _to_ms(percentile(latencies, 0.9)),
+            "latency_p99_ms": _to_ms(percentile(latencies, 0.99)),
+            "latency_max_ms": _to_ms(latencies[-1] if latencies else None),
+            "host_rss_bytes": rss,
+            "device_memory_bytes": device_memory,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+        }
+
+
+def _to_ms(seconds):
+    return None if seconds is None else seconds * 1000
+
+
+class StressTestTelemetry:
+    def __init__(
+        self,
+        device: str,
+        stress_test_index: int,
+        batch_size: int = 1,
+        bucket_seconds: float = 10,
+        memory_fn=None,
+        clock=time.time,
+    ):
+        self.device = device
+        self.stress_test_index = stress_test_index
+        self.batch_size = batch_size
+        self.bucket_seconds = bucket_seconds
+        self.memory_fn = memory_fn
+        self.clock = clock
+        self.start = clock()
+        self.bucket = TelemetryBucket(self.start)
+        self.series = []
+        self.aborted = None
+
+    def _roll(self, now: float, force: bool = False):
+        if not force and now - self.bucket.start < self.bucket_seconds:
+            return None
+        device_memory = self.memory_fn() if self.memory_fn else None
+        summary = self.bucket.summarize(
+            now, self.batch_size, get_host_rss_bytes(), device_memory
+        )
+        self.series.append(summary)
+        self.bucket = TelemetryBucket(now)
+        return summary
+
+    def record_latency(self, seconds: float):
+        self.bucket.latencies.append(seconds)
+        return self._roll(self.clock())
+
+    def record_error(self):
+        self.bucket.errors += 1
+        return self._roll(self.clock())
+
+    def record_timeout(self):
+        self.bucket.timeouts += 1
+        return self._roll(self.clock())
+
+    def finish(self):
+        if self.bucket.latencies or self.bucket.errors or self.bucket.timeouts:
+            self._roll(self.clock(), force=True)
+        return self.report()
+
+    def report(self):
+        return {
+            "device": self.device,
+            "stress_test_index": self.stress_test_index,
+            "batch_size": self.batch_size,
+            "bucket_seconds": self.bucket_seconds,
+            "iterations": sum(b["iterations"] for b in self.series),
+            "errors": sum(b["errors"] for b in self.series),
+            "timeouts": sum(b["timeouts"] for b in self.series),
+            "aborted": self.aborted,
+            "series": self.series,
+        }
+
+
+def _median(values):
+    values = sorted(v for v in values if v is not None)
+    return values[len(values) // 2] if values else None
+
+
+def _slope_per_hour(points):
+    # Least squares slope of (seconds, value) points, scaled to per hour.
+    points = [(t, v) for t, v in points if v is not None]
+    if len(points) < 2:
+        return None
+    mean_t = sum(t for t, _ in points) / len(points)
+    mean_v = sum(v for _, v in points) / len(points)
+    var_t = sum((t - mean_t) ** 2 for t, _ in points)
+    if var_t == 0:
+        return None
+    cov = sum((t - mean_t) * (v - mean_v) for t, v in points)
+    return cov / var_t * 3600
+
+
+def detect_regressions(
+    report: dict,
+    max_latency_drift: float = 0.1,
+    max_memory_growth_per_hour: float = 64 * 1024**2,
+    window_fraction: float = 0.1,
+    warmup_buckets: int = 1,
+):
+    """
+    Compares the median p50 latency of the last window of buckets with the
+    first one after warm-up, and fits host RSS and device memory over time.
+    Returns a list of human readable findings, empty if the run is stable.
+    """
+    series = report["series"][warmup_buckets:]
+    findings = []
+    if len(series) < 2:
+        return findings
+    window = max(int(len(series) * window_fraction), 1)
+    baseline = _median(b["latency_p50_ms"] for b in series[:window])
+    latest = _median(b["latency_p50_ms"] for b in series[-window:])
+    if baseline and latest and latest > baseline * (1 + max_latency_drift):
+        findings.append(
+            f"p50 latency drifted from {baseline:.3f}ms to {latest:.3f}ms "
+            f"(+{(latest / baseline - 1) * 100:.1f}%)"
+        )
+    for key in ["host_rss_bytes", "device_memory_bytes"]:
+        slope = _slope_per_hour(
+            [(b["end"] - series[0]["start"], b[key]) for b in series]
+        )
+        if slope is not None and slope > max_memory_growth_per_hour:
+            findings.append(
+                f"{key} growing by {slope / 1024**2:.1f}MiB per hour"
+            )
+    return findings
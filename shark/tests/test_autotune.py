@@ -0,0 +1,104 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+
+import shark.iree_utils.autotune_utils as autotune_utils
+from shark.iree_utils.autotune_utils import (
+    get_model_hash,
+    get_tuned_flags,
+    get_tuning_key,
+    is_improvement,
+    mann_whitney_u,
+    merge_tuned_flags,
+    override_flags,
+    parse_benchmark_samples,
+    save_tuning_result,
+)
+
+
+def test_override_flags():
+    args = ["--iree-llvmcpu-enable-ukernels", "--iree-opt-const-eval=true"]
+    overrides = ["--iree-llvmcpu-enable-ukernels=none"]
+    assert override_flags(args, overrides) == [
+        "--iree-opt-const-eval=true",
+        "--iree-llvmcpu-enable-ukernels=none",
+    ]
+    assert override_flags(args, None) == args
+
+
+def test_parse_benchmark_samples():
+    report = {
+        "benchmarks": [
+            {"run_type": "iteration", "real_time": 2000, "time_unit": "us"},
+            {"run_type": "iteration", "real_time": 3.0, "time_unit": "ms"},
+            {"run_type": "aggregate", "real_time": 2.5, "time_unit": "ms"},
+        ]
+    }
+    assert parse_benchmark_samples(json.dumps(report)) == [2.0, 3.0]
+
+
+def test_is_improvement():
+    best = [10.0 + 0.01 * i for i in range(20)]
+    assert is_improvement([9.0 + 0.01 * i for i in range(20)], best)
+    # Faster, but within the noise of the baseline.
+    noisy = [8.0 + 4.0 * (i % 2) for i in range(20)]
+    assert mann_whitney_u(noisy, best) > 0.05
+    assert not is_improvement(noisy, best)
+    # Significant, but below the minimum improvement.
+    assert not is_improvement([x - 0.1 for x in best], best)
+
+
+def test_tuned_flags_round_trip(tmp_path):
+    path = str(tmp_path / "autotune.json")
+    module = "module { }"
+    assert get_tuned_flags(module, "cpu", path) is None
+    key = get_tuning_key(get_model_hash(module), "cpu")
+    save_tuning_result(key, {"flags": ["--iree-opt-data-tiling"]}, path)
+    assert get_tuned_flags(module, "cpu", path) == ["--iree-opt-data-tiling"]
+    assert get_tuned_flags("module { func }", "cpu", path) is None
+
+
+def test_explicit_flags_win_over_tuned_flags():
+    args = ["--iree-opt-const-eval=true", "--iree-llvmcpu-enable-ukernels"]
+    tuned = [
+        "--iree-llvmcpu-enable-ukernels=none",
+        "--iree-opt-data-tiling=false",
+    ]
+    explicit = ["--iree-opt-data-tiling=true"]
+    assert merge_tuned_flags(args, tuned, explicit) == [
+        "--iree-opt-const-eval=true",
+        "--iree-llvmcpu-enable-ukernels=none",
+        "--iree-opt-data-tiling=true",
+    ]
+
+
+def test_model_hash_cached_per_file(tmp_path):
+    module = tmp_path / "model.mlir"
+    module.write_text("module { }")
+    first = get_model_hash(str(module))
+    assert get_model_hash(str(module)) == first
+    module.write_text("module { func }")
+    assert get_model_hash(str(module)) != first
+
+
+def test_no_hash_without_tuning_for_device(tmp_path, monkeypatch):
+    path = str(tmp_path / "autotune.json")
+    save_tuning_result("hash|rocm|gfx1100", {"flags": ["--x"]}, path)
+
+    def fail(module):
+        raise AssertionError("hashed the module")
+
+    monkeypatch.setattr(autotune_utils, "get_model_hash", fail)
+    assert get_tuned_flags("module { }", "cpu", path) is None
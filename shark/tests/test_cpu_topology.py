@@ -0,0 +1,129 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import pytest
+
+import shark.iree_utils.cpu_utils as cpu_utils
+from shark.iree_utils.cpu_topology import (
+    CpuTopology,
+    format_cpu_list,
+    get_runtime_cpus,
+)
+from shark.parser import shark_args
+
+
+def make_topology(tmp_path, cpu_max=None, cpus=None):
+    # Two sockets with 4 cores each and SMT, one NUMA node per socket.
+    # cpus 0-7 are the first threads of the cores, 8-15 their siblings.
+    cpu_dir = tmp_path / "cpu"
+    node_dir = tmp_path / "node"
+    cgroup_dir = tmp_path / "cgroup"
+    for cpu in range(16):
+        topology = cpu_dir / f"cpu{cpu}" / "topology"
+        topology.mkdir(parents=True)
+        (topology / "physical_package_id").write_text(str(cpu % 8 // 4))
+        (topology / "core_id").write_text(str(cpu % 4))
+    for node, cpulist in [(0, "0-3,8-11"), (1, "4-7,12-15")]:
+        (node_dir / f"node{node}").mkdir(parents=True)
+        (node_dir / f"node{node}" / "cpulist").write_text(cpulist)
+    cgroup_dir.mkdir()
+    if cpu_max is not None:
+        (cgroup_dir / "cpu.max").write_text(cpu_max)
+    return CpuTopology(
+        range(16) if cpus is None else cpus,
+        str(cpu_dir),
+        str(node_dir),
+        str(cgroup_dir),
+    )
+
+
+def test_group_count(tmp_path):
+    topology = make_topology(tmp_path)
+    assert topology.get_group_count() == 8
+    assert topology.get_group_count(topology.nodes[1]) == 4
+
+
+def test_cgroup_quota(tmp_path):
+    topology = make_topology(tmp_path, cpu_max="250000 100000")
+    assert topology.cpu_limit == 3
+    assert topology.get_group_count() == 3
+
+
+def test_affinity_and_local_node(tmp_path):
+    topology = make_topology(tmp_path, cpus=[1, 4, 5, 6, 12, 13])
+    assert topology.get_local_node() == 1
+    cpus = get_runtime_cpus(topology, numa_node="auto")
+    assert format_cpu_list(cpus) == "4-6,12-13"
+
+
+def test_replica_cpus(tmp_path):
+    topology = make_topology(tmp_path)
+    replicas = [topology.get_replica_cpus(i, 2) for i in range(2)]
+    assert format_cpu_list(replicas[0]) == "0-3,8-11"
+    assert format_cpu_list(replicas[1]) == "4-7,12-15"
+    cpus = get_runtime_cpus(topology, replica="1/4")
+    assert format_cpu_list(cpus) == "2-3,10-11"
+
+
+
+@pytest.fixture
+def cpu_caches():
+    cached = [
+        cpu_utils.get_cpu_topology,
+        cpu_utils.get_runtime_cpuset,
+        cpu_utils.get_iree_cpu_rt_args,
+    ]
+    for function in cached:
+        function.cache_clear()
+    yield
+    for function in cached:
+        function.cache_clear()
+
+
+def test_pin_cpu_runtime(tmp_path, monkeypatch, cpu_caches):
+    make_topology(tmp_path)
+    affinity = set(range(16))
+
+    def set_affinity(pid, cpus):
+        affinity.intersection_update(cpus)
+
+    monkeypatch.setattr(
+        cpu_utils,
+        "CpuTopology",
+        lambda: CpuTopology(
+            affinity,
+            str(tmp_path / "cpu"),
+            str(tmp_path / "node"),
+            str(tmp_path / "cgroup"),
+        ),
+    )
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(affinity))
+    monkeypatch.setattr(os, "sched_setaffinity", set_affinity)
+    monkeypatch.setattr(shark_args, "cpu_numa_node", None)
+    monkeypatch.setattr(shark_args, "cpu_replica", "1/2")
+    monkeypatch.setattr(shark_args, "task_topology_max_group_count", None)
+
+    # Reading the flags leaves the process affinity alone.
+    rt_args = cpu_utils.get_iree_cpu_rt_args()
+    assert rt_args == ["--task_topology_max_group_count=4"]
+    assert len(affinity) == 16
+    assert cpu_utils.get_cpu_count() == 16
+
+    cpus = cpu_utils.pin_cpu_runtime()
+    assert format_cpu_list(affinity) == format_cpu_list(cpus) == "4-7,12-15"
+    # The topology is read again after pinning.
+    assert cpu_utils.get_cpu_count() == 8
+    assert cpu_utils.pin_cpu_runtime() == cpus
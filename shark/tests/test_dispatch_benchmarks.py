@@ -0,0 +1,67 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+from shark.iree_utils.dispatch_benchmark_utils import (
+    create_dispatch_dirs,
+    parse_benchmark_json,
+    parse_cpu_list,
+    rank_dispatches,
+    select_dispatch_dirs,
+)
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list("0-2,5") == {0, 1, 2, 5}
+
+
+def test_parse_benchmark_json():
+    report = {
+        "benchmarks": [
+            {"aggregate_name": "mean", "real_time": 1500, "time_unit": "us"},
+            {"aggregate_name": "median", "real_time": 1.4, "time_unit": "ms"},
+        ]
+    }
+    times = parse_benchmark_json("log line\n" + json.dumps(report))
+    assert times == {"mean": 1.5, "median": 1.4}
+
+
+def test_rank_dispatches():
+    results = rank_dispatches(
+        [
+            {"dispatch": "a", "mean_ms": 1.0},
+            {"dispatch": "b", "error": "compile failed"},
+            {"dispatch": "c", "mean_ms": 3.0},
+        ]
+    )
+    assert [r["dispatch"] for r in results] == ["c", "a", "b"]
+    assert results[0]["time_share"] == 0.75
+
+
+def test_create_and_select_dispatch_dirs(tmp_path):
+    bench_dir = tmp_path / "bench"
+    tmp_dir = tmp_path / "temp_bench"
+    bench_dir.mkdir()
+    tmp_dir.mkdir()
+    for name in ["module_dispatch_1.mlir", "module_dispatch_12.mlir"]:
+        (bench_dir / name).write_text("")
+    (tmp_dir / "module_dispatch_12_benchmark.mlir").write_text("")
+    create_dispatch_dirs(str(bench_dir), "cpu")
+    assert os.path.isfile(
+        bench_dir / "module_dispatch_12" / "module_dispatch_12_benchmark.mlir"
+    )
+    assert select_dispatch_dirs(str(bench_dir), "1") == ["module_dispatch_1"]
+    assert len(select_dispatch_dirs(str(bench_dir), "All")) == 2
@@ -0,0 +1,94 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+import torch
+import torch.fx
+
+import shark.dynamo_backend.utils as dynamo_utils
+import shark.iree_utils.compile_utils as compile_utils
+from shark.dynamo_backend.utils import SharkBackend, to_torch
+
+
+def double(x):
+    return (x * 2,)
+
+
+class FakeRunner:
+    def __init__(self):
+        self.iree_compilation_module = {"forward": lambda x: x * 2}
+
+
+class FakeInference:
+    loaded = []
+
+    def __init__(self, mlir_module, device, mlir_dialect):
+        self.shark_runner = FakeRunner()
+
+    def load_module(self, path):
+        FakeInference.loaded.append(path)
+
+
+@pytest.fixture
+def compiles(monkeypatch):
+    compiles = []
+
+    def export(module, device, directory, dialect, module_name, **kwargs):
+        compiles.append(module_name)
+        path = f"{directory}/{module_name}.vmfb"
+        with open(path, "wb") as f:
+            f.write(module)
+        return path
+
+    FakeInference.loaded = []
+    monkeypatch.setattr(SharkBackend, "lower", lambda self, inputs: b"vmfb")
+    monkeypatch.setattr(compile_utils, "export_iree_module_to_vmfb", export)
+    monkeypatch.setattr(dynamo_utils, "SharkInference", FakeInference)
+    return compiles
+
+
+def make_backend(inputs, cache_dir):
+    return SharkBackend(
+        torch.fx.symbolic_trace(double), inputs, {"cache_dir": cache_dir}
+    )
+
+
+def test_second_backend_loads_cached_module(compiles, tmp_path):
+    inputs = (torch.ones(2, 3),)
+    first = make_backend(inputs, str(tmp_path))
+    assert len(compiles) == 1
+    second = make_backend(inputs, str(tmp_path))
+    # Same graph and inputs: loaded from disk without compiling again.
+    assert len(compiles) == 1
+    assert FakeInference.loaded[0] == FakeInference.loaded[1]
+    assert torch.equal(second(*inputs)[0], first(*inputs)[0])
+
+
+def test_new_input_shapes_get_their_own_module(compiles, tmp_path):
+    backend = make_backend((torch.ones(2, 3),), str(tmp_path))
+    x = torch.ones(4, 5)
+    assert torch.equal(backend(x)[0], x * 2)
+    assert len(compiles) == 2
+    assert len(set(FakeInference.loaded)) == 2
+    # Calls with the first shape still use the first module.
+    backend(torch.ones(2, 3))
+    assert len(compiles) == 2
+
+
+def test_to_torch_shares_memory():
+    value = np.arange(4, dtype=np.float32)
+    tensor = to_torch(value)
+    value[0] = 10
+    assert tensor[0] == 10
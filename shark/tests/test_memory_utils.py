@@ -0,0 +1,71 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import numpy as np
+import pytest
+
+from shark.iree_utils.memory_utils import (
+    DeviceMemoryBudgetError,
+    MemoryTracker,
+    parse_size,
+)
+
+
+class FakeAllocator:
+    def __init__(self):
+        self.statistics = {
+            "device_bytes_allocated": 0,
+            "device_bytes_freed": 0,
+        }
+
+
+class FakeDevice:
+    def __init__(self):
+        self.allocator = FakeAllocator()
+
+
+def test_parse_size():
+    assert parse_size("512mib") == 512 * 1024**2
+    assert parse_size("4GB") == 4 * 1000**3
+    assert parse_size("1024") == 1024
+    with pytest.raises(ValueError):
+        parse_size("lots")
+
+
+def test_invocation_accounting():
+    device = FakeDevice()
+    tracker = MemoryTracker(allocators=["caching"])
+    inputs = [np.zeros((4, 4), np.float32), np.zeros(8, np.int64)]
+    with tracker.invocation(device, "forward", inputs, True) as invocation:
+        device.allocator.statistics["device_bytes_allocated"] += 4096
+        invocation["outputs"] = [np.zeros(16, np.float32)]
+    report = tracker.report(device)
+    assert report["invocations"] == 1
+    assert report["host_to_device_bytes"] == 128
+    assert report["device_to_host_bytes"] == 64
+    assert report["allocations"] == {"caching": {"count": 3, "bytes": 192}}
+    assert report["allocator_pool_bytes"] == 4096
+    assert report["last_invocation"]["allocator_device_bytes_allocated"] == 4096
+
+
+def test_budget_fails_before_invocation():
+    device = FakeDevice()
+    tracker = MemoryTracker(budget_bytes="1kib")
+    inputs = [np.zeros(128, np.float32)]
+    with tracker.invocation(device, "forward", inputs, False) as invocation:
+        invocation["outputs"] = np.zeros(128, np.float32)
+    # The previous call's outputs count towards the next one.
+    with pytest.raises(DeviceMemoryBudgetError):
+        with tracker.invocation(device, "forward", inputs * 2, False):
+            pass
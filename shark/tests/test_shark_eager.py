@@ -0,0 +1,76 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import pytest
+import torch
+import torch.fx
+
+import shark.shark_eager.shark_eager as shark_eager
+from shark.shark_eager.shark_eager import SharkEagerModule
+
+
+def add_size(x):
+    # size() runs in torch and feeds an int into the compiled region.
+    return torch.mul(torch.add(x, x.size(0)), 2)
+
+
+class FakeModule:
+    def __init__(self, gm):
+        self.gm = gm
+
+    def __call__(self, function_name, inputs):
+        return self.gm(*[torch.from_numpy(x) for x in inputs]).numpy()
+
+
+@pytest.fixture(autouse=True)
+def module_cache():
+    shark_eager.clear_module_cache()
+    yield
+    shark_eager.clear_module_cache()
+
+
+def test_compile_failure_runs_region_in_torch(monkeypatch):
+    calls = []
+
+    def failing_backend(gm, inputs, device="cpu"):
+        calls.append(gm)
+        raise RuntimeError("unsupported op")
+
+    monkeypatch.setattr(shark_eager, "shark_backend", failing_backend)
+    module = SharkEagerModule(torch.fx.symbolic_trace(add_size))
+    x = torch.ones(3)
+    assert torch.equal(module(x), add_size(x))
+    assert torch.equal(module(x), add_size(x))
+    # The failure is cached, so the region isn't compiled again.
+    assert len(calls) == 1
+    assert shark_eager.module_cache_info()["failed"] == 1
+
+
+def test_non_tensor_inputs_become_constants(monkeypatch):
+    compiled = []
+
+    def backend(gm, inputs, device="cpu"):
+        compiled.append(gm)
+        return FakeModule(gm)
+
+    monkeypatch.setattr(shark_eager, "shark_backend", backend)
+    module = SharkEagerModule(torch.fx.symbolic_trace(add_size))
+    for size in [3, 3, 5]:
+        x = torch.ones(size)
+        assert torch.equal(module(x), add_size(x))
+    # One module per size, each taking only the tensor.
+    assert len(compiled) == 2
+    for gm in compiled:
+        placeholders = [n for n in gm.graph.nodes if n.op == "placeholder"]
+        assert len(placeholders) == 1
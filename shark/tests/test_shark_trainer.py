@@ -0,0 +1,83 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import numpy as np
+import torch
+
+from shark.shark_trainer import SharkTrainer
+
+
+class FakeDeviceArray:
+    """Stands in for a device array and counts reads back to the host."""
+
+    host_reads = 0
+
+    def __init__(self, value):
+        self.value = value
+
+    def __array__(self, dtype=None, copy=None):
+        FakeDeviceArray.host_reads += 1
+        return self.value
+
+
+class FakeRunner:
+    def __init__(self, num_state):
+        self.num_state = num_state
+        self.last_state = None
+
+    def run(self, function_name, inputs, send_to_host=True):
+        assert not send_to_host
+        state = inputs[: self.num_state]
+        if self.last_state is not None:
+            # The previous step's outputs are passed back unchanged.
+            assert all(a is b for a, b in zip(state, self.last_state))
+        self.last_state = [FakeDeviceArray(x.value + 1) for x in state]
+        return self.last_state
+
+
+def make_trainer():
+    model = torch.nn.Linear(2, 2)
+    trainer = SharkTrainer(model, (torch.ones(1, 2),))
+    trainer.shark_runner = FakeRunner(len(trainer.get_torch_params()))
+    trainer._to_device = lambda arrays: [FakeDeviceArray(x) for x in arrays]
+    return trainer
+
+
+def test_state_stays_on_device_between_steps():
+    trainer = make_trainer()
+    initial = [x.numpy().copy() for x in trainer.get_torch_params()]
+    FakeDeviceArray.host_reads = 0
+    state = trainer.train(num_iters=3)
+    # Only the final result is read back.
+    assert FakeDeviceArray.host_reads == len(initial)
+    for before, after in zip(initial, state):
+        np.testing.assert_allclose(after, before + 3)
+
+
+def test_checkpoint_every_writes_npz(tmp_path):
+    trainer = make_trainer()
+    initial = [x.numpy().copy() for x in trainer.get_torch_params()]
+    trainer.train(num_iters=4, checkpoint_every=2, checkpoint_dir=tmp_path)
+    names = trainer.get_torch_param_names()
+    assert sorted(os.listdir(tmp_path)) == [
+        "checkpoint_2.npz",
+        "checkpoint_4.npz",
+    ]
+    for step in [2, 4]:
+        saved = np.load(tmp_path / f"checkpoint_{step}.npz")
+        assert sorted(saved.files) == sorted(names)
+        for name, before in zip(names, initial):
+            np.testing.assert_allclose(saved[name], before + step)
@@ -0,0 +1,68 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from shark.stress_test_telemetry import (
+    StressTestTelemetry,
+    detect_regressions,
+    percentile,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def run(latency_fn, memory_fn, buckets=20):
+    clock = FakeClock()
+    telemetry = StressTestTelemetry(
+        "cpu", 0, bucket_seconds=60, memory_fn=memory_fn, clock=clock
+    )
+    for _ in range(buckets * 60):
+        latency = latency_fn(clock.now)
+        clock.now += 1
+        telemetry.record_latency(latency)
+    return telemetry.finish()
+
+
+def test_percentile():
+    values = sorted(range(101))
+    assert percentile(values, 0.5) == 50
+    assert percentile(values, 0.99) == 99
+    assert percentile([], 0.5) is None
+
+
+def test_buckets():
+    report = run(lambda t: 0.01, lambda: 1024, buckets=3)
+    assert len(report["series"]) == 3
+    assert report["iterations"] == 180
+    assert report["series"][0]["latency_p50_ms"] == 10
+    assert report["series"][0]["device_memory_bytes"] == 1024
+
+
+def test_stable_run_has_no_regressions():
+    report = run(lambda t: 0.01, lambda: 1024)
+    assert detect_regressions(report) == []
+
+
+def test_latency_drift_and_memory_growth():
+    memory = iter(range(0, 10**12, 64 * 1024**2))
+    report = run(lambda t: 0.01 + t * 1e-5, lambda: next(memory))
+    findings = detect_regressions(report)
+    assert len(findings) == 2
+    assert findings[0].startswith("p50 latency drifted")
+    assert "device_memory_bytes" in findings[1]
@@ -0,0 +1,54 @@
+# Copyright 2023 The Nod Team. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import threading
+
+from shark.iree_utils.trace import Tracer
+
+
+def test_disabled_tracer_records_nothing():
+    tracer = Tracer(enabled=False)
+    with tracer.span("invoke"):
+        pass
+    tracer.instant("marker")
+    assert tracer.stats() == {}
+
+
+def test_ring_buffer_and_stats():
+    tracer = Tracer(enabled=True, buffer_size=4)
+    for _ in range(10):
+        with tracer.span("invoke"):
+            pass
+    assert tracer.stats()["invoke"]["count"] == 4
+
+
+def test_chrome_trace_export(tmp_path):
+    tracer = Tracer(enabled=True)
+
+    def work():
+        with tracer.span("outer", function="main"):
+            tracer.instant("marker")
+            with tracer.span("inner"):
+                pass
+
+    worker = threading.Thread(target=work, name="worker")
+    worker.start()
+    worker.join()
+    path = tracer.export_chrome_trace(str(tmp_path / "trace.json"))
+    with open(path) as f:
+        events = json.load(f)["traceEvents"]
+    phases = sorted(e["ph"] for e in events)
+    assert phases == ["M", "X", "X", "i"]
+    assert any(e["args"].get("name") == "worker" for e in events)